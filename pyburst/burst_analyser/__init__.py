@@ -2,9 +2,11 @@ from . import burst_analyser
 from . import burst_tools
 from . import burst_pipeline
 from . import burst_testing
+from . import lum_file
 
 __all__ = ['burst_analyser',
            'burst_pipeline',
            'burst_tools',
            'burst_testing',
+           'lum_file',
            ]
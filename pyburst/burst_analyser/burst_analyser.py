@@ -3,9 +3,9 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import os
 
-from scipy import interpolate, integrate
+from scipy import interpolate
 from scipy.signal import argrelextrema
-from scipy.stats import linregress
+from numpy.lib.stride_tricks import sliding_window_view
 
 # kepler_grids
 from pyburst.burst_analyser import burst_tools
@@ -40,7 +40,7 @@ class BurstRun(object):
                  load_dumps=False, set_paramaters=None, auto_discard=False,
                  get_slopes=False, load_model_params=True, truncate_edd=False,
                  check_stable_burning=True, quick_discard=True,
-                 check_lumfile_monotonic=True):
+                 check_lumfile_monotonic=True, lum_float32=False):
         self.flags = {'lum_loaded': False,
                       'lum_does_not_exist': False,
                       'dumps_loaded': False,
@@ -70,6 +70,7 @@ class BurstRun(object):
                         'check_stable_burning': check_stable_burning,
                         'quick_discard': quick_discard,
                         'check_lumfile_monotonic': check_lumfile_monotonic,
+                        'lum_float32': lum_float32,
                         }
         self.check_options()
 
@@ -231,7 +232,8 @@ class BurstRun(object):
                                         source=self.source, basename=self.basename,
                                         save=self.options['save_lum'],
                                         reload=self.options['reload'],
-                                        check_monotonic=self.options['check_lumfile_monotonic'])
+                                        check_monotonic=self.options['check_lumfile_monotonic'],
+                                        float32=self.options['lum_float32'])
 
         if self.lum is None:
             self.flags['lum_does_not_exist'] = True
@@ -552,12 +554,15 @@ class BurstRun(object):
         """
         old_candidates = [0]
         candidates = self.get_lum_maxima()
+        check = None  # check all maxima on first pass
         count = 0
 
         while not np.array_equal(old_candidates, candidates):
             old_candidates = candidates
-            self.remove_shocks(candidates)
+            replaced = self.remove_shocks(candidates, check=check)
             candidates = self.get_lum_maxima()
+            check = self.get_shock_checks(candidates, old_maxima=old_candidates,
+                                          replaced=replaced)
 
             count += 1
             if count == self.parameters['max_shock_iterations']:
@@ -596,36 +601,93 @@ class BurstRun(object):
         maxima_i = argrelextrema(lum_cut[:, 1], np.greater)[0]
         return lum_cut[maxima_i]
 
-    def remove_shocks(self, maxima):
+    def remove_shocks(self, maxima, check=None):
         """Cut out convective shocks (extreme spikes in luminosity).
         Identifies spikes, and replaces them with interpolation from neighbours.
 
+        Returns lum indexes of replaced shocks
+
         parameters
         ----------
         maxima : nparray(n,2)
-            local maxima to check (t, lum)
+            local maxima to check (t, lum). Lum of shocks are updated in place
+        check : bool array (optional)
+            which maxima to check (default all)
         """
         self.remove_zeros()
         radius = self.parameters['shock_radius']
+        idxs = np.searchsorted(self.lum[:, 0], maxima[:, 0])
+        check = np.full(len(maxima), True) if check is None else np.array(check)
+
         # ----- Discard if maxima more than [tolerance] larger than all neighbours -----
-        for max_i in maxima:
-            t, lum = max_i
-            idx = np.searchsorted(self.lum[:, 0], t)
+        windows = sliding_window_view(self.lum[:, 1], 2*radius + 1)[idxs - radius]
+        new_lum = 0.5 * (windows[:, radius - 1] + windows[:, radius + 1])  # mean of two neighbours
+        shock = np.full(len(maxima), False)
+
+        while check.any():
+            shock[check] = self.is_shock(maxima[check, 1], windows[check])
+            check[:] = False
+
+            # replacing a shock lowers the left neighbours of following maxima
+            # (as if checked in order), which may make them shocks too
+            for step in range(1, radius + 1):
+                prev = np.searchsorted(idxs, idxs - step).clip(max=len(idxs) - 1)
+                update = ((idxs[prev] == idxs - step) & shock[prev]
+                          & (windows[:, radius - step] != new_lum[prev]))
+
+                windows[update, radius - step] = new_lum[prev[update]]
+                check |= update & ~shock
+
+        shock_i = np.where(shock)[0]
+        if len(shock_i) > 0 and not self.flags['shocks']:
+            self.printv('Shocks detected and removed: consider verifying'
+                        ' with self.plot(shocks=True)')
+            self.flags['shocks'] = True
 
-            left = self.lum[idx - radius: idx, 1]  # left neighbours
-            right = self.lum[idx + 1: idx + radius + 1, 1]  # right neighbours
-            neighbours = np.concatenate([left, right])
+        for i in shock_i:
+            self.shocks.append([idxs[i], maxima[i, 0], maxima[i, 1]])
 
-            if True in (lum > self.parameters['shock_frac'] * neighbours):
-                if not self.flags['shocks']:
-                    self.printv('Shocks detected and removed: consider verifying'
-                                ' with self.plot(shocks=True)')
-                    self.flags['shocks'] = True
+        self.lum[idxs[shock], 1] = new_lum[shock]
+        maxima[shock, 1] = new_lum[shock]
+        return idxs[shock]
 
-                new_lum = 0.5 * (left[-1] + right[0])  # mean of two neighbours
-                max_i[1] = new_lum
-                self.lum[idx, 1] = new_lum
-                self.shocks.append([idx, t, lum])
+    def is_shock(self, lum, windows):
+        """Returns bool array of which maxima are shocks:
+            more than [shock_frac] larger than any neighbour
+
+        parameters
+        ----------
+        lum : 1darray
+            lum of maxima, shape (n,)
+        windows : 2darray
+            lum of neighbourhoods centred on each maxima, shape (n, 2*shock_radius + 1)
+        """
+        radius = self.parameters['shock_radius']
+        neighbours = np.delete(windows, radius, axis=1)
+        return np.any(lum[:, np.newaxis] > self.parameters['shock_frac'] * neighbours,
+                      axis=1)
+
+    def get_shock_checks(self, maxima, old_maxima, replaced):
+        """Returns bool array of maxima to check for shocks on the next pass:
+            those that are new, or have a replaced shock in their neighbourhood
+            (all others had the same neighbourhood when last checked)
+
+        parameters
+        ----------
+        maxima : nparray(n,2)
+            current local maxima (t, lum)
+        old_maxima : nparray(m,2)
+            maxima of the last pass
+        replaced : 1darray
+            lum indexes of shocks replaced on the last pass
+        """
+        radius = self.parameters['shock_radius']
+        idxs = np.searchsorted(self.lum[:, 0], maxima[:, 0])
+        neighbourhoods = idxs[:, np.newaxis] + np.arange(-radius, radius + 1)
+
+        new = np.invert(np.isin(maxima[:, 0], old_maxima[:, 0]))
+        touched = np.isin(neighbourhoods, replaced).any(axis=1)
+        return new | touched
 
     def remove_zeros(self):
         """During shocks, kepler can also give zero luminosity (for some reason...)
@@ -641,18 +703,12 @@ class BurstRun(object):
         """Keep largest maxima within some time-window
         """
         t_radius = self.parameters['maxima_radius']
-        peaks = []
-
-        for maxi in self.candidates:
-            t, lum = maxi
-            i_left = np.searchsorted(self.lum[:, 0], t - t_radius)
-            i_right = np.searchsorted(self.lum[:, 0], t + t_radius)
-
-            maxx = np.max(self.lum[i_left:i_right, 1])
-            if maxx == lum:
-                peaks.append(maxi)
+        t = self.candidates[:, 0]
+        i_left = np.searchsorted(self.lum[:, 0], t - t_radius)
+        i_right = np.searchsorted(self.lum[:, 0], t + t_radius)
 
-        peaks = np.array(peaks)
+        maxx = burst_tools.window_max(self.lum[:, 1], i_left=i_left, i_right=i_right)
+        peaks = self.candidates[maxx == self.candidates[:, 1]]
         self.n_bursts = len(peaks)
         self.check_n_bursts()
         self.bursts['t_peak'] = peaks[:, 0]  # times of burst peaks (s)
@@ -703,29 +759,37 @@ class BurstRun(object):
         self.bursts['t_start'] = np.full(self.n_bursts, np.nan)
         self.bursts['t_start_i'] = np.zeros(self.n_bursts, dtype=int)
 
-        for burst in self.bursts.itertuples():
-            rise_steps = burst.t_peak_i - burst.t_pre_i
-            if rise_steps < self.parameters['min_rise_steps'] \
-                    or (burst.peak / burst.lum_pre) < self.parameters['peak_frac']:
-                self.printv(f'Excluding micro-burst at t={burst.t_peak:.0f} s '
-                            + f'({burst.t_peak/3600:.1f} hr)')
-                try:
-                    self.delete_burst(burst.Index)
-                except NoBursts:
-                    self.bursts['lum_start'] = np.nan
-                    return
-                continue
-
-            lum_slice = self.lum[burst.t_pre_i:burst.t_peak_i]
-            pre_lum = lum_slice[0, 1]
-            peak_lum = lum_slice[-1, 1]
-            start_lum = pre_lum + self.parameters['start_frac'] * (peak_lum - pre_lum)
-
-            slice_i = np.searchsorted(lum_slice[:, 1], start_lum)
-            t_start = lum_slice[slice_i, 0]
-            self.bursts.loc[burst.Index, 't_start'] = t_start
-            self.bursts.loc[burst.Index, 't_start_i'] = np.searchsorted(self.lum[:, 0], t_start)
+        t_peak = self.bursts['t_peak'].values
+        t_peak_i = self.bursts['t_peak_i'].values
+        t_pre_i = self.bursts['t_pre_i'].values
+
+        micro = ((t_peak_i - t_pre_i) < self.parameters['min_rise_steps']) \
+            | ((self.bursts['peak'].values / self.bursts['lum_pre'].values)
+               < self.parameters['peak_frac'])
+
+        for t in t_peak[micro]:
+            self.printv(f'Excluding micro-burst at t={t:.0f} s ({t/3600:.1f} hr)')
+        try:
+            self.delete_bursts(micro)
+        except NoBursts:
+            self.bursts['lum_start'] = np.nan
+            return
 
+        # ----- first point in rise (t_pre to t_peak) above start_lum -----
+        t_start_i = np.zeros(self.n_bursts, dtype=int)
+        for i, (i0, i1) in enumerate(zip(t_pre_i[~micro], t_peak_i[~micro])):
+            rise = self.lum[i0:i1, 1]
+            start_lum = rise[0] + self.parameters['start_frac'] * (rise[-1] - rise[0])
+            slice_i = np.searchsorted(rise, start_lum)
+
+            if slice_i == len(rise):
+                raise RuntimeError(f'Failed to find start of burst at '
+                                   f't={t_peak[~micro][i]:.0f} s')
+            t_start_i[i] = i0 + slice_i
+
+        t_start = self.lum[t_start_i, 0]
+        self.bursts['t_start'] = t_start
+        self.bursts['t_start_i'] = np.searchsorted(self.lum[:, 0], t_start)
         self.bursts['lum_start'] = self.lum[self.bursts['t_start_i'], 1]
 
     def get_burst_ends(self):
@@ -735,51 +799,68 @@ class BurstRun(object):
         self.bursts['t_end'] = np.full(self.n_bursts, np.nan)
         self.bursts['t_end_i'] = np.zeros(self.n_bursts, dtype=int)
 
-        for burst in self.bursts.itertuples():
-            lum_slice = self.lum[burst.t_peak_i:]
-            pre_lum = self.lum[burst.t_pre_i, 1]
-
-            peak_t, peak_lum = lum_slice[0]
-            lum_diff = peak_lum - pre_lum
-
-            time_from_peak = lum_slice[:, 0] - peak_t
-            threshold_lum = pre_lum + (self.parameters['end_frac'] * lum_diff)
-            thresh_i = np.where(lum_slice[:, 1] < threshold_lum)[0]
-
-            min_length_i = np.where(time_from_peak > self.parameters['min_length'])[0]
-            intersection = list(set(thresh_i).intersection(min_length_i))
-
-            if len(intersection) == 0:
-                if burst.Index == self.bursts.index[-1]:
-                    self.printv('File ends during burst. Discarding final burst')
-                    try:
-                        self.delete_burst(burst.Index)
-                    except NoBursts:
-                        self.bursts['lum_end'] = np.nan
-                        return
-                    continue
-                else:
-                    raise RuntimeError(f'Failed to find end of burst {burst.Index + 1}, '
-                                       + f't={peak_t:.0f} s ({peak_t/3600:.1f} hr)')
-            else:
-                end_i = np.min(intersection)
-                t_end = lum_slice[end_i, 0]
-                self.bursts.loc[burst.Index, 't_end'] = t_end
-                self.bursts.loc[burst.Index, 't_end_i'] = np.searchsorted(self.lum[:, 0], t_end)
+        t_peak_i = self.bursts['t_peak_i'].values
+        t_pre_i = self.bursts['t_pre_i'].values
+        n_lum = len(self.lum)
+
+        peak_t = self.lum[t_peak_i, 0]
+        peak_lum = self.lum[t_peak_i, 1]
+        pre_lum = self.lum[t_pre_i, 1]
+        threshold_lum = pre_lum + self.parameters['end_frac'] * (peak_lum - pre_lum)
 
+        # search up to the next peak, then the rest of the lightcurve if not found
+        window_ends = np.append(t_peak_i[1:], n_lum)
+        t_end_i = np.full(self.n_bursts, -1)
+
+        for i in range(self.n_bursts):
+            for i0, i1 in ((t_peak_i[i], window_ends[i]), (window_ends[i], n_lum)):
+                window = self.lum[i0:i1]
+                ended = (window[:, 1] < threshold_lum[i]) \
+                    & ((window[:, 0] - peak_t[i]) > self.parameters['min_length'])
+                if ended.any():
+                    t_end_i[i] = i0 + np.argmax(ended)
+                    break
+
+        not_ended = (t_end_i == -1)
+        if not_ended[:-1].any():
+            i = np.nonzero(not_ended)[0][0]
+            raise RuntimeError(f'Failed to find end of burst {self.bursts.index[i] + 1}, '
+                               + f't={peak_t[i]:.0f} s ({peak_t[i]/3600:.1f} hr)')
+        elif not_ended[-1]:
+            self.printv('File ends during burst. Discarding final burst')
+            try:
+                self.delete_bursts(not_ended)
+            except NoBursts:
+                self.bursts['lum_end'] = np.nan
+                return
+
+        t_end = self.lum[t_end_i[~not_ended], 0]
+        self.bursts['t_end'] = t_end
+        self.bursts['t_end_i'] = np.searchsorted(self.lum[:, 0], t_end)
         self.bursts['lum_end'] = self.lum[self.bursts['t_end_i'], 1]
 
     def delete_burst(self, burst_i):
         """Removes burst from self.bursts table
         """
-        self.bursts = self.bursts.drop(burst_i)
-        self.n_bursts -= 1
+        self.delete_bursts(self.bursts.index == burst_i)
+
+    def delete_bursts(self, mask):
+        """Removes all bursts in mask (bool array over rows of self.bursts)
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if not mask.any():
+            return
+
+        first_deleted = mask[0] and (self.bursts.index[0] == 0)
+        self.bursts = self.bursts[~mask]
+        self.n_bursts -= np.count_nonzero(mask)
 
         if self.n_bursts == 0:  # have deleted last burst
             self.print_warn('Discarded only burst')
             raise NoBursts
         # TODO: this won't catch if the second burst is also deleted after the first
-        if burst_i == 0:    # if deleting first burst, second burst has undefined dt
+        if first_deleted and (1 in self.bursts.index):
+            # if deleting first burst, second burst has undefined dt
             self.bursts.loc[1, 'dt'] = np.nan
 
     def identify_short_wait_bursts(self):
@@ -806,11 +887,15 @@ class BurstRun(object):
     def get_fluences(self):
         """Calculates burst fluences by integrating over burst luminosity
         """
-        self.bursts['fluence'] = np.zeros(self.n_bursts)
-        for burst in self.bursts.itertuples():
-            lum_slice = self.lum[burst.t_pre_i:burst.t_end_i]
-            self.bursts.loc[burst.Index, 'fluence'] = integrate.trapz(y=lum_slice[:, 1],
-                                                                      x=lum_slice[:, 0])
+        # cumulative trapezoid integral over whole lightcurve
+        t = self.lum[:, 0]
+        lum = self.lum[:, 1]
+        integral = np.concatenate([[0], np.cumsum(np.diff(t) * 0.5 * (lum[1:] + lum[:-1]))])
+
+        # integrate over lum[t_pre_i:t_end_i]
+        i_start = self.bursts['t_pre_i'].values.astype(int)
+        i_end = np.maximum(self.bursts['t_end_i'].values.astype(int) - 1, i_start)
+        self.bursts['fluence'] = integral[i_end] - integral[i_start]
 
     def identify_outliers(self):
         """Identify outlier bursts
@@ -878,13 +963,19 @@ class BurstRun(object):
             bursts_regress_full = self.clean_bursts(exclude_min_regress=False)
 
             if len(bursts_regress) > 0:
-                for bprop in self.regress_bprops:
-                    for burst in bursts_regress.itertuples():
-                        regress_slice = bursts_regress_full[burst.Index:]
-                        lin = linregress(regress_slice['n'], regress_slice[bprop])
-
-                        self.bursts.loc[burst.Index, f'slope_{bprop}'] = lin[0]
-                        self.bursts.loc[burst.Index, f'slope_{bprop}_err'] = lin[-1]
+                # regress all suffixes bursts_regress_full[i:] at once
+                slopes, errs = burst_tools.suffix_linregress(
+                                    bursts_regress_full['n'],
+                                    bursts_regress_full[self.regress_bprops])
+                # last row stands in for empty suffixes (nan slope)
+                empty = np.full((1, len(self.regress_bprops)), np.nan)
+                slopes = np.concatenate([slopes, empty])
+                errs = np.concatenate([errs, empty])
+                starts = np.minimum(bursts_regress.index.values, len(bursts_regress_full))
+
+                for i, bprop in enumerate(self.regress_bprops):
+                    self.bursts.loc[bursts_regress.index, f'slope_{bprop}'] = slopes[starts, i]
+                    self.bursts.loc[bursts_regress.index, f'slope_{bprop}_err'] = errs[starts, i]
             else:
                 too_few()
         finally:
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-import subprocess
 import os
 import sys
 import multiprocessing as mp
@@ -15,53 +14,63 @@ except ModuleNotFoundError:
 # pyburst
 from pyburst.misc import pyprint
 from pyburst.grids import grid_strings, grid_tools
+from pyburst.burst_analyser import lum_file
 
 MODELS_PATH = os.environ['KEPLER_MODELS']
 GRIDS_PATH = os.environ['KEPLER_GRIDS']
 
 # TODO: Move to kepler_tools.py?
 def load_lum(run, batch, source, basename='xrb', reload=False, save=True,
-             silent=True, check_monotonic=True):
-    """Attempts to load pre-extracted luminosity data, or load raw binary.
+             silent=True, check_monotonic=True, float32=False):
+    """Attempts to load cached luminosity data, or load raw binary.
     Returns [time (s), luminosity (erg/s)]
-    """
-    def load_save(load_filepath, save_filepath):
-        lum_loaded = extract_lcdata(filepath=load_filepath, silent=silent)
-        if save:
-            try:
-                save_ascii(lum=lum_loaded, filepath=save_filepath)
-            except FileNotFoundError:
-                print("Can't save preloaded luminosity file, path not found")
-        return lum_loaded
 
-    pyprint.print_dashes()
-    batch_str = grid_strings.get_batch_string(batch, source)
-    analysis_path = grid_strings.get_source_subdir(source, 'burst_analysis')
-    input_path = os.path.join(analysis_path, batch_str, 'input')
+    The cache is re-extracted if its binary (.lc) file has since changed.
+    Old .txt preload files are converted to the binary cache (and left in place)
 
-    presaved_filepath = os.path.join(input_path, f'{batch_str}_{run}.txt')
+    parameters
+    ----------
+    reload : bool
+        ignore any cached file, and re-extract from the binary
+    save : bool
+        save extracted luminosity to the cache
+    float32 : bool
+        cache luminosity as float32 (halving its size)
+    """
+    pyprint.print_dashes()
+    cache_filepath = get_lum_cache_filepath(run, batch, source)
+    ascii_filepath = get_lum_cache_filepath(run, batch, source, extension='.txt')
     run_str = grid_strings.get_run_string(run, basename)
     model_path = grid_strings.get_model_path(run, batch, source, basename)
     binary_filepath = os.path.join(model_path, f'{run_str}.lc')
     print(binary_filepath)
+
+    lum = None
+    cached = False
     if reload:
-        print('Deleting preloaded file, reloading binary file')
-        subprocess.run(['rm', '-f', presaved_filepath])
+        print('Ignoring cached luminosity file, reloading binary file')
+    else:
+        lum = load_lum_cache(cache_filepath, lc_filepath=binary_filepath,
+                             float32=float32)
+        cached = lum is not None
+        if (lum is None) and os.path.exists(ascii_filepath):
+            lum = load_legacy_ascii(ascii_filepath, lc_filepath=binary_filepath)
+
+    if lum is None:
+        print('Extracting luminosity from binary')
         try:
-            lum = load_save(binary_filepath, presaved_filepath)
+            lum = extract_lcdata(filepath=binary_filepath, silent=silent)
         except FileNotFoundError:
-            print('XXXXXXX lumfile not found. Skipping XXXXXXXX')
+            print('XXXXXXX lumfile not found. Skipping XXXXXXX')
             return
-    else:
-        try:
-            lum = load_ascii(presaved_filepath)
-        except (FileNotFoundError, OSError):
-            print('No preloaded file found. Reloading binary')
-            try:
-                lum = load_save(binary_filepath, presaved_filepath)
-            except FileNotFoundError:
-                print('XXXXXXX lumfile not found. Skipping XXXXXXX')
-                return
+
+    if float32:  # same values whether loaded from binary or cache
+        scale = lum_file.LUM_SCALE_32
+        lum[:, 1] = scale * (lum[:, 1] / scale).astype(np.float32).astype(np.float64)
+
+    if save and not cached:
+        save_lum_cache(lum, filepath=cache_filepath, lc_filepath=binary_filepath,
+                       float32=float32)
 
     if check_monotonic:
         dt = np.diff(lum[:, 0])
@@ -73,6 +82,71 @@ def load_lum(run, batch, source, basename='xrb', reload=False, save=True,
     return lum
 
 
+def get_lum_cache_filepath(run, batch, source, extension='.lum'):
+    """Returns filepath of cached luminosity file
+
+    extension : str
+        '.lum' for the binary cache, '.txt' for old ascii preload files
+    """
+    batch_str = grid_strings.get_batch_string(batch, source)
+    analysis_path = grid_strings.get_source_subdir(source, 'burst_analysis')
+    input_path = os.path.join(analysis_path, batch_str, 'input')
+    return os.path.join(input_path, f'{batch_str}_{run}{extension}')
+
+
+def load_lum_cache(filepath, lc_filepath, float32=False):
+    """Returns cached [time, lum], or None if missing, unreadable, or stale
+
+    lc_filepath : str
+        binary (.lc) file the cache was extracted from
+    float32 : bool
+        whether lum should be cached as float32
+    """
+    if not os.path.exists(filepath):
+        return None
+
+    try:
+        header, time, lum = lum_file.load(filepath)
+    except ValueError as e:
+        print(f'Invalid cached luminosity file ({e}). Reloading binary')
+        return None
+
+    if lum_file.is_stale(header, lc_filepath=lc_filepath):
+        print('Cached luminosity file is out of date. Reloading binary')
+        return None
+
+    lum_dtype = np.float32 if float32 else np.float64
+    if (lum.dtype != lum_dtype) and os.path.exists(lc_filepath):
+        print(f'Cached luminosity is {lum.dtype}, not {np.dtype(lum_dtype)}. '
+              'Reloading binary')
+        return None
+
+    print(f'Loading cached luminosity file: {filepath}')
+    return np.column_stack([time, header['lum_scale'] * lum.astype(np.float64)])
+
+
+def save_lum_cache(lum, filepath, lc_filepath, float32=False):
+    """Saves [time, lum] to the binary cache
+    """
+    print(f'Saving data for faster loading in: {filepath}')
+    try:
+        lum_file.save(filepath, lum=lum, lc_filepath=lc_filepath, float32=float32)
+    except FileNotFoundError:
+        print("Can't save cached luminosity file, path not found")
+
+
+def load_legacy_ascii(filepath, lc_filepath):
+    """Returns [time, lum] from an old .txt preload file,
+        or None if it is older than its binary (.lc) file
+    """
+    if (os.path.exists(lc_filepath)
+            and os.path.getmtime(filepath) < os.path.getmtime(lc_filepath)):
+        print('Preloaded file is older than binary. Reloading binary')
+        return None
+
+    return load_ascii(filepath)
+
+
 def load_ascii(filepath):
     """Loads pre-extracted .txt file of [time, lum]
     """
@@ -275,3 +349,88 @@ def snip_outliers(x, percentiles):
     """
     idxs = get_outlier_idxs(x, percentiles)
     return np.delete(x, idxs)
+
+
+def suffix_linregress(x, y):
+    """Returns slope and slope stderr of a linear regression of every suffix
+        x[i:], y[i:], for all i at once (equivalent to scipy.stats.linregress)
+
+    Suffixes with fewer than two points have nan slope/stderr
+
+    parameters
+    ----------
+    x : 1darray
+        shape (n,)
+    y : array
+        shape (n,) or (n, n_cols), regressing each column separately
+    returns
+    -------
+    slope, stderr : arrays with same shape as y
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    y_2d = y.reshape((len(x), -1))
+
+    # shift to the means, to avoid cancellation in the (co)variances
+    x = (x - np.mean(x))[:, np.newaxis]
+    y_2d = y_2d - np.mean(y_2d, axis=0)
+
+    def suffix_sum(a):
+        return np.cumsum(a[::-1], axis=0)[::-1]
+
+    n = suffix_sum(np.ones_like(x))
+    x_mean = suffix_sum(x) / n
+    y_mean = suffix_sum(y_2d) / n
+    ssxm = np.maximum(suffix_sum(x**2) / n - x_mean**2, 0)
+    ssym = np.maximum(suffix_sum(y_2d**2) / n - y_mean**2, 0)
+    ssxym = suffix_sum(x * y_2d) / n - x_mean * y_mean
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = ssxym / ssxm
+        r_den = np.sqrt(ssxm * ssym)
+        r = np.where(r_den == 0, 0.0, np.clip(ssxym / r_den, -1.0, 1.0))
+        stderr = np.sqrt((1 - r**2) * ssym / ssxm / (n - 2))
+
+    stderr[n[:, 0] == 2] = 0.0
+    slope[n[:, 0] < 2] = np.nan
+    stderr[n[:, 0] < 2] = np.nan
+    return slope.reshape(y.shape), stderr.reshape(y.shape)
+
+
+def window_max(x, i_left, i_right):
+    """Returns max of x[i_left:i_right] for each pair of window indexes
+
+    Uses running maxima over windows of doubling length (2, 4, 8, ...),
+    each from two strided copies of the last, so any non-empty window is
+    covered by two overlapping windows of the largest length that fits
+
+    parameters
+    ----------
+    x : 1darray
+    i_left : int array
+        window starts
+    i_right : int array
+        window ends (exclusive), must be > i_left
+    """
+    x = np.asarray(x)
+    i_left = np.asarray(i_left, dtype=int)
+    i_right = np.asarray(i_right, dtype=int)
+    maxima = np.zeros(len(i_left), dtype=x.dtype)
+
+    if len(i_left) == 0:
+        return maxima
+
+    levels = np.floor(np.log2(i_right - i_left)).astype(int)
+    running = x  # running[i] = max(x[i: i + 2**level])
+
+    for level in range(np.max(levels) + 1):
+        if level > 0:
+            width = 2**(level - 1)
+            running = np.maximum(running[:-width], running[width:])
+
+        mask = (levels == level)
+        left = i_left[mask]
+        right = i_right[mask] - 2**level
+        maxima[mask] = np.maximum(running[left], running[right])
+
+    return maxima
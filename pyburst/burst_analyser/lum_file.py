@@ -0,0 +1,81 @@
+import numpy as np
+import os
+
+from pyburst.misc import binary_file
+
+# =============================================================================
+# Binary cache of a model lightcurve, extracted from its kepler binary (.lc)
+#
+# Layout (see misc/binary_file.py):
+#   - a single line of JSON (the header). Holds the size and modification time
+#     of the source .lc file, and the dtype, shape and offset of each array
+#   - time (float64) and lum (float64, or float32) as raw bytes.
+#     float32 lum is stored in units of LUM_SCALE_32, as erg/s can exceed
+#     the float32 range (~3.4e38)
+#
+# Arrays are memory-mapped on load. A cache is stale if its source .lc file
+# has since changed (size or mtime)
+# =============================================================================
+FORMAT = 'pyburst_lum'
+FORMAT_VERSION = 1
+LUM_SCALE_32 = 1e30
+
+
+def save(filepath, lum, lc_filepath=None, float32=False):
+    """Saves lightcurve to file (atomically, replacing any existing file)
+
+    parameters
+    ----------
+    filepath : str
+    lum : nparray(n,2)
+        [time (s), luminosity (erg/s)]
+    lc_filepath : str (optional)
+        source .lc file, whose size and mtime are recorded
+    float32 : bool
+        store luminosity as float32 (time is always float64)
+    """
+    lum_dtype = np.float32 if float32 else np.float64
+    lum_scale = LUM_SCALE_32 if float32 else 1.0
+    arrays = {'time': np.asarray(lum[:, 0], dtype=np.float64),
+              'lum': np.asarray(lum[:, 1] / lum_scale, dtype=lum_dtype),
+              }
+    header = {'format': FORMAT,
+              'format_version': FORMAT_VERSION,
+              'source': get_source_stat(lc_filepath),
+              'lum_scale': lum_scale,
+              }
+    binary_file.save(filepath, header=header, arrays=arrays)
+
+
+def load(filepath, mmap=True):
+    """Returns header (dict), time and lum (read-only 1darrays) from file
+
+    Note: lum is in units of header['lum_scale'] (erg/s)
+
+    mmap : bool
+        memory-map arrays (instead of reading them into memory)
+    """
+    header, arrays = binary_file.load(filepath, fmt=FORMAT, fmt_version=FORMAT_VERSION,
+                                      mmap=mmap)
+    return header, arrays['time'], arrays['lum']
+
+
+def is_stale(header, lc_filepath):
+    """Returns True if the source .lc file has changed since the cache was saved
+
+    If the .lc file no longer exists, the cache can't be checked (so isn't stale)
+    """
+    source = get_source_stat(lc_filepath)
+    if source is None:
+        return False
+    return source != header['source']
+
+
+def get_source_stat(lc_filepath):
+    """Returns size (bytes) and mtime (ns) of .lc file (None if it doesn't exist)
+    """
+    if (lc_filepath is None) or (not os.path.exists(lc_filepath)):
+        return None
+
+    stat = os.stat(lc_filepath)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
@@ -111,8 +111,8 @@ def create_batch(batch, dv, source,
     params_full['y'] = 1 - params_full['x'] - params_full['z']  # helium-4 values
     params_full['geemult'] = params_full['mass'] / mass_ref  # Gravity multiplier
 
-    gravities = gravity.get_acceleration_newtonian(r=radius_ref,
-                                                   m=params_full['mass']).value
+    gravities = gravity.get_acceleration_newtonian_raw(r=radius_ref,
+                                                       m=np.array(params_full['mass']))
     params_full['radius'] = np.full(n_models, radius_ref)
     params_full['gravity'] = gravities
 
@@ -162,8 +162,8 @@ def combine_tables(source, burst_analyser=True, add_radius=True, radius=10,
     if add_gravity:
         masses = np.array(param_table['mass'])
         radii = np.array(param_table['radius'])
-        gravities = gravity.get_acceleration_newtonian(r=radii, m=masses)
-        param_table['gravity'] = gravities.value
+        gravities = gravity.get_acceleration_newtonian_raw(r=radii, m=masses)
+        param_table['gravity'] = gravities
 
     print('Combining summ and params tables')
     summ_table.drop(['batch', 'run'], axis=1, inplace=True)
@@ -1,6 +1,8 @@
+from . import emulator_file
 from . import interpolator
 from . import interp_versions
 
-__all__ = ['interpolator',
+__all__ = ['emulator_file',
+           'interpolator',
            'interp_versions'
            ]
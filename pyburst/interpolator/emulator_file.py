@@ -0,0 +1,72 @@
+import json
+import hashlib
+import numpy as np
+
+from pyburst.misc import binary_file
+
+# =============================================================================
+# Self-describing binary file of a Kemulator's interpolator data
+#
+# Layout (see misc/binary_file.py):
+#   - a single line of JSON (the header). Holds the metadata (source, version,
+#     bprops, param_keys, grid exclusions, hash of the grid tables, etc.),
+#     and the name, dtype, shape and offset of each array
+#   - each array as raw (C-order) bytes
+#
+# Arrays are memory-mapped on load, so opening a file costs the same for any
+# size of grid, and nothing depends on the installed scipy version
+# =============================================================================
+FORMAT = 'pyburst_emulator'
+FORMAT_VERSION = 1
+
+
+def save(filepath, meta, arrays):
+    """Saves metadata and arrays to file (atomically, replacing any existing file)
+
+    parameters
+    ----------
+    filepath : str
+    meta : dict
+        metadata (must be JSON-serialisable, numpy scalars/arrays allowed)
+    arrays : {name: ndarray}
+    """
+    header = {'format': FORMAT,
+              'format_version': FORMAT_VERSION,
+              'meta': meta,
+              }
+    binary_file.save(filepath, header=header, arrays=arrays)
+
+
+def load(filepath, mmap=True):
+    """Returns metadata (dict) and arrays (dict of read-only ndarray) from file
+
+    mmap : bool
+        memory-map arrays (instead of reading them into memory)
+    """
+    header, arrays = binary_file.load(filepath, fmt=FORMAT, fmt_version=FORMAT_VERSION,
+                                      mmap=mmap)
+    return header['meta'], arrays
+
+
+def load_meta(filepath):
+    """Returns only the metadata (dict) from file
+    """
+    header, _ = binary_file.load_header(filepath, fmt=FORMAT, fmt_version=FORMAT_VERSION)
+    return header['meta']
+
+
+def load_meta_json(meta):
+    """Returns meta as it would be loaded from file (i.e. after a JSON round-trip)
+    """
+    return json.loads(json.dumps(meta, default=binary_file.to_builtin))
+
+
+def get_table_hash(*arrays):
+    """Returns hash (hex str) of the contents of arrays
+    """
+    sha = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha.update(f'{array.dtype.str}{array.shape}'.encode())
+        sha.update(array.tobytes())
+    return sha.hexdigest()
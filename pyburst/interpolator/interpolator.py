@@ -1,13 +1,17 @@
 # standard
 import numpy as np
 from scipy.interpolate import LinearNDInterpolator
+import itertools
 import os
 import time
 import pickle
+import atexit
+import tempfile
 
 # kepler_grids
 from pyburst.grids import grid_tools, grid_strings, grid_versions
 from . import interp_versions
+from . import emulator_file
 
 GRIDS_PATH = os.environ['KEPLER_GRIDS']
 MODELS_PATH = os.environ['KEPLER_MODELS']
@@ -16,6 +20,10 @@ key_map = {'dt': 'tDel', 'u_dt': 'uTDel',
            'fluence': 'fluence', 'u_fluence': 'uFluence',
            'peak': 'peakLum', 'u_peak': 'uPeakLum'}
 
+# Arrays/interpolators shared through files (see Kemulator.share), by filepath.
+# Each process opens these once, no matter how many times it unpickles them
+_shared_cache = {}
+
 # TODO:
 #   - function to re-generate interpolator files
 
@@ -29,17 +37,31 @@ class Kemulator:
     verbose : bool
         print diagnostics
     re_interp: bool
-        setup interpolator
+        setup interpolator. Otherwise, loads the saved interpolator, which is
+        rebuilt (and saved) if missing or out of date with the grid tables
+    engine : str
+        interpolation method used when setting up interpolator, one of:
+            'delaunay' : scipy LinearNDInterpolator (triangulated). Default,
+                         as used for all existing mcmc versions
+            'regular'  : multilinear over the grid axes (see GridInterpolator).
+                         Falls back on 'delaunay' if the grid is incomplete.
+                         NOTE: gives different values than 'delaunay' between
+                         grid points, so lhoods aren't comparable across engines
     """
 
     def __init__(self, source, version, verbose=True, re_interp=True, burst_analyser=True,
-                 check_complete=True):
+                 check_complete=True, engine='delaunay'):
+        if engine not in ('regular', 'delaunay'):
+            raise ValueError(f"engine must be one of ('regular', 'delaunay'), not '{engine}'")
+
         self.verbose = verbose
         source = grid_strings.source_shorthand(source)
         self.source = source
         self.version = version
         self.burst_analyser = burst_analyser
+        self.engine = engine
         self.interpolator = None
+        self.shared_path = None
 
         summ = grid_tools.load_grid_table('summ', source=source, burst_analyser=burst_analyser)
         params = grid_tools.load_grid_table('params', source=source)
@@ -80,47 +102,140 @@ class Kemulator:
         reduced_idxs = grid_tools.reduce_table_idx(self.params, params=params)
         return self.summ.iloc[reduced_idxs]
 
+    def __getstate__(self):
+        """Pickled state, which excludes the grid tables (only needed for setup),
+        and, if shared, the interpolator itself
+        """
+        state = self.__dict__.copy()
+        state['summ'] = None
+        state['params'] = None
+        if state.get('shared_path') is not None:
+            state['interpolator'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.interpolator is None and self.shared_path is not None:
+            self.interpolator = load_shared(self.shared_path, loader=pickle_load)
+
+    def get_interpolator_filepath(self, label=''):
+        filename = f'interpolator_{self.source}_V{self.version}{label}'
+        return os.path.join(GRIDS_PATH, 'sources', self.source,
+                            'interpolator', filename)
+
+    def share(self):
+        """Moves interpolator data into a file that worker processes attach to
+
+        Pickling the Kemulator (e.g., to send to a multiprocessing pool) then only
+        passes the file location. The file is unique to this process (so
+        concurrent runs of a version don't collide), and is removed on exit.
+
+        For engine='regular', the value grid is memory-mapped, so workers share
+        the same (read-only) memory.
+
+        NOTE: a LinearNDInterpolator (engine='delaunay', or an incomplete grid)
+        is NOT shared in memory. Its triangulation is a qhull object, which can't
+        be rebuilt over memory-mapped arrays, so each worker process unpickles its
+        own copy from the file (once, however many times the Kemulator is sent to
+        it), and memory still grows with the number of workers. Only workers
+        forked after share() start with the parent's copy (copy-on-write)
+        """
+        if isinstance(self.interpolator, GridInterpolator):
+            filepath = self.get_shared_filepath(suffix='.npy')
+            self.interpolator.share(filepath)
+        else:
+            filepath = self.get_shared_filepath(suffix='.pickle')
+            with open(filepath, 'wb') as f:
+                pickle.dump(self.interpolator, f)
+            _shared_cache[filepath] = self.interpolator
+            self.shared_path = filepath
+
+        self.printv(f'Shared interpolator: {filepath}')
+
+    def get_shared_filepath(self, suffix):
+        """Returns path of a new, empty file to share the interpolator through
+        (see share), which is removed when this process exits
+        """
+        prefix = os.path.basename(self.get_interpolator_filepath(label='_shared_'))
+        path = os.path.dirname(self.get_interpolator_filepath())
+        fd, filepath = tempfile.mkstemp(suffix=suffix, prefix=prefix, dir=path)
+        os.close(fd)
+        atexit.register(remove_shared, filepath)
+        return filepath
+
+    def get_meta(self, points, values):
+        """Returns metadata describing the interpolator, for the emulator file
+        """
+        return {'source': self.source,
+                'version': self.version,
+                'bprops': list(self.bprops),
+                'param_keys': list(self.version_def.param_keys),
+                'grid_version': self.version_def.grid_version,
+                'exclude_any': self.grid_def.exclude_any,
+                'exclude_all': self.grid_def.exclude_all,
+                'burst_analyser': self.burst_analyser,
+                'n_models': len(values),
+                'table_hash': emulator_file.get_table_hash(np.column_stack(points),
+                                                           values),
+                }
+
     def save_interpolator(self):
-        """Saves (pickles) interpolator to file
+        """Saves interpolator data to file (see emulator_file.py)
         """
-        self.printv(f'Saving interpolator')
-        filename = f'interpolator_{self.source}_V{self.version}'
-        filepath = os.path.join(GRIDS_PATH, 'sources', self.source,
-                                'interpolator', filename)
+        filepath = self.get_interpolator_filepath(label='.emu')
         self.printv(f'Saving interpolator: {filepath}')
-        pickle.dump(self.interpolator, open(filepath, 'wb'))
+        points, values = self.get_points_values(self.bprops)
+        arrays = {'points': np.column_stack(points), 'values': values}
+
+        if isinstance(self.interpolator, GridInterpolator):
+            for i, axis in enumerate(self.interpolator.axes):
+                arrays[f'axis_{i}'] = axis
+            arrays['grid'] = self.interpolator.grid
+
+        emulator_file.save(filepath, meta=self.get_meta(points, values), arrays=arrays)
 
     def load_interpolator(self):
-        """Loads previously-saved (pickled) interpolators from file
+        """Loads previously-saved interpolator from file
+
+        If the file is missing, or doesn't match the current grid tables
+        and version definitions, the interpolator is rebuilt and saved
         """
-        self.printv(f'Loading interpolator')
-        filename = f'interpolator_{self.source}_V{self.version}'
-        filepath = os.path.join(GRIDS_PATH, 'sources', self.source,
-                                'interpolator', filename)
-        self.interpolator = pickle.load(open(filepath, 'rb'))
+        filepath = self.get_interpolator_filepath(label='.emu')
+        self.printv(f'Loading interpolator: {filepath}')
 
-    def setup_interpolator(self, bprops):
-        """Creates interpolator object from kepler grid data
+        if not os.path.exists(filepath):
+            self.printv('No interpolator file found, rebuilding')
+            self.setup_interpolator(self.bprops, save=True)
+            return
 
-        bprops : [str]
-            burst properties to interpolate (e.g., dt, fluence)
-        """
-        self.printv('Creating interpolator on grid: ')
-        points = []
+        points, values = self.get_points_values(self.bprops)
+        saved_meta = emulator_file.load_meta(filepath)
+        current_meta = emulator_file.load_meta_json(self.get_meta(points, values))
 
-        for param in self.version_def.param_keys:
-            param_points = np.array(self.params[param])
-            points += [param_points]
-            self.printv(f'{param}:  {np.unique(param_points)}')
+        stale = [key for key in current_meta if saved_meta.get(key) != current_meta[key]]
+        if len(stale) > 0:
+            self.printv(f'Interpolator file out of date ({", ".join(stale)}), rebuilding')
+            self.setup_interpolator(self.bprops, save=True)
+            return
 
-        points = tuple(points)
-        n_models = len(self.params)
-        n_bprops = len(bprops)
-        values = np.full((n_models, n_bprops), np.nan)
-        self.printv(f'Number of models: {n_models}')
+        meta, arrays = emulator_file.load(filepath)
+        n_dim = len(meta['param_keys'])
 
-        t0 = time.time()
-        self.printv(f'Creating interpolator:')
+        if (self.engine == 'regular') and ('grid' in arrays):
+            axes = [arrays[f'axis_{i}'] for i in range(n_dim)]
+            self.interpolator = GridInterpolator.from_grid(axes, arrays['grid'])
+        else:
+            self.build_interpolator(tuple(arrays['points'].T), arrays['values'])
+
+    def get_points_values(self, bprops):
+        """Returns grid points (tuple of arrays, one per param) and burst values
+
+        bprops : [str]
+            burst properties to interpolate (e.g., dt, fluence)
+        """
+        points = tuple(np.array(self.params[param])
+                       for param in self.version_def.param_keys)
+        values = np.full((len(self.params), len(bprops)), np.nan)
 
         for i, bp in enumerate(bprops):
             if not self.burst_analyser:
@@ -128,10 +243,46 @@ class Kemulator:
             else:
                 key = bp
             values[:, i] = np.array(self.summ[key])  # * 0.9
-        self.interpolator = LinearNDInterpolator(points, values)
+
+        return points, values
+
+    def setup_interpolator(self, bprops, save=False):
+        """Creates interpolator object from kepler grid data
+
+        bprops : [str]
+            burst properties to interpolate (e.g., dt, fluence)
+        save : bool
+            save interpolator to file
+        """
+        self.printv('Creating interpolator on grid: ')
+        points, values = self.get_points_values(bprops)
+
+        for param, param_points in zip(self.version_def.param_keys, points):
+            self.printv(f'{param}:  {np.unique(param_points)}')
+        self.printv(f'Number of models: {len(values)}')
+
+        t0 = time.time()
+        self.printv(f'Creating interpolator:')
+        self.build_interpolator(points, values)
         t1 = time.time()
         self.printv(f'Setup time: {t1-t0:.1f} s')
 
+        if save:
+            self.save_interpolator()
+
+    def build_interpolator(self, points, values):
+        """Sets up interpolator over the given points and values
+        """
+        engine = self.engine
+        if engine == 'regular' and not self.is_complete():
+            self.printv("Model grid incomplete, falling back on engine='delaunay'")
+            engine = 'delaunay'
+
+        if engine == 'regular':
+            self.interpolator = GridInterpolator(points, values)
+        else:
+            self.interpolator = LinearNDInterpolator(points, values)
+
     def emulate_burst(self, params):
         """Returns interpolated burst properties for given params
 
@@ -140,6 +291,16 @@ class Kemulator:
         # check_params_length(params, length=len(self.version_def.param_keys))
         return self.interpolator(params)
 
+    def is_complete(self):
+        """Returns True if model grid contains every combination of param_keys
+        """
+        product = 1
+        for param in self.version_def.param_keys:
+            product *= len(np.unique(self.params[param]))
+
+        unique = self.params.drop_duplicates(subset=self.version_def.param_keys)
+        return product == len(self.params) == len(unique)
+
     def check_completeness(self):
         """Checks for completeness of model grid, and raises an error if incomplete
         """
@@ -157,6 +318,153 @@ class Kemulator:
                                "Use arg check_complete=False to disable this check.")
 
 
+class GridInterpolator:
+    """Multilinear interpolator over a complete (Cartesian-product) model grid
+
+    Drop-in replacement for LinearNDInterpolator when every combination of
+    the grid parameters exists. Values are stored as a dense N-D array over
+    the unique values of each axis, and points are located with a binary
+    search per axis, instead of a simplex search over a triangulation.
+    Points outside the grid return NaN.
+
+    An axis with a single value is not interpolated over (points must match
+    that value exactly, otherwise they are outside the grid).
+
+    parameters
+    ----------
+    points : tuple(1darray)
+        parameter values of each model, one array per axis
+    values : 2darray
+        values to interpolate, shape (n_models, n_values)
+    """
+
+    def __init__(self, points, values):
+        self.axes = [np.unique(p) for p in points]
+        self.n_dim = len(self.axes)
+        values = np.asarray(values, dtype=float)
+        self.n_values = values.shape[1]
+
+        shape = tuple(len(axis) for axis in self.axes)
+        if np.prod(shape) != len(values):
+            raise ValueError(f'Grid is not complete! Expected {np.prod(shape)} points, '
+                             f'but only have {len(values)}')
+
+        grid_idxs = tuple(np.searchsorted(axis, p)
+                          for axis, p in zip(self.axes, points))
+        self.grid = np.full(shape + (self.n_values,), np.nan)
+        self.grid[grid_idxs] = values
+
+        self.corners = get_corners(self.axes)
+        self.shared_path = None
+
+    @classmethod
+    def from_grid(cls, axes, grid):
+        """Returns interpolator from existing grid axes and dense value grid
+        (e.g. as saved by Kemulator.save_interpolator), without copying the grid
+        """
+        interp = cls.__new__(cls)
+        interp.axes = [np.asarray(axis) for axis in axes]
+        interp.n_dim = len(interp.axes)
+        interp.grid = grid
+        interp.n_values = grid.shape[-1]
+        interp.corners = get_corners(interp.axes)
+        interp.shared_path = None
+        return interp
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared_path is not None:
+            state['grid'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('shared_path', None)
+        self.__dict__.update(state)
+        if self.grid is None:
+            self.grid = load_shared(self.shared_path, loader=memmap_load)
+
+    def share(self, filepath):
+        """Saves grid to file, and replaces it with a read-only memory-map of it.
+        Pickled copies then attach to the file instead of copying the grid
+        """
+        tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        with open(tmp_filepath, 'wb') as f:
+            np.save(f, self.grid)
+        os.replace(tmp_filepath, filepath)
+
+        _shared_cache.pop(filepath, None)
+        self.grid = load_shared(filepath, loader=memmap_load)
+        self.shared_path = filepath
+
+    def __call__(self, params):
+        """Returns interpolated values at params, shape (..., n_dim)
+        """
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        out_shape = params.shape[:-1] + (self.n_values,)
+        params = params.reshape((-1, self.n_dim))
+        n_points = len(params)
+
+        lower_idxs = np.empty((n_points, self.n_dim), dtype=int)
+        fracs = np.empty((n_points, self.n_dim))
+        outside = np.zeros(n_points, dtype=bool)
+
+        for i, axis in enumerate(self.axes):
+            x = params[:, i]
+            outside |= np.invert((x >= axis[0]) & (x <= axis[-1]))
+
+            if len(axis) == 1:  # single-valued axis, not interpolated over
+                lower_idxs[:, i] = 0
+                fracs[:, i] = 0.0
+                continue
+
+            idx = np.searchsorted(axis, x, side='right') - 1
+            idx = np.clip(idx, 0, len(axis) - 2)
+            lower_idxs[:, i] = idx
+            fracs[:, i] = (x - axis[idx]) / (axis[idx + 1] - axis[idx])
+
+        output = np.zeros((n_points, self.n_values))
+        for corner in self.corners:
+            weights = np.prod(np.where(corner, fracs, 1 - fracs), axis=1)
+            idxs = lower_idxs + corner
+            output += weights[:, np.newaxis] * self.grid[tuple(idxs.T)]
+
+        output[outside] = np.nan
+        return output.reshape(out_shape)
+
+
+def get_corners(axes):
+    """Returns offsets of the corners of a grid cell, shape (n_corners, n_dim)
+    (single-valued axes have no offset)
+    """
+    offsets = [(0, 1) if len(axis) > 1 else (0,) for axis in axes]
+    return np.array(list(itertools.product(*offsets)))
+
+
+def load_shared(filepath, loader):
+    """Returns shared array/object from file, only loading it once per process
+    """
+    if filepath not in _shared_cache:
+        _shared_cache[filepath] = loader(filepath)
+    return _shared_cache[filepath]
+
+
+def remove_shared(filepath):
+    """Removes shared file (if it still exists)
+    """
+    _shared_cache.pop(filepath, None)
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+
+def memmap_load(filepath):
+    return np.load(filepath, mmap_mode='r')
+
+
+def pickle_load(filepath):
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
+
+
 def check_params_length(params, length=5):
     """Checks that five parameters have been provided
     """
@@ -1,16 +1,28 @@
+from . import autocorr
 from . import burstfit
+from . import chain_stats
+from . import chain_store
 from . import mcmc
 from . import mcmc_jobs
 from . import mcmc_plot
 from . import mcmc_tools
 from . import mcmc_versions
+from . import ptsampler
+from . import reweight
 from . import sample
+from . import telemetry
 
-__all__ = ['burstfit',
+__all__ = ['autocorr',
+           'burstfit',
+           'chain_stats',
+           'chain_store',
            'mcmc',
            'mcmc_jobs',
            'mcmc_plot',
            'mcmc_tools',
            'mcmc_versions',
+           'ptsampler',
+           'reweight',
            'sample',
+           'telemetry',
            ]
@@ -0,0 +1,255 @@
+import numpy as np
+
+# =============================================================================
+# Streaming estimates of the integrated autocorrelation time (tau) of a chain
+#
+# Uses blocking (batch means): for blocks of B steps, the variance of the block
+# means is var * tau / B, once B >> tau (it is biased low for B ~ tau).
+#
+# The mean (and mean square) of each block of block_size steps is kept, per
+# walker. Once max_blocks are held, neighbouring pairs are merged and
+# block_size doubles, so memory is fixed, and each step is O(1) (amortised),
+# without keeping or re-reading the chain.
+#
+# Because blocks are kept in order, the burn-in can be discarded afterwards
+# (to within block_size steps). tau is then taken from the smallest block
+# size B (a power of 2 times block_size) that is self-consistent, i.e.
+# B >= window * tau, with at least min_blocks blocks per walker.
+# The burn-in (burn_factor * tau) is itself iterated to self-consistency
+# =============================================================================
+
+
+class AutocorrTracker:
+    """Running autocorrelation time and effective sample size of an emcee chain
+
+    parameters
+    ----------
+    n_walkers : int
+    n_dim : int
+    min_blocks : int
+        minimum number of blocks (per walker) needed to use a block size
+    window : float
+        minimum block size, in units of tau
+    max_blocks : int
+        number of blocks kept (per walker) before merging, must be even.
+        Memory use is 2 * max_blocks * n_walkers * n_dim floats
+    burn_factor : float
+        burn-in discarded before estimating tau, as burn_factor * max(tau)
+    """
+
+    def __init__(self, n_walkers, n_dim, min_blocks=4, window=10, max_blocks=128,
+                 burn_factor=2):
+        if max_blocks % 2 != 0:
+            raise ValueError(f'max_blocks ({max_blocks}) must be even')
+
+        self.n_walkers = n_walkers
+        self.n_dim = n_dim
+        self.min_blocks = min_blocks
+        self.window = window
+        self.max_blocks = max_blocks
+        self.burn_factor = burn_factor
+        self.n_steps = 0
+        self.tau_last = np.full(n_dim, np.nan)  # tau at last call of check()
+        self.converged = False
+
+        shape = (n_walkers, n_dim)
+        self.block_size = 1
+        self.n_blocks = 0  # completed blocks
+        self.means = np.zeros((max_blocks,) + shape)    # mean of each block
+        self.sqmeans = np.zeros((max_blocks,) + shape)  # mean square of each block
+        self.n_partial = 0  # steps in current (incomplete) block
+        self.partial_sum = np.zeros(shape)
+        self.partial_sumsq = np.zeros(shape)
+
+    def __repr__(self):
+        return (f'AutocorrTracker: n_steps={self.n_steps}'
+                + f'\ntau : {self.get_tau()}')
+
+    def update(self, pos):
+        """Adds a single step of walker positions, shape (n_walkers, n_dim)
+        """
+        pos = np.array(pos, dtype=float)
+        self.n_steps += 1
+        self.n_partial += 1
+        self.partial_sum += pos
+        self.partial_sumsq += pos**2
+
+        if self.n_partial == self.block_size:
+            self.means[self.n_blocks] = self.partial_sum / self.block_size
+            self.sqmeans[self.n_blocks] = self.partial_sumsq / self.block_size
+            self.n_blocks += 1
+            self.n_partial = 0
+            self.partial_sum[:] = 0
+            self.partial_sumsq[:] = 0
+
+            if self.n_blocks == self.max_blocks:
+                self.merge_blocks()
+
+    def merge_blocks(self):
+        """Merges neighbouring pairs of blocks, doubling block_size
+        """
+        half = self.n_blocks // 2
+        for array in (self.means, self.sqmeans):
+            array[:half] = 0.5 * (array[0:2*half:2] + array[1:2*half:2])
+
+        self.n_blocks = half
+        self.block_size *= 2
+
+    def update_chain(self, chain):
+        """Adds multiple steps, shape (n_walkers, n_steps, n_dim)
+        """
+        for i in range(chain.shape[1]):
+            self.update(chain[:, i, :])
+
+    def get_kept_blocks(self, discard):
+        """Returns means and mean squares of blocks after discarding
+        (at least) the first discard steps
+        """
+        first = int(np.ceil(discard / self.block_size))
+        return self.means[first:self.n_blocks], self.sqmeans[first:self.n_blocks]
+
+    def get_tau(self, discard=None):
+        """Returns current estimate of tau (in steps) for each parameter
+
+        Uses the smallest block size B with B >= window * tau, and at least
+        min_blocks blocks. Returns NaN while the chain is too short for this
+
+        discard : int (optional)
+            steps to discard as burn-in (default: see get_burn_in)
+        """
+        if discard is None:
+            discard = self.get_burn_in()
+        nan = np.full(self.n_dim, np.nan)
+        if discard is None:
+            return nan
+
+        means, sqmeans = self.get_kept_blocks(discard)
+        size = self.block_size
+
+        while len(means) >= self.min_blocks:
+            # variances are about the mean of all walkers (not of each walker), as
+            # a single walker's mean over a few tau soaks up most of the block variance
+            mean = np.mean(means, axis=(0, 1))
+            var0 = np.mean(sqmeans, axis=(0, 1)) - mean**2
+            if np.any(var0 <= 0):
+                return nan
+
+            var_block = np.mean((means - mean)**2, axis=(0, 1))
+            tau = np.maximum(size * var_block / var0, 1.0)
+            if size >= self.window * np.max(tau):
+                return tau
+
+            # combine pairs into blocks of twice the size (dropping the oldest if odd)
+            odd = len(means) % 2
+            means = 0.5 * (means[odd::2] + means[odd + 1::2])
+            sqmeans = 0.5 * (sqmeans[odd::2] + sqmeans[odd + 1::2])
+            size *= 2
+
+        return nan
+
+    def get_ess(self, discard=None):
+        """Returns effective sample size (over all walkers) for each parameter,
+        after discarding burn-in
+
+        discard : int (optional)
+            steps to discard as burn-in (default: see get_burn_in)
+        """
+        if discard is None:
+            discard = self.get_burn_in()
+        if discard is None:
+            return np.full(self.n_dim, np.nan)
+
+        means, _ = self.get_kept_blocks(discard)
+        n_steps = len(means) * self.block_size
+        return self.n_walkers * n_steps / self.get_tau(discard=discard)
+
+    def get_burn_in(self, burn_factor=None, max_iter=10):
+        """Returns recommended number of steps to discard (burn_factor * max tau),
+        with tau estimated after discarding this burn-in.
+        Returns None while tau can't be estimated
+
+        Starts from no burn-in, or, if tau can't be estimated over the whole
+        chain (e.g. it is dominated by the initial transient), from half the chain
+
+        burn_factor : float (optional)
+            default: self.burn_factor
+        max_iter : int
+            maximum iterations towards a self-consistent burn-in
+        """
+        if burn_factor is None:
+            burn_factor = self.burn_factor
+
+        for burn_in in (0, self.n_steps // 2):
+            tau = self.get_tau(discard=burn_in)
+            if not np.isnan(tau).any():
+                break
+        else:
+            return None
+
+        for i in range(max_iter):
+            new_burn_in = int(np.ceil(burn_factor * np.max(tau)))
+            if new_burn_in == burn_in:
+                break
+
+            tau = self.get_tau(discard=new_burn_in)
+            if np.isnan(tau).any():
+                break
+            burn_in = new_burn_in
+
+        return burn_in
+
+    def check(self, n_tau=50, tol=0.01):
+        """Returns True if chain has converged, i.e. is longer than n_tau * tau
+        after burn-in, and tau has changed by less than tol (fractional)
+        since the last check
+        """
+        burn_in = self.get_burn_in()
+        tau = self.get_tau(discard=burn_in)
+        change = np.abs(tau - self.tau_last) / tau
+        self.tau_last = tau
+
+        if np.isnan(change).any():
+            return False
+        return ((self.n_steps - burn_in >= n_tau * np.max(tau))
+                and (np.max(change) < tol))
+
+    def get_state(self, prefix='autocorr_'):
+        """Returns tracker state as dict of arrays (e.g. to save in a checkpoint)
+        """
+        return {f'{prefix}n_steps': self.n_steps,
+                f'{prefix}min_blocks': self.min_blocks,
+                f'{prefix}window': self.window,
+                f'{prefix}burn_factor': self.burn_factor,
+                f'{prefix}tau_last': self.tau_last,
+                f'{prefix}block_size': self.block_size,
+                f'{prefix}means': self.means[:self.n_blocks],
+                f'{prefix}sqmeans': self.sqmeans[:self.n_blocks],
+                f'{prefix}max_blocks': self.max_blocks,
+                f'{prefix}n_partial': self.n_partial,
+                f'{prefix}partial_sum': self.partial_sum,
+                f'{prefix}partial_sumsq': self.partial_sumsq,
+                }
+
+    @classmethod
+    def from_state(cls, state, prefix='autocorr_'):
+        """Returns tracker restored from get_state()
+        """
+        means = np.array(state[f'{prefix}means'])
+        partial_sum = np.array(state[f'{prefix}partial_sum'])
+        n_walkers, n_dim = partial_sum.shape
+
+        tracker = cls(n_walkers=n_walkers, n_dim=n_dim,
+                      min_blocks=int(state[f'{prefix}min_blocks']),
+                      window=float(state[f'{prefix}window']),
+                      max_blocks=int(state[f'{prefix}max_blocks']),
+                      burn_factor=float(state[f'{prefix}burn_factor']))
+        tracker.n_steps = int(state[f'{prefix}n_steps'])
+        tracker.tau_last = np.array(state[f'{prefix}tau_last'])
+        tracker.block_size = int(state[f'{prefix}block_size'])
+        tracker.n_blocks = len(means)
+        tracker.means[:len(means)] = means
+        tracker.sqmeans[:len(means)] = state[f'{prefix}sqmeans']
+        tracker.n_partial = int(state[f'{prefix}n_partial'])
+        tracker.partial_sum = partial_sum
+        tracker.partial_sumsq = np.array(state[f'{prefix}partial_sumsq'])
+        return tracker
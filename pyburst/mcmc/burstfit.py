@@ -10,7 +10,6 @@ import functools
 # pyburst
 from pyburst.interpolator import interpolator
 from .mcmc_versions import McmcVersion
-from pyburst.mcmc.mcmc_tools import print_params
 from pyburst.misc import pyprint
 from pyburst.synth import synth
 from pyburst.physics import gravity
@@ -43,6 +42,22 @@ def default_plt_options():
 
 default_plt_options()
 
+# Methods traced when debug=True, and the stage they're timed under when profile=True
+# (methods are only wrapped when enabled, so have no overhead otherwise)
+debug_methods = ('lhood', 'lhood_batch', 'lnprior', 'get_epoch_params',
+                 'get_interp_param', 'transform_aliases', 'interpolate',
+                 'get_frame_factors', 'shift_to_observer', 'compare')
+
+profile_stages = {'lhood': 'total',
+                  'lhood_batch': 'total',
+                  'lnprior': 'prior',
+                  'get_epoch_params': 'epochs',
+                  'interpolate': 'interpolate',
+                  'get_frame_factors': 'frame_shift',
+                  'shift_to_observer': 'frame_shift',
+                  'compare': 'compare',
+                  }
+
 # TODO: Docstrings
 
 class BurstFit:
@@ -52,18 +67,28 @@ class BurstFit:
     def __init__(self, source, version, verbose=True,
                  lhood_factor=1, debug=False, priors_only=False,
                  re_interp=False, u_fper_frac=0.0, zero_lhood=-np.inf,
-                 reference_mass=1.4, reference_radius=10, **kwargs):
+                 reference_mass=1.4, reference_radius=10, profile=False,
+                 blobs=False, **kwargs):
         """
         reference_mass : float
             mass (Msun) that 'g' factor is relative to (i.e. mass used in Kepler)
         reference_radius : float
             Newtonian radius (km) used in Kepler
+        debug : bool
+            trace calls of the likelihood methods (slow)
+        profile : bool
+            record time spent in each stage of the likelihood (see print_profile).
+            Only records calls made in this process
+        blobs : bool
+            lhood (and lhood_batch) also return derived quantities of each sample,
+            as a flat array (emcee "blobs"). See get_blob_fields for the layout
         """
         self.source = source
         self.source_obs = obs_source_map.get(self.source, self.source)
         self.version = version
         self.verbose = verbose
         self.debug = pyprint.Debugger(debug=debug)
+        self.profiler = pyprint.Profiler() if profile else None
         self.mcmc_version = McmcVersion(source=source, version=version)
         self.param_idxs = {}
         self.interp_idxs = {}
@@ -81,11 +106,18 @@ class BurstFit:
         self.has_m_gr = 'm_gr' in self.mcmc_version.param_keys
 
         self.kpc_to_cm = u.kpc.to(u.cm)
+        self.setup_frame_constants()
         self.zero_lhood = zero_lhood
         self.u_fper_frac = u_fper_frac
         self.lhood_factor = lhood_factor
         self.priors_only = priors_only
 
+        # evaluation counters, e.g. for mcmc telemetry. Evaluations in a
+        # worker pool are added by the parent process (see count_evals)
+        self.n_evals = 0
+        self.n_rejected_prior = 0   # outside prior bounds
+        self.n_rejected_interp = 0  # outside interpolator grid (NaN)
+
         if self.mcmc_version.synthetic:
             interp_source = self.mcmc_version.interp_source
         else:
@@ -99,17 +131,74 @@ class BurstFit:
         self.n_epochs = None
         self.obs_data = None
         self.extract_obs_values()
+        self.check_obs_lengths()
+
+        self.epoch_idxs = None
+        self.setup_epoch_idxs()
+
+        self.return_blobs = blobs
+        self.blob_slices = {}
+        self.n_blob = None
+        self.setup_blob_slices()
 
         self.z_prior = None
         self.xi_ratio_prior = None
         self.inc_prior = None
         self.d_b_prior = None
         self.setup_priors()
+        self.setup_wrappers()
+
+    def __getstate__(self):
+        """Excludes debug/profile wrappers (can't be pickled), which are re-applied
+        on unpickling
+        """
+        state = self.__dict__.copy()
+        for name in debug_methods:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.setup_wrappers()
 
     def printv(self, string, **kwargs):
         if self.verbose:
             print(string, **kwargs)
 
+    def setup_wrappers(self):
+        """Wraps likelihood methods for debug tracing and/or profiling, if enabled
+        """
+        if self.profiler is not None:
+            for name, stage in profile_stages.items():
+                count_samples = {'lhood': lambda params, **kw: 1,
+                                 'lhood_batch': lambda params, **kw: len(params),
+                                 }.get(name)
+                method = self.profiler.wrap(getattr(self, name), stage=stage,
+                                            count_samples=count_samples)
+                setattr(self, name, method)
+
+        if self.debug.debug:
+            for name in debug_methods:
+                setattr(self, name, self.debug.trace(getattr(self, name), name=name))
+
+    def print_profile(self):
+        """Prints table of time spent in each stage of the likelihood
+        """
+        if self.profiler is None:
+            raise ValueError('Profiling not enabled, use profile=True')
+        self.profiler.print_table()
+
+    def check_obs_lengths(self):
+        """Checks that all observed burst properties have a value for each epoch
+        """
+        keys = ['fper', 'u_fper']
+        for bprop in self.mcmc_version.bprops:
+            keys += [bprop, f'u_{bprop}']
+
+        for key in keys:
+            pyprint.check_same_length(self.obs_data[key], np.arange(self.n_epochs),
+                                      f'obs {key} and n_epochs')
+
     def get_param_indexes(self):
         """Extracts indexes of parameters
 
@@ -124,11 +213,56 @@ class BurstFit:
 
         self.debug.end_function()
 
+    def setup_epoch_idxs(self):
+        """Pre-computes indexes of params for each epoch's interpolator inputs,
+        such that epoch_params = params[..., epoch_idxs]
+        """
+        n_interp = len(self.mcmc_version.interp_keys)
+        self.epoch_idxs = np.zeros((self.n_epochs, n_interp), dtype=int)
+
+        for i in range(self.n_epochs):
+            for j, key in enumerate(self.mcmc_version.interp_keys):
+                self.epoch_idxs[i, j] = self.get_interp_param_idx(key, epoch_idx=i)
+
+    def get_blob_fields(self):
+        """Returns list of [name, shape] of the derived quantities in each blob
+
+        model burst properties (observer frame), per epoch, for each bprop and fper,
+        followed by redshift (1+z), mass_ratio (M_GR/M_NW), lnprior,
+        and the lhood contribution of each bprop (lhood_<bprop>)
+        """
+        fields = []
+        for bprop in tuple(self.mcmc_version.bprops) + ('fper',):
+            fields += [[bprop, [self.n_epochs]]]
+        for key in ('redshift', 'mass_ratio', 'lnprior'):
+            fields += [[key, []]]
+        for bprop in tuple(self.mcmc_version.bprops) + ('fper',):
+            fields += [[f'lhood_{bprop}', []]]
+        return fields
+
+    def setup_blob_slices(self):
+        """Pre-computes the slice of each blob field in the flat blob array
+        """
+        i0 = 0
+        for name, shape in self.get_blob_fields():
+            size = int(np.prod(shape))
+            self.blob_slices[name] = slice(i0, i0 + size)
+            i0 += size
+        self.n_blob = i0
+
+    def setup_frame_constants(self):
+        """Pre-computes constants (as plain floats, cgs) used in get_frame_factors()
+        """
+        r_ref = self.reference_radius
+        self.c2 = gravity.c_cgs**2
+        self.zeta_ref = gravity.get_zeta_raw(r=r_ref, m=1.0)  # GM/Rc^2 per Msun
+        self.g_ref = gravity.get_acceleration_newtonian_raw(r=r_ref, m=1.0)  # per Msun
+
     def setup_priors(self):
         self.debug.start_function('setup_priors')
-        self.z_prior = self.mcmc_version.prior_pdfs['z']
-        self.xi_ratio_prior = self.mcmc_version.prior_pdfs['xi_ratio']
-        self.d_b_prior = self.mcmc_version.prior_pdfs['d_b']
+        self.z_prior = self.mcmc_version.prior_lnpdfs['z']
+        self.xi_ratio_prior = self.mcmc_version.prior_lnpdfs['xi_ratio']
+        self.d_b_prior = self.mcmc_version.prior_lnpdfs['d_b']
         self.debug.end_function()
 
     def extract_obs_values(self):
@@ -165,6 +299,8 @@ class BurstFit:
     def lhood(self, params, plot=False):
         """Return lhood for given params
 
+        If self.return_blobs, returns (lhood, blob), see get_blob_fields()
+
         Parameters
         ----------
         params : ndarray
@@ -172,28 +308,30 @@ class BurstFit:
         plot : bool
             whether to plot the comparison
         """
-        self.debug.start_function('lhood')
-        if self.debug.debug:
-            print_params(params, source=self.source, version=self.version)
+        blob = None
+        if self.return_blobs:
+            blob = np.full(self.n_blob, np.nan)
 
         # ===== check priors =====
+        self.n_evals += 1
         lp = self.lnprior(params=params)
+        if blob is not None:
+            blob[self.blob_slices['lnprior']] = lp
+
         if self.priors_only:
-            self.debug.end_function()
-            return lp * self.lhood_factor
+            return self.lhood_output(lp * self.lhood_factor, blob)
 
         if lp == self.zero_lhood:
-            self.debug.end_function()
-            return self.zero_lhood * self.lhood_factor
+            self.n_rejected_prior += 1
+            return self.lhood_output(self.zero_lhood * self.lhood_factor, blob)
 
         # ===== interpolate bursts from model params =====
         epoch_params = self.get_epoch_params(params)
         interp = self.interpolate(interp_params=epoch_params)
 
         if True in np.isnan(interp):
-            self.debug.print_('Outside interpolator bounds')
-            self.debug.end_function()
-            return self.zero_lhood * self.lhood_factor
+            self.n_rejected_interp += 1
+            return self.lhood_output(self.zero_lhood * self.lhood_factor, blob)
 
         n_bprops = len(self.mcmc_version.bprops) + 1
         if plot:
@@ -205,6 +343,7 @@ class BurstFit:
             fig = ax = None
 
         # ===== compare model burst properties against observed =====
+        factors = self.get_frame_factors(params)
         lh = 0.0
         for i, bprop in enumerate(self.mcmc_version.bprops):
             u_bprop = f'u_{bprop}'
@@ -215,13 +354,19 @@ class BurstFit:
             for j, key in enumerate([bprop, u_bprop]):
                 col = bprop_col + j
                 interp[:, col] = self.shift_to_observer(values=interp[:, col],
-                                                        bprop=key, params=params)
+                                                        bprop=key, params=params,
+                                                        factors=factors)
             model = interp[:, bprop_col]
             u_model = interp[:, u_bprop_col]
 
-            lh += self.compare(model=model, u_model=u_model,
-                               obs=self.obs_data[bprop], bprop=bprop,
-                               u_obs=self.obs_data[u_bprop], label=bprop)
+            lh_bprop = self.compare(model=model, u_model=u_model,
+                                    obs=self.obs_data[bprop], bprop=bprop,
+                                    u_obs=self.obs_data[u_bprop], label=bprop)
+            lh += lh_bprop
+            if blob is not None:
+                blob[self.blob_slices[bprop]] = model
+                blob[self.blob_slices[f'lhood_{bprop}']] = lh_bprop
+
             if plot:
                 self.plot_compare(model=model, u_model=u_model, obs=self.obs_data[bprop],
                                   u_obs=self.obs_data[u_bprop], bprop=bprop,
@@ -230,28 +375,156 @@ class BurstFit:
 
         # ===== compare predicted persistent flux with observed =====
         fper = self.shift_to_observer(values=epoch_params[:, self.interp_idxs['mdot']],
-                                      bprop='fper', params=params)
+                                      bprop='fper', params=params, factors=factors)
         u_fper = fper * self.u_fper_frac  # Assign uncertainty to model persistent flux
 
-        lh += self.compare(model=fper, u_model=u_fper, label='fper',
-                           obs=self.obs_data['fper'], bprop='fper',
-                           u_obs=self.obs_data['u_fper'])
+        lh_fper = self.compare(model=fper, u_model=u_fper, label='fper',
+                               obs=self.obs_data['fper'], bprop='fper',
+                               u_obs=self.obs_data['u_fper'])
+        lh += lh_fper
 
         lhood = (lp + lh) * self.lhood_factor
 
+        if blob is not None:
+            blob[self.blob_slices['fper']] = fper
+            blob[self.blob_slices['lhood_fper']] = lh_fper
+            blob[self.blob_slices['redshift']] = factors['redshift']
+            blob[self.blob_slices['mass_ratio']] = factors['mass_ratio']
+
         if plot:
             self.plot_compare(model=fper, u_model=u_fper, bprop='fper',
                               obs=self.obs_data['fper'], u_obs=self.obs_data['u_fper'],
                               ax=ax[n_bprops - 1], display=False,
                               xlabel=True)
             plt.show(block=False)
-            self.debug.end_function()
             return lhood, fig
         else:
-            self.debug.end_function()
-            return lhood
+            return self.lhood_output(lhood, blob)
+
+    def lhood_output(self, lhood, blob):
+        """Returns lhood, or (lhood, blob) if self.return_blobs
+        """
+        if self.return_blobs:
+            return lhood, blob
+        return lhood
+
+    def lhood_value(self, output):
+        """Returns lhood from the output of lhood() or lhood_batch(),
+        i.e. without the blobs if self.return_blobs (see lhood_output)
+        """
+        if self.return_blobs:
+            return output[0]
+        return output
+
+    def count_evals(self, lnprior, lhood):
+        """Adds evaluations made elsewhere (e.g. in a worker pool) to the
+        evaluation counters, from their lnprior and returned lhood
+
+        lnprior : 1darray
+            lnprior of each evaluated walker (see lnprior)
+        lhood : 1darray
+            lhood returned for each walker (without blobs)
+        """
+        outside_prior = (lnprior == self.zero_lhood)
+        rejected = (lhood == self.zero_lhood * self.lhood_factor)
+
+        self.n_evals += len(lhood)
+        self.n_rejected_prior += np.count_nonzero(outside_prior)
+        if not self.priors_only:
+            self.n_rejected_interp += np.count_nonzero(rejected & ~outside_prior)
+
+    def lhood_batch(self, params):
+        """Return lhood for a batch of params (e.g. every walker in a step)
+
+        Vectorised equivalent of lhood(): all rows are evaluated together,
+        using a single stacked interpolator query.
+        If self.return_blobs, returns (lhood, blobs), with blobs of
+        shape (n_walkers, n_blob), see get_blob_fields()
+
+        Parameters
+        ----------
+        params : ndarray
+            shape (n_walkers, n_dim), columns ordered as in "param_keys"
+        """
+        params = np.atleast_2d(params)
+        n_walkers = len(params)
+
+        blobs = None
+        if self.return_blobs:
+            blobs = np.full((n_walkers, self.n_blob), np.nan)
+
+        # ===== check priors =====
+        self.n_evals += n_walkers
+        lp = self.lnprior(params=params)
+        if blobs is not None:
+            blobs[:, self.blob_slices['lnprior']] = lp[:, np.newaxis]
 
-    def shift_to_observer(self, values, bprop, params):
+        if self.priors_only:
+            return self.lhood_output(lp * self.lhood_factor, blobs)
+
+        lhood = np.full(n_walkers, self.zero_lhood, dtype=float)
+        idxs = np.where(lp != self.zero_lhood)[0]
+        self.n_rejected_prior += n_walkers - len(idxs)
+        if len(idxs) == 0:
+            return self.lhood_output(lhood * self.lhood_factor, blobs)
+
+        # ===== interpolate bursts from model params =====
+        epoch_params = self.get_epoch_params(params[idxs])
+        n_interp = epoch_params.shape[-1]
+        interp = self.interpolate(interp_params=epoch_params.reshape(-1, n_interp))
+        interp = interp.reshape((len(idxs), self.n_epochs, -1))
+
+        in_bounds = np.invert(np.isnan(interp).any(axis=(1, 2)))
+        self.n_rejected_interp += len(idxs) - np.count_nonzero(in_bounds)
+        idxs = idxs[in_bounds]
+        interp = interp[in_bounds]
+        epoch_params = epoch_params[in_bounds]
+
+        # param columns of shape (n_walkers, 1), to broadcast against epochs
+        columns = params[idxs].T[:, :, np.newaxis]
+        factors = self.get_frame_factors(columns)
+
+        # ===== compare model burst properties against observed =====
+        lh = np.zeros(len(idxs))
+        for i, bprop in enumerate(self.mcmc_version.bprops):
+            u_bprop = f'u_{bprop}'
+            bprop_col = 2*i
+            u_bprop_col = bprop_col + 1
+
+            # ===== shift values to observer frame and units =====
+            model = self.shift_to_observer(values=interp[:, :, bprop_col],
+                                           bprop=bprop, params=columns, factors=factors)
+            u_model = self.shift_to_observer(values=interp[:, :, u_bprop_col],
+                                             bprop=u_bprop, params=columns, factors=factors)
+
+            lh_bprop = self.compare(model=model, u_model=u_model,
+                                    obs=self.obs_data[bprop], bprop=bprop,
+                                    u_obs=self.obs_data[u_bprop], label=bprop)
+            lh += lh_bprop
+            if blobs is not None:
+                blobs[idxs, self.blob_slices[bprop]] = model
+                blobs[idxs, self.blob_slices[f'lhood_{bprop}']] = lh_bprop[:, np.newaxis]
+
+        # ===== compare predicted persistent flux with observed =====
+        fper = self.shift_to_observer(values=epoch_params[:, :, self.interp_idxs['mdot']],
+                                      bprop='fper', params=columns, factors=factors)
+        u_fper = fper * self.u_fper_frac
+
+        lh_fper = self.compare(model=fper, u_model=u_fper, label='fper',
+                               obs=self.obs_data['fper'], bprop='fper',
+                               u_obs=self.obs_data['u_fper'])
+        lh += lh_fper
+
+        if blobs is not None:
+            blobs[idxs, self.blob_slices['fper']] = fper
+            blobs[idxs, self.blob_slices['lhood_fper']] = lh_fper[:, np.newaxis]
+            blobs[idxs, self.blob_slices['redshift']] = factors['redshift']
+            blobs[idxs, self.blob_slices['mass_ratio']] = factors['mass_ratio']
+
+        lhood[idxs] = lp[idxs] + lh
+        return self.lhood_output(lhood * self.lhood_factor, blobs)
+
+    def shift_to_observer(self, values, bprop, params, factors=None):
         """Returns burst property shifted to observer frame/units
 
         Parameters
@@ -261,7 +534,11 @@ class BurstFit:
         bprop : str
             name of burst property being converted/calculated
         params : 1darray
-            parameters (see param_keys)
+            parameters (see param_keys). For a batch of walkers, give param
+            columns of shape (n_dim, n_walkers, 1) (see lhood_batch)
+        factors : dict (optional)
+            frame factors of params, as returned by get_frame_factors().
+            If not provided, will be calculated from params
 
 
         Notes
@@ -269,66 +546,86 @@ class BurstFit:
         In special case bprop='fper', 'values' must be local accrate
                 as fraction of Eddington rate.
         """
-        def gr_factors():
-            mass_nw = self.reference_mass * params[self.param_idxs['g']]
-
-            if self.has_m_gr:
-                mass_gr = params[self.param_idxs['m_gr']]
-                m_ratio = mass_gr / mass_nw
-                red = gravity.gr_corrections(r=self.reference_radius, m=mass_nw,
-                                             phi=m_ratio)[1]
-            else:
-                red = params[self.param_idxs['redshift']]
-                g_nw = gravity.get_acceleration_newtonian(r=self.reference_radius, m=mass_nw)
-                mass_gr = gravity.mass(g=g_nw, redshift=red).value
-                m_ratio = mass_gr / mass_nw
-
-            return m_ratio, red
-
-        # TODO: cache other reused values
-        self.debug.start_function('shift_to_observer')
-        mass_ratio, redshift = gr_factors()
+        if factors is None:
+            factors = self.get_frame_factors(params)
+
+        mass_ratio = factors['mass_ratio']
+        redshift = factors['redshift']
 
         if bprop in ('dt', 'u_dt'):
             shifted = values * redshift / 3600
         elif bprop in ('rate', 'u_rate'):
             shifted = values / redshift
+        elif bprop in ('fluence', 'u_fluence'):  # (erg) --> (erg / cm^2)
+            shifted = (values * mass_ratio) / (4*np.pi * factors['flux_factor_b'])
+
+        elif bprop in ('peak', 'u_peak'):  # (erg/s) --> (erg / cm^2 / s)
+            shifted = (values * mass_ratio) / (redshift * 4*np.pi * factors['flux_factor_b'])
+
+        elif bprop in 'fper':  # mdot --> (erg / cm^2 / s)
+            lum_acc = values * mdot_edd * factors['phi']
+            shifted = (lum_acc * mass_ratio) / (redshift * 4*np.pi * factors['flux_factor_p'])
         else:
-            if self.has_two_f:  # model uses generalised flux_factors xi*d^2 (x10^45)
-                flux_factor_b = 1e45 * params[self.param_idxs['f_b']]
-                flux_factor_p = 1e45 * params[self.param_idxs['f_p']]
-            elif self.has_one_f:
-                flux_factor_b = 1e45 * params[self.param_idxs['f']]
-                flux_factor_p = flux_factor_b
-            elif self.has_xi_ratio:
-                flux_factor_b = (self.kpc_to_cm * params[self.param_idxs['d_b']])**2
-                flux_factor_p = flux_factor_b * params[self.param_idxs['xi_ratio']]
-            else:
-                xi_b = params[self.param_idxs['xi_b']]
-                xi_p = params[self.param_idxs['xi_p']]
-
-                d = params[self.param_idxs['d']]
-                d *= u.kpc.to(u.cm)
-                flux_factor_p = xi_p * d**2
-                flux_factor_b = xi_b * d**2
-
-            if bprop in ('fluence', 'u_fluence'):  # (erg) --> (erg / cm^2)
-                shifted = (values * mass_ratio) / (4*np.pi * flux_factor_b)
-
-            elif bprop in ('peak', 'u_peak'):  # (erg/s) --> (erg / cm^2 / s)
-                shifted = (values * mass_ratio) / (redshift * 4*np.pi * flux_factor_b)
-
-            elif bprop in 'fper':  # mdot --> (erg / cm^2 / s)
-                phi = (redshift - 1) * c.value ** 2 / redshift  # gravitational potential
-                lum_acc = values * mdot_edd * phi
-                shifted = (lum_acc * mass_ratio) / (redshift * 4*np.pi * flux_factor_p)
-            else:
-                raise ValueError('bprop must be one of (dt, u_dt, rate, u_rate, '
-                                 + 'fluence, u_fluence, '
-                                 + 'peak, u_peak, fper)')
-        self.debug.end_function()
+            raise ValueError('bprop must be one of (dt, u_dt, rate, u_rate, '
+                             + 'fluence, u_fluence, '
+                             + 'peak, u_peak, fper)')
         return shifted
 
+    def get_frame_factors(self, params):
+        """Returns factors for shifting model values to the observer frame
+
+        Calculated once per set of params, and shared by each bprop in shift_to_observer()
+
+        Returns dict of:
+            mass_ratio : M_GR / M_NW
+            redshift : (1+z)
+            flux_factor_b, flux_factor_p : burst/persistent flux factors (xi*d^2, cm^2)
+            phi : gravitational potential (erg/g), (1+z - 1) c^2 / (1+z)
+
+        Parameters
+        ----------
+        params : 1darray
+            parameters (see param_keys). Can also be columns (see shift_to_observer)
+        """
+        mass_nw = self.reference_mass * params[self.param_idxs['g']]
+
+        if self.has_m_gr:
+            mass_gr = params[self.param_idxs['m_gr']]
+            mass_ratio = mass_gr / mass_nw
+            redshift = gravity.gr_correction_factors(zeta=self.zeta_ref * mass_nw,
+                                                     phi=mass_ratio)[1]
+        else:
+            redshift = params[self.param_idxs['redshift']]
+            g_nw = self.g_ref * mass_nw
+            mass_gr = gravity.mass_raw(g=g_nw, redshift=redshift)
+            mass_ratio = mass_gr / mass_nw
+
+        if self.has_two_f:  # model uses generalised flux_factors xi*d^2 (x10^45)
+            flux_factor_b = 1e45 * params[self.param_idxs['f_b']]
+            flux_factor_p = 1e45 * params[self.param_idxs['f_p']]
+        elif self.has_one_f:
+            flux_factor_b = 1e45 * params[self.param_idxs['f']]
+            flux_factor_p = flux_factor_b
+        elif self.has_xi_ratio:
+            flux_factor_b = (self.kpc_to_cm * params[self.param_idxs['d_b']])**2
+            flux_factor_p = flux_factor_b * params[self.param_idxs['xi_ratio']]
+        else:
+            xi_b = params[self.param_idxs['xi_b']]
+            xi_p = params[self.param_idxs['xi_p']]
+
+            d = params[self.param_idxs['d']] * self.kpc_to_cm
+            flux_factor_p = xi_p * d**2
+            flux_factor_b = xi_b * d**2
+
+        phi = (redshift - 1) * self.c2 / redshift  # gravitational potential
+
+        return {'mass_ratio': mass_ratio,
+                'redshift': redshift,
+                'flux_factor_b': flux_factor_b,
+                'flux_factor_p': flux_factor_p,
+                'phi': phi,
+                }
+
     def interpolate(self, interp_params):
         """Interpolates burst properties for N epochs
 
@@ -337,44 +634,34 @@ class BurstFit:
         interp_params : 1darray
             parameters specific to the model (e.g. mdot1, x, z, qb, mass)
         """
-        self.debug.start_function('interpolate')
         # TODO: generalise to N-epochs
-        self.debug.variable('interp_params', interp_params, formatter='')
         output = self.kemulator.emulate_burst(params=interp_params)
-        self.debug.end_function()
         return output
 
     def get_epoch_params(self, params):
         """Extracts array of model parameters for each epoch
+
+        If params is 2D (n_walkers, n_dim), returns (n_walkers, n_epochs, n_interp)
         """
-        self.debug.start_function('extract_epoch_params')
         # TODO: use base set of interp params (without epoch duplicates)
-        n_interp = len(self.mcmc_version.interp_keys)
-        epoch_params = np.full((self.n_epochs, n_interp), np.nan, dtype=float)
-
-        for i in range(self.n_epochs):
-            for j in range(n_interp):
-                key = self.mcmc_version.interp_keys[j]
-                epoch_params[i, j] = self.get_interp_param(key, params, epoch_idx=i)
-
+        epoch_params = np.asarray(params, dtype=float)[..., self.epoch_idxs]
         self.transform_aliases(epoch_params)
-        self.debug.variable('epoch_params', epoch_params, formatter='')
-        self.debug.end_function()
         return epoch_params
 
     def get_interp_param(self, key, params, epoch_idx):
         """Extracts interp param value from full params
         """
-        self.debug.start_function('get_interp_param')
-        self.debug.variable('interp key', key, formatter='')
+        return params[..., self.get_interp_param_idx(key, epoch_idx=epoch_idx)]
+
+    def get_interp_param_idx(self, key, epoch_idx):
+        """Returns index in full params of an interp param for given epoch
+        """
         key = self.mcmc_version.param_aliases.get(key, key)
 
         if key in self.mcmc_version.epoch_unique:
             key = f'{key}{epoch_idx + 1}'
 
-        self.debug.variable('param key', key, formatter='')
-        self.debug.end_function()
-        return params[self.param_idxs[key]]
+        return self.param_idxs[key]
 
     def transform_aliases(self, epoch_params):
         """Transforms any alias params into the correct model form
@@ -384,58 +671,27 @@ class BurstFit:
         epoch_params : nparray
             set of parameters to be parsed to interpolator
         """
-        self.debug.start_function('transform_aliases')
-        self.debug.variable('epoch params in', epoch_params, formatter='')
-
         if self.has_g:
-            epoch_params[:, self.interp_idxs['mass']] *= self.reference_mass
+            epoch_params[..., self.interp_idxs['mass']] *= self.reference_mass
         if self.has_logz:
             idx = self.interp_idxs['z']
-            epoch_params[:, idx] = z_sun * 10**epoch_params[:, idx]
-
-        self.debug.variable('epoch params out', epoch_params, formatter='')
-        self.debug.end_function()
+            epoch_params[..., idx] = z_sun * 10**epoch_params[..., idx]
 
     def lnprior(self, params):
         """Return logarithm prior lhood of params
-        """
-        self.debug.start_function('lnprior')
-        lower_bounds = self.mcmc_version.prior_bounds[:, 0]
-        upper_bounds = self.mcmc_version.prior_bounds[:, 1]
-        inside_bounds = np.logical_and(params > lower_bounds,
-                                       params < upper_bounds)
-
-        if False in inside_bounds:
-            self.debug.end_function()
-            return self.zero_lhood
-
-        if self.has_logz:
-            z_input = params[self.param_idxs['logz']]
-        else:
-            z = params[self.param_idxs['z']]
-            z_input = np.log10(z / z_sun)
-
-        prior_lhood = np.log(self.z_prior(z_input))
-
-        # ===== anisotropy/inclination priors =====
-        if self.has_two_f:
-            xi_ratio = params[self.param_idxs['f_p']] / params[self.param_idxs['f_b']]
-            prior_lhood += np.log(self.xi_ratio_prior(xi_ratio))
-        elif self.has_xi_ratio:
-            xi_ratio = params[self.param_idxs['xi_ratio']]
-            d_b = params[self.param_idxs['d_b']]
-            prior_lhood += np.log(self.xi_ratio_prior(xi_ratio))
-            prior_lhood += np.log(self.d_b_prior(d_b))
 
-        self.debug.variable('prior_lhood', prior_lhood, formatter='f')
-        self.debug.end_function()
-        return prior_lhood
+        params : 1darray, or 2darray of shape (n_walkers, n_dim)
+            for 2D, the prior of each row (walker) is returned
+        """
+        return get_lnprior(params, mcmc_version=self.mcmc_version,
+                           zero_lhood=self.zero_lhood)
 
     def compare(self, model, u_model, obs, u_obs, bprop, label='', plot=False):
         """Returns logarithmic likelihood of given model values
 
         Calculates difference between modelled and observed values.
-        All provided arrays must be the same length
+        All provided arrays must be the same length. Model arrays may also be 2D
+        (n_walkers, n_epochs), returning one lhood per walker
 
         Parameters
         ----------
@@ -454,21 +710,15 @@ class BurstFit:
         plot : bool
             whether to plot the comparison
         """
-        self.debug.start_function('compare')
-        pyprint.check_same_length(model, obs, 'model and obs arrays')
-        pyprint.check_same_length(u_model, u_obs, 'u_model and u_obs arrays')
-
         weight = self.mcmc_version.weights[bprop]
         inv_sigma2 = 1 / (u_model ** 2 + u_obs ** 2)
         lh = -0.5 * weight * ((model - obs) ** 2 * inv_sigma2
                      + np.log(2 * np.pi / inv_sigma2))
-        self.debug.print_(f'lhood breakdown: {label} {lh}')
 
         if plot:
             self.plot_compare(model=model, u_model=u_model, obs=obs,
                               u_obs=u_obs, bprop=label)
-        self.debug.end_function()
-        return lh.sum()
+        return lh.sum(axis=-1)
 
     def plot_compare(self, model, u_model, obs, u_obs, bprop, ax=None, title=False,
                      display=True, xlabel=False, legend=False):
@@ -538,3 +788,49 @@ class BurstFit:
         ax.legend()
         plt.tight_layout()
         plt.show(block=False)
+
+
+def get_lnprior(params, mcmc_version, zero_lhood=-np.inf):
+    """Return logarithm prior lhood of params under mcmc_version's priors
+    (see BurstFit.lnprior), without setting up a BurstFit
+
+    params : 1darray, or 2darray of shape (n_walkers, n_dim)
+        for 2D, the prior of each row (walker) is returned
+    mcmc_version : McmcVersion
+    zero_lhood : flt
+        value returned outside the prior bounds
+    """
+    params = np.asarray(params)
+    param_idxs = {key: i for i, key in enumerate(mcmc_version.param_keys)}
+    prior_lnpdfs = mcmc_version.prior_lnpdfs
+    lower_bounds = mcmc_version.prior_bounds[:, 0]
+    upper_bounds = mcmc_version.prior_bounds[:, 1]
+    inside_bounds = np.all((params > lower_bounds) & (params < upper_bounds), axis=-1)
+
+    if params.ndim == 1 and not inside_bounds:
+        return zero_lhood
+
+    columns = params.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):  # out-of-bounds walkers
+        if 'logz' in param_idxs:
+            z_input = columns[param_idxs['logz']]
+        else:
+            z = columns[param_idxs['z']]
+            z_input = np.log10(z / z_sun)
+
+        prior_lhood = prior_lnpdfs['z'](z_input)
+
+        # ===== anisotropy/inclination priors =====
+        if ('f_b' in param_idxs) and ('f_p' in param_idxs):
+            xi_ratio = columns[param_idxs['f_p']] / columns[param_idxs['f_b']]
+            prior_lhood = prior_lhood + prior_lnpdfs['xi_ratio'](xi_ratio)
+        elif 'xi_ratio' in param_idxs:
+            xi_ratio = columns[param_idxs['xi_ratio']]
+            d_b = columns[param_idxs['d_b']]
+            prior_lhood = prior_lhood + prior_lnpdfs['xi_ratio'](xi_ratio)
+            prior_lhood = prior_lhood + prior_lnpdfs['d_b'](d_b)
+
+    if params.ndim == 1:
+        return float(prior_lhood)
+    return np.where(inside_bounds, prior_lhood, zero_lhood)
@@ -0,0 +1,206 @@
+import numpy as np
+
+# =============================================================================
+# Streaming statistics of (memory-mapped) mcmc chains
+#
+# Chains are read a block of steps at a time, so summaries and histograms can be
+# made for chains larger than memory. Statistics are made in two passes:
+#   1. range and mean of each parameter
+#   2. fine 1-D histograms (for quantiles, modes, credible intervals)
+#      and 2-D histograms of parameter pairs (for contours)
+# Quantiles are accurate to a fine bin width, (max - min) / n_bins_fine
+# =============================================================================
+CHUNK_BYTES = 2**26
+N_BINS_FINE = 2**14
+
+
+def iter_chunks(chain, weights=None, chunk_bytes=CHUNK_BYTES):
+    """Yields blocks of steps as in-memory (samples, weights)
+
+    samples have shape (n_samples, n_dim), weights (n_samples,) or None
+
+    chain : ndarray
+        shape (n_walkers, n_steps, n_dim), e.g. a lazy memory-mapped view
+    weights : ndarray (optional)
+        weight of each sample, shape (n_walkers, n_steps)
+    """
+    n_walkers, n_steps, n_dim = chain.shape
+    chunk_steps = max(1, chunk_bytes // (8 * n_walkers * n_dim))
+
+    for i0 in range(0, n_steps, chunk_steps):
+        i1 = min(i0 + chunk_steps, n_steps)
+        samples = np.array(chain[:, i0:i1, :], dtype=float).reshape((-1, n_dim))
+        chunk_weights = None
+        if weights is not None:
+            chunk_weights = np.array(weights[:, i0:i1], dtype=float).reshape(-1)
+        yield samples, chunk_weights
+
+
+def get_moments(chain, weights=None):
+    """Returns ranges (n_dim, 2), means (n_dim,) and total weight of samples
+    """
+    n_dim = chain.shape[2]
+    ranges = np.full((n_dim, 2), [np.inf, -np.inf])
+    sums = np.zeros(n_dim)
+    total = 0.0
+
+    for samples, w in iter_chunks(chain, weights=weights):
+        if w is not None:
+            samples = samples[w > 0]
+            w = w[w > 0]
+        if len(samples) == 0:
+            continue
+
+        ranges[:, 0] = np.minimum(ranges[:, 0], np.min(samples, axis=0))
+        ranges[:, 1] = np.maximum(ranges[:, 1], np.max(samples, axis=0))
+
+        if w is None:
+            sums += np.sum(samples, axis=0)
+            total += len(samples)
+        else:
+            sums += np.sum(samples * w[:, np.newaxis], axis=0)
+            total += np.sum(w)
+
+    if total == 0:
+        raise ValueError('Chain has no samples (with non-zero weight)')
+
+    # avoid zero-width ranges (e.g. fixed parameter)
+    flat = ranges[:, 1] == ranges[:, 0]
+    ranges[flat] += [-0.5, 0.5]
+    return ranges, sums / total, total
+
+
+def get_histograms(chain, ranges, weights=None, n_bins=N_BINS_FINE,
+                   pairs=None, n_bins_2d=50):
+    """Returns 1-D histograms, and 2-D histograms of parameter pairs
+
+    Returns: hist (n_dim, n_bins), hist_2d {(i, j): (n_bins_2d, n_bins_2d)}
+
+    ranges : ndarray
+        (min, max) of each parameter, shape (n_dim, 2), see get_moments()
+    pairs : [(int, int)] (optional)
+        parameter index pairs to make 2-D histograms of
+    """
+    n_dim = chain.shape[2]
+    pairs = [] if pairs is None else pairs
+    hist = np.zeros(n_dim * n_bins)
+    hist_2d = {pair: np.zeros(n_bins_2d**2) for pair in pairs}
+    offsets = np.arange(n_dim) * n_bins
+
+    for samples, w in iter_chunks(chain, weights=weights):
+        idxs = get_bin_idxs(samples, ranges=ranges, n_bins=n_bins)
+        w_dim = None if w is None else np.repeat(w, n_dim)
+        hist += np.bincount((idxs + offsets).ravel(), weights=w_dim,
+                            minlength=n_dim * n_bins)
+
+        if len(pairs) > 0:
+            idxs_2d = get_bin_idxs(samples, ranges=ranges, n_bins=n_bins_2d)
+            for i, j in pairs:
+                flat_idx = idxs_2d[:, i] * n_bins_2d + idxs_2d[:, j]
+                hist_2d[(i, j)] += np.bincount(flat_idx, weights=w,
+                                               minlength=n_bins_2d**2)
+
+    hist = hist.reshape((n_dim, n_bins))
+    hist_2d = {pair: h.reshape((n_bins_2d, n_bins_2d)) for pair, h in hist_2d.items()}
+    return hist, hist_2d
+
+
+def get_bin_idxs(samples, ranges, n_bins):
+    """Returns histogram bin index of each sample value, shape (n_samples, n_dim)
+    """
+    widths = (ranges[:, 1] - ranges[:, 0]) / n_bins
+    idxs = ((samples - ranges[:, 0]) / widths).astype(int)
+    return np.clip(idxs, 0, n_bins - 1)
+
+
+def get_edges(ranges, n_bins):
+    """Returns bin edges of each parameter, shape (n_dim, n_bins + 1)
+    """
+    return np.linspace(ranges[:, 0], ranges[:, 1], n_bins + 1).T
+
+
+def rebin(hist, n_bins):
+    """Returns histograms (n_dim, n_fine) summed into n_bins (must divide n_fine)
+    """
+    n_dim, n_fine = hist.shape
+    return hist.reshape((n_dim, n_bins, n_fine // n_bins)).sum(axis=2)
+
+
+def get_quantiles(hist, edges, q):
+    """Returns quantiles of a 1-D histogram, interpolating within bins
+    """
+    cdf = np.concatenate([[0], np.cumsum(hist)])
+    cdf /= cdf[-1]
+    return np.interp(q, cdf, edges)
+
+
+def get_credible_interval(hist, edges, level=0.6827):
+    """Returns highest-density credible interval (lower, upper) and mode
+    of a 1-D histogram, assuming a single peak
+    """
+    order = np.argsort(hist)[::-1]
+    cumulative = np.cumsum(hist[order]) / np.sum(hist)
+    n_in = np.searchsorted(cumulative, level) + 1
+    included = order[:n_in]
+
+    i_mode = order[0]
+    mode = 0.5 * (edges[i_mode] + edges[i_mode + 1])
+    return edges[np.min(included)], mode, edges[np.max(included) + 1]
+
+
+def get_summary(chain, weights=None, statistic='max', n_bins=None, level=0.6827):
+    """Returns summary (lower, centre, upper) of each parameter, shape (n_dim, 3)
+
+    statistic : str
+        'max' : mode, and highest-density interval holding `level`,
+                of histograms with n_bins (as for ChainConsumer's 'max')
+        'cumulative' : median, and equal-tailed interval holding `level`
+        'mean' : mean, and equal-tailed interval holding `level`
+    n_bins : int (optional)
+        histogram bins for 'max' statistic (must divide N_BINS_FINE).
+        Default scales with number of samples (see get_n_bins)
+    """
+    if statistic not in ('max', 'cumulative', 'mean'):
+        raise ValueError(f"statistic must be one of ('max', 'cumulative', 'mean'), "
+                         f"not '{statistic}'")
+
+    ranges, means, total = get_moments(chain, weights=weights)
+    hist, _ = get_histograms(chain, ranges=ranges, weights=weights)
+    edges = get_edges(ranges, n_bins=N_BINS_FINE)
+    q = [0.5 - level / 2, 0.5, 0.5 + level / 2]
+    summary = np.zeros((len(ranges), 3))
+
+    if statistic == 'max':
+        n_samples = chain.shape[0] * chain.shape[1]
+        n_bins = get_n_bins(n_samples) if n_bins is None else n_bins
+        hist = rebin(hist, n_bins)
+        edges = get_edges(ranges, n_bins=n_bins)
+        for i in range(len(ranges)):
+            summary[i] = get_credible_interval(hist[i], edges[i], level=level)
+
+    else:
+        for i in range(len(ranges)):
+            summary[i] = get_quantiles(hist[i], edges[i], q=q)
+        if statistic == 'mean':
+            summary[:, 1] = means
+    return summary
+
+
+def get_n_bins(n_samples):
+    """Returns number of histogram bins for a number of samples,
+    rounded down to a power of 2 (so fine histograms can be rebinned)
+    """
+    n_bins = np.clip(np.sqrt(n_samples) / 10, 16, N_BINS_FINE)
+    return int(2**np.floor(np.log2(n_bins)))
+
+
+def get_contour_levels(hist_2d, levels=(0.3935, 0.8647)):
+    """Returns density thresholds enclosing given fractions of a 2-D histogram
+
+    Default levels are the 1- and 2-sigma regions of a 2-D gaussian.
+    Returned in increasing order (as needed by matplotlib contour)
+    """
+    density = np.sort(hist_2d.ravel())[::-1]
+    cumulative = np.cumsum(density) / np.sum(density)
+    idxs = np.minimum(np.searchsorted(cumulative, levels), len(density) - 1)
+    return np.sort(density[idxs])
@@ -0,0 +1,278 @@
+import numpy as np
+import os
+import json
+
+# =============================================================================
+# Append-only on-disk storage of mcmc chains
+#
+# One file per run, made up of a fixed-size (JSON) header, followed by one
+# fixed-size record per step. Each record holds every walker's:
+#   chain    : (n_walkers, n_dim) positions
+#   lnprob   : (n_walkers,) log-probability
+#   accepted : (n_walkers,) whether the step was accepted
+#   blobs    : (n_walkers, n_blob) derived quantities (optional,
+#              see BurstFit.get_blob_fields), layout given by 'blob_fields'
+#
+# Saving a step only appends that step, and reading memory-maps the records,
+# so slicing off the burn-in (discard/cap) never loads it from disk
+# =============================================================================
+HEADER_SIZE = 4096
+FORMAT = 'pyburst_chain_store'
+FORMAT_VERSION = 1
+
+
+class ChainStore:
+    """Append-only, memory-mapped store of an mcmc chain
+
+    parameters
+    ----------
+    filepath : str
+    mode : str
+        'r' : read-only, file must exist
+        'a' : append, file is created if it doesn't exist
+    n_walkers : int
+        required if creating a new file
+    n_dim : int
+        required if creating a new file
+    blob_fields : [[str, [int]]] (optional)
+        name and shape of each derived quantity in a blob, if storing blobs.
+        If the file exists, must match its blob_fields
+    """
+
+    def __init__(self, filepath, mode='r', n_walkers=None, n_dim=None,
+                 blob_fields=None):
+        if mode not in ('r', 'a'):
+            raise ValueError(f"mode must be one of ('r', 'a'), not '{mode}'")
+
+        self.filepath = filepath
+        self.mode = mode
+        self.buffer = []
+
+        if os.path.exists(filepath):
+            self.header = read_header(filepath)
+        elif mode == 'a':
+            if None in (n_walkers, n_dim):
+                raise ValueError('Must provide n_walkers and n_dim to create a new store')
+            self.header = get_header(n_walkers=n_walkers, n_dim=n_dim,
+                                     blob_fields=blob_fields)
+            write_header(filepath, header=self.header)
+        else:
+            raise FileNotFoundError(f'Chain store not found: {filepath}')
+
+        self.n_walkers = self.header['n_walkers']
+        self.n_dim = self.header['n_dim']
+        self.blob_fields = self.header.get('blob_fields')
+        self.dtype = get_record_dtype(self.header)
+
+        self.blob_slices = {}
+        if self.blob_fields is not None:
+            i0 = 0
+            for name, shape in self.blob_fields:
+                size = int(np.prod(shape))
+                self.blob_slices[name] = (slice(i0, i0 + size), tuple(shape))
+                i0 += size
+
+        for name, val in {'n_walkers': n_walkers, 'n_dim': n_dim}.items():
+            if (val is not None) and (val != self.header[name]):
+                raise ValueError(f'{name} ({val}) does not match existing '
+                                 f'chain store ({self.header[name]})')
+
+        if (blob_fields is not None) and (get_blob_fields(blob_fields) != self.blob_fields):
+            raise ValueError(f'blob_fields ({get_blob_fields(blob_fields)}) do not match '
+                             f'existing chain store ({self.blob_fields})')
+
+        if mode == 'a':
+            self.truncate(self.n_steps)  # drop any partially-written final step
+
+    def __repr__(self):
+        return (f'ChainStore: {self.filepath}'
+                + f'\nn_walkers : {self.n_walkers}'
+                + f'\nn_dim     : {self.n_dim}'
+                + f'\nn_steps   : {self.n_steps}')
+
+    @property
+    def n_steps(self):
+        """Number of complete steps written to file
+        """
+        n_bytes = os.path.getsize(self.filepath) - HEADER_SIZE
+        return n_bytes // self.dtype.itemsize
+
+    def records(self):
+        """Returns memory-map of all step records, shape (n_steps,)
+        """
+        n_steps = self.n_steps
+        if n_steps == 0:
+            return np.zeros(0, dtype=self.dtype)
+
+        return np.memmap(self.filepath, dtype=self.dtype, mode='r',
+                         offset=HEADER_SIZE, shape=(n_steps,))
+
+    def get_chain(self, discard=None, cap=None, thin=None):
+        """Returns lazy view of chain, shape (n_walkers, n_steps, n_dim)
+        """
+        return self.records()['chain'][discard:cap:thin].transpose(1, 0, 2)
+
+    def get_lnprob(self, discard=None, cap=None, thin=None):
+        """Returns lazy view of lnprob, shape (n_walkers, n_steps)
+        """
+        return self.records()['lnprob'][discard:cap:thin].transpose()
+
+    def get_accepted(self, discard=None, cap=None):
+        """Returns lazy view of step acceptances, shape (n_walkers, n_steps)
+        """
+        return self.records()['accepted'][discard:cap].transpose()
+
+    def get_blobs(self, discard=None, cap=None):
+        """Returns lazy view of blobs, shape (n_walkers, n_steps, n_blob)
+        """
+        self.check_blobs()
+        return self.records()['blobs'][discard:cap].transpose(1, 0, 2)
+
+    def get_blob(self, name, discard=None, cap=None):
+        """Returns a single derived quantity from blobs, shape (n_walkers, n_steps, ...)
+
+        e.g. get_blob('rate') has shape (n_walkers, n_steps, n_epochs)
+        """
+        self.check_blobs()
+        if name not in self.blob_slices:
+            raise ValueError(f"No blob field '{name}', must be one of "
+                             f"{list(self.blob_slices)}")
+
+        idx, shape = self.blob_slices[name]
+        blobs = self.get_blobs(discard=discard, cap=cap)[:, :, idx]
+        return blobs.reshape(blobs.shape[:2] + shape)
+
+    def last_blobs(self):
+        """Returns blobs of the final step (list of 1darray, one per walker),
+        or None if the store has no blobs
+        """
+        if self.blob_fields is None:
+            return None
+        if self.n_steps == 0:
+            raise ValueError(f'Chain store is empty: {self.filepath}')
+
+        return list(np.array(self.records()[-1]['blobs']))
+
+    def last_step(self):
+        """Returns walker positions and lnprob of the final step
+        """
+        if self.n_steps == 0:
+            raise ValueError(f'Chain store is empty: {self.filepath}')
+
+        record = self.records()[-1]
+        return np.array(record['chain']), np.array(record['lnprob'])
+
+    def append(self, chain, lnprob, accepted, blobs=None):
+        """Buffers a single step to be written on the next flush()
+
+        parameters
+        ----------
+        chain : ndarray
+            walker positions, shape (n_walkers, n_dim)
+        lnprob : 1darray
+            log-probability of each walker
+        accepted : 1darray
+            whether each walker's step was accepted
+        blobs : [1darray] (optional)
+            blob of each walker (required if store has blob_fields)
+        """
+        self.check_writable()
+        record = np.zeros(1, dtype=self.dtype)
+        record['chain'] = chain
+        record['lnprob'] = lnprob
+        record['accepted'] = accepted
+
+        if self.blob_fields is not None:
+            if blobs is None:
+                raise ValueError('Chain store has blob_fields, must provide blobs')
+            record['blobs'] = np.array(blobs)
+        self.buffer += [record]
+
+    def flush(self):
+        """Appends all buffered steps to file
+        """
+        self.check_writable()
+        if len(self.buffer) == 0:
+            return
+
+        block = np.concatenate(self.buffer)
+        with open(self.filepath, 'ab') as f:
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.buffer = []
+
+    def truncate(self, n_steps):
+        """Discards all steps after n_steps (e.g. to restart from an earlier step)
+        """
+        self.check_writable()
+        if n_steps > self.n_steps:
+            raise ValueError(f'n_steps ({n_steps}) is larger than the number '
+                             f'of steps in store ({self.n_steps})')
+
+        self.buffer = []
+        os.truncate(self.filepath, HEADER_SIZE + n_steps * self.dtype.itemsize)
+
+    def check_writable(self):
+        if self.mode != 'a':
+            raise IOError("Chain store was opened read-only, use mode='a'")
+
+    def check_blobs(self):
+        if self.blob_fields is None:
+            raise ValueError(f'Chain store has no blobs: {self.filepath}')
+
+
+def get_header(n_walkers, n_dim, blob_fields=None):
+    """Returns header dict for a new chain store
+    """
+    header = {'format': FORMAT,
+              'format_version': FORMAT_VERSION,
+              'n_walkers': int(n_walkers),
+              'n_dim': int(n_dim),
+              'fields': [['chain', '<f8', [int(n_walkers), int(n_dim)]],
+                         ['lnprob', '<f8', [int(n_walkers)]],
+                         ['accepted', 'u1', [int(n_walkers)]],
+                         ],
+              }
+
+    if blob_fields is not None:
+        blob_fields = get_blob_fields(blob_fields)
+        n_blob = sum(int(np.prod(shape)) for name, shape in blob_fields)
+        header['blob_fields'] = blob_fields
+        header['fields'] += [['blobs', '<f8', [int(n_walkers), n_blob]]]
+
+    return header
+
+
+def get_blob_fields(blob_fields):
+    """Returns blob_fields in the form saved in the header, [[name, [int]]]
+    """
+    return [[name, [int(n) for n in shape]] for name, shape in blob_fields]
+
+
+def get_record_dtype(header):
+    """Returns numpy dtype of a single step record
+    """
+    return np.dtype([(name, dtype, tuple(shape))
+                     for name, dtype, shape in header['fields']])
+
+
+def write_header(filepath, header):
+    header_str = json.dumps(header).encode()
+    if len(header_str) >= HEADER_SIZE:
+        raise ValueError(f'Chain store header exceeds {HEADER_SIZE} bytes')
+
+    with open(filepath, 'wb') as f:
+        f.write(header_str.ljust(HEADER_SIZE - 1) + b'\n')
+
+
+def read_header(filepath):
+    with open(filepath, 'rb') as f:
+        header = json.loads(f.read(HEADER_SIZE).decode())
+
+    if header.get('format') != FORMAT:
+        raise ValueError(f'Not a chain store file: {filepath}')
+    if header['format_version'] > FORMAT_VERSION:
+        raise ValueError(f"Chain store format_version ({header['format_version']}) "
+                         f"is newer than supported ({FORMAT_VERSION})")
+    return header
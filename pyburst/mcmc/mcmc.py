@@ -4,6 +4,10 @@ import os
 import sys
 import time
 import emcee
+import functools
+import multiprocessing
+import multiprocessing.pool
+from emcee.interruptible_pool import InterruptiblePool
 from scipy.optimize import fmin
 
 # kepler_grids
@@ -11,6 +15,7 @@ from . import burstfit
 from . import mcmc_versions
 from . import mcmc_plot
 from . import mcmc_tools
+from . import ptsampler
 from pyburst.grids import grid_tools
 from pyburst.misc.pyprint import check_params_length
 
@@ -18,12 +23,71 @@ GRIDS_PATH = os.environ['KEPLER_GRIDS']
 MODELS_PATH = os.environ['KEPLER_MODELS']
 
 
+class VectorizedPool:
+    """Stand-in for a multiprocessing pool, for use with EnsembleSampler
+
+    emcee evaluates walkers with pool.map(lnprobfn, positions). Here, every walker
+    in the step is instead passed in one call to BurstFit.lhood_batch()
+    """
+
+    def __init__(self, bfit):
+        self.bfit = bfit
+
+    def map(self, func, iterable):
+        out = self.bfit.lhood_batch(np.array(list(iterable)))
+        if self.bfit.return_blobs:
+            return list(zip(*out))
+        return out
+
+
+class CountingPool:
+    """Worker pool for EnsembleSampler, which adds the evaluations done by its
+    workers to the evaluation counters of the parent BurstFit (see BurstFit.count_evals)
+    """
+
+    def __init__(self, n_threads, bfit):
+        self.pool = InterruptiblePool(n_threads)
+        self.bfit = bfit
+
+    def map(self, func, iterable):
+        params = np.array(list(iterable))
+        out = self.pool.map(func, params)
+
+        lhood = [x[0] for x in out] if self.bfit.return_blobs else out
+        self.bfit.count_evals(lnprior=self.bfit.lnprior(params), lhood=np.array(lhood))
+        return out
+
+    def close(self):
+        self.pool.close()
+
+    def join(self):
+        self.pool.join()
+
+
 def setup_sampler(source, version, pos=None, n_walkers=None, n_threads=1,
-                  **kwargs):
+                  vectorize=False, bfit=None, n_temps=1, t_max=None,
+                  adapt_temps=True, **kwargs):
     """Initialises and returns EnsembleSampler object
 
     NOTE: Only uses pos to get n_walkers and n_dimensions
+
+    vectorize : bool
+        evaluate all walkers of each step in a single call to
+        BurstFit.lhood_batch (can't be combined with n_threads > 1)
+    bfit : BurstFit (optional)
+        use existing BurstFit object (otherwise created with kwargs)
+    n_temps : int
+        if > 1, returns a PTSampler with n_temps temperatures of n_walkers
+        each (see ptsampler.py). Always evaluated in batches, split over
+        n_threads processes
+    t_max : float (optional)
+        highest temperature of the initial PTSampler ladder
+    adapt_temps : bool
+        adapt PTSampler temperature spacing while sampling
     """
+    if vectorize and n_threads > 1:
+        raise ValueError('vectorize=True requires n_threads=1')
+
     if pos is None:
         if n_walkers is None:
             print('ERROR: must provide either pos or n_walkers')
@@ -32,15 +96,42 @@ def setup_sampler(source, version, pos=None, n_walkers=None, n_threads=1,
     n_walkers = len(pos)
     n_dimensions = len(pos[0])
 
-    bfit = burstfit.BurstFit(source=source, version=version, verbose=False,
-                             re_interp=False, **kwargs)
-
-    sampler = emcee.EnsembleSampler(n_walkers, n_dimensions, bfit.lhood,
-                                    threads=n_threads)
+    if bfit is None:
+        bfit = burstfit.BurstFit(source=source, version=version, verbose=False,
+                                 re_interp=False, **kwargs)
+    if n_threads > 1:
+        # emcee pickles bfit to the worker pool on every step
+        bfit.kemulator.share()
+
+    if n_temps > 1:
+        pool = multiprocessing.Pool(n_threads) if n_threads > 1 else None
+        sampler = ptsampler.PTSampler(n_temps=n_temps, n_walkers=n_walkers,
+                                      n_dim=n_dimensions, bfit=bfit, t_max=t_max,
+                                      adapt=adapt_temps, pool=pool,
+                                      n_threads=n_threads)
+    elif vectorize:
+        sampler = emcee.EnsembleSampler(n_walkers, n_dimensions, bfit.lhood,
+                                        pool=VectorizedPool(bfit))
+    elif n_threads > 1:
+        sampler = emcee.EnsembleSampler(n_walkers, n_dimensions, bfit.lhood,
+                                        pool=CountingPool(n_threads, bfit))
+    else:
+        sampler = emcee.EnsembleSampler(n_walkers, n_dimensions, bfit.lhood)
     return sampler
 
 
-def setup_positions(source, version, n_walkers, params0=None, mag=1e-3):
+def close_pool(sampler):
+    """Closes the worker pool of a sampler from setup_sampler (if it has one)
+    """
+    pool = getattr(sampler, 'pool', None)
+    if isinstance(pool, (multiprocessing.pool.Pool, CountingPool)):
+        pool.close()
+        pool.join()
+
+
+def setup_positions(source, version, n_walkers, params0=None, mag=1e-3,
+                    prev_version=None, prev_source=None, prev_n_walkers=None,
+                    prev_n_steps=None, prev_discard=None):
     """Sets up and returns posititons of walkers
 
     Parameters
@@ -50,7 +141,21 @@ def setup_positions(source, version, n_walkers, params0=None, mag=1e-3):
     n_walkers: int, number of mcmc walkers to use
     params0: array, initial guess (mdot1, x, z, qb, g, redshift, d, inc)
     mag: flt, magnitude of random seeds to use for initial mcmc 'ball'
+    prev_version : int (optional)
+        warm-start from the chain of a previous run (see warm_start_positions),
+        instead of a ball around params0
+    prev_source, prev_n_walkers, prev_n_steps, prev_discard : (optional)
+        previous run's source (default source), n_walkers (default n_walkers),
+        n_steps (default all saved steps), and steps to discard
     """
+    if prev_version is not None:
+        prev_source = source if prev_source is None else prev_source
+        prev_n_walkers = n_walkers if prev_n_walkers is None else prev_n_walkers
+        return warm_start_positions(source, version=version, n_walkers=n_walkers,
+                                    prev_source=prev_source, prev_version=prev_version,
+                                    prev_n_walkers=prev_n_walkers,
+                                    prev_n_steps=prev_n_steps, prev_discard=prev_discard)
+
     if type(params0) == type(None):
         mcmc_version = mcmc_versions.McmcVersion(source=source, version=version)
         params0 = mcmc_version.initial_position
@@ -60,24 +165,191 @@ def setup_positions(source, version, n_walkers, params0=None, mag=1e-3):
     return np.array(pos)
 
 
-def run_sampler(sampler, pos, n_steps, verbose=True):
-    """Runs emcee chain for n_steps
+def warm_start_positions(source, version, n_walkers, prev_source, prev_version,
+                         prev_n_walkers, prev_n_steps=None, prev_discard=None,
+                         n_draws=100, bfit=None, seed=None, verbose=True):
+    """Returns walker positions drawn from the posterior of a previous run
+
+    Parameters shared with the previous version are matched by name (see
+    get_param_map), and any new parameters are drawn from the new priors
+    (given the shared parameters). Walkers outside the new priors/grid are re-drawn
+
+    Parameters
+    ----------
+    prev_discard : int (optional)
+        steps of the previous chain to discard. Defaults to its recommended
+        burn-in (see mcmc_tools.get_burn_in), or otherwise half the chain
+    n_draws : int
+        prior draws per walker used to sample new parameters
     """
+    if bfit is None:
+        bfit = burstfit.BurstFit(source=source, version=version, verbose=False)
+    rng = np.random.default_rng(seed)
+
+    new_keys = bfit.mcmc_version.param_keys
+    old_keys = mcmc_versions.get_parameter(prev_source, prev_version, 'param_keys')
+    param_map = get_param_map(old_keys=old_keys, new_keys=new_keys)
+    new_idxs = [i for i, key in enumerate(new_keys) if key not in param_map]
+    shared_idxs = [i for i, key in enumerate(new_keys) if key in param_map]
+    old_idxs = [old_keys.index(param_map[new_keys[i]]) for i in shared_idxs]
+
+    chain = mcmc_tools.load_chain(prev_source, version=prev_version, n_steps=prev_n_steps,
+                                  n_walkers=prev_n_walkers, verbose=verbose)
+    if prev_discard is None:
+        prev_discard = mcmc_tools.get_burn_in(prev_source, version=prev_version,
+                                              n_walkers=prev_n_walkers)
+    if prev_discard is None:
+        prev_discard = chain.shape[1] // 2
+
+    samples = np.array(mcmc_tools.slice_chain(chain, discard=prev_discard))
+    samples = samples.reshape((-1, len(old_keys)))
+    samples = samples[rng.permutation(len(samples))]
+
+    if verbose:
+        print(f'Warm-starting from {prev_source} V{prev_version} '
+              f'({len(samples)} samples after discarding {prev_discard} steps)')
+        print(f'Shared params: {[new_keys[i] for i in shared_idxs]}')
+        print(f'New params (drawn from priors): {[new_keys[i] for i in new_idxs]}')
+
+    bounds = bfit.mcmc_version.prior_bounds
+    pos = np.zeros((0, len(new_keys)))
+    i0 = 0
+
+    while len(pos) < n_walkers:
+        if i0 >= len(samples):
+            raise RuntimeError(f'Only {len(pos)} of the previous samples are valid '
+                               f'under {source} V{version}, need {n_walkers}')
+        old = samples[i0:i0 + 2*n_walkers]
+        i0 += len(old)
+        n_old = len(old)
+
+        # ===== draw new params from priors, by importance resampling =====
+        trial = np.zeros((n_old, n_draws, len(new_keys)))
+        trial[:, :, shared_idxs] = old[:, np.newaxis, old_idxs]
+        trial[:, :, new_idxs] = rng.uniform(bounds[new_idxs, 0], bounds[new_idxs, 1],
+                                            size=(n_old, n_draws, len(new_idxs)))
+
+        lnprior = bfit.lnprior(trial.reshape((-1, len(new_keys)))).reshape(n_old, n_draws)
+        lnprior_max = np.max(lnprior, axis=1)
+        has_prior = np.isfinite(lnprior_max)
+
+        weights = np.exp(lnprior[has_prior] - lnprior_max[has_prior, np.newaxis])
+        cdf = np.cumsum(weights, axis=1)
+        u = rng.uniform(size=(len(cdf), 1)) * cdf[:, -1:]
+        choice = np.minimum(np.sum(cdf < u, axis=1), n_draws - 1)
+        trial = trial[has_prior, choice]
+
+        valid = np.isfinite(bfit.lhood_value(bfit.lhood_batch(trial)))
+        pos = np.concatenate([pos, trial[valid]])
+
+    return pos[:n_walkers]
+
+
+def get_param_map(old_keys, new_keys):
+    """Returns dict mapping new param keys to the matching old param key
+
+    Keys match by name, or else by base name across epochs, e.g. new qb1, qb2
+    take old qb, and new qb takes old qb1. Unmatched new keys are excluded
+    """
+    param_map = {}
+    for key in new_keys:
+        base = key.rstrip('0123456789')
+
+        if key in old_keys:
+            param_map[key] = key
+        elif base != key and base in old_keys:
+            param_map[key] = base
+        elif f'{key}1' in old_keys:
+            param_map[key] = f'{key}1'
+
+    return param_map
+
+
+def run_sampler(sampler, pos, n_steps, verbose=True, store=None,
+                lnprob0=None, rstate0=None, autocorr=None, check_every=100,
+                n_tau=None, blobs0=None, telemetry=None, progress_interval=1.0):
+    """Runs emcee chain for n_steps, or until converged (if n_tau provided)
+
+    store : ChainStore (optional)
+        if provided, each step is appended to this on-disk store
+        (see chain_store.py), instead of being kept in sampler.chain
+    lnprob0 : 1darray (optional)
+        lnprob of walkers at pos (e.g. when restarting), to avoid re-calculating
+    rstate0 : tuple (optional)
+        state of random number generator to start from
+    blobs0 : list (optional)
+        blobs of walkers at pos. Required with lnprob0 if sampling blobs
+        (see BurstFit.get_blob_fields)
+    autocorr : AutocorrTracker (optional)
+        updated with every step (see autocorr.py)
+    check_every : int
+        steps between convergence checks of autocorr
+    n_tau : float (optional)
+        stop early once the chain is n_tau times longer than the autocorrelation
+        time (requires autocorr). Sets autocorr.converged
+    telemetry : Telemetry (optional)
+        updated with every step, writing metrics to file (see telemetry.py)
+    progress_interval : float
+        minimum seconds between progress updates (if verbose)
+    """
+    if (n_tau is not None) and (autocorr is None):
+        raise ValueError('Must provide autocorr to use n_tau')
+
     t0 = time.time()
     result = None
-
-    for i, result in enumerate(sampler.sample(pos, iterations=n_steps)):
-        if verbose:
-            progress = (float(i + 1) / n_steps) * 100
+    storechain = store is None
+    naccepted = sampler.naccepted.copy()
+    n_done = 0
+    t_progress = 0
+
+    if (telemetry is not None) and (telemetry.last is None):
+        telemetry.start(sampler)
+
+    for i, result in enumerate(sampler.sample(pos, lnprob0=lnprob0, rstate0=rstate0,
+                                              blobs0=blobs0, iterations=n_steps,
+                                              storechain=storechain)):
+        n_done = i + 1
+        if store is not None:
+            accepted = sampler.naccepted > naccepted
+            naccepted = sampler.naccepted.copy()
+            blobs = result[3] if len(result) > 3 else None
+            store.append(result[0], lnprob=result[1], accepted=accepted, blobs=blobs)
+
+        if telemetry is not None:
+            telemetry.update(sampler, lnprob=result[1])
+
+        if autocorr is not None:
+            autocorr.update(result[0])
+            if autocorr.n_steps % check_every == 0:
+                autocorr.converged = autocorr.check(n_tau=n_tau) if n_tau else False
+                if autocorr.converged:
+                    break
+
+        if verbose and (time.time() - t_progress >= progress_interval
+                        or n_done == n_steps):
+            t_progress = time.time()
+            progress = (float(n_done) / n_steps) * 100
             sys.stdout.write(f"\r{progress:.1f}%")
+            sys.stdout.flush()
     sys.stdout.write("\n")
 
+    if telemetry is not None:
+        telemetry.write(sampler)
+
+    if verbose and (autocorr is not None):
+        print(f'Autocorrelation time: {autocorr.get_tau()}')
+        if autocorr.converged:
+            print(f'Converged after {autocorr.n_steps} steps (n_tau={n_tau})')
+
+    if store is not None:
+        store.flush()
+
     t1 = time.time()
     dtime = t1 - t0
-    time_per_step = dtime / n_steps
+    time_per_step = dtime / n_done
 
     n_walkers = pos.shape[0]
-    n_samples = n_walkers * n_steps
+    n_samples = n_walkers * n_done
     time_per_sample = dtime / n_samples
 
     if verbose:
@@ -94,7 +366,18 @@ def get_acceptance_fraction(source=None, version=None, n_walkers=None,
     Must provide either:
         1. a sampler object (as returned from load_sampler_state)
         2. source, version, n_walkers, and n_steps
+    If a checkpoint exists for the run (see mcmc_tools.save_checkpoint), uses it,
+    excluding any steps not counted in its acceptances (accept_offset)
     """
+    if sampler is None and (None not in (source, version, n_walkers)):
+        checkpoint_path = mcmc_tools.get_checkpoint_path(source, version=version,
+                                                         n_walkers=n_walkers)
+        if os.path.exists(checkpoint_path):
+            checkpoint = mcmc_tools.load_checkpoint(source, version=version,
+                                                    n_walkers=n_walkers)
+            n_counted = checkpoint['n_steps'] - checkpoint.get('accept_offset', 0)
+            return np.average(checkpoint['naccepted'] / n_counted)
+
     if sampler is None:
         if None in (source, version, n_walkers, n_steps):
             raise ValueError('Must provide source, version, n_steps, '
@@ -124,6 +407,170 @@ def optimise(source, version, x0=None):
     return fmin(bfit.lhood, x0=x0, maxfun=10000)
 
 
+def optimise_multistart(source, version, n_starts=32, n_best=1, n_candidates=None,
+                        n_threads=1, maxfun=2000, seed=None, bfit=None, verbose=True):
+    """Optimises from multiple starting points, and returns the best optima
+
+    Candidate points are drawn uniformly within prior_bounds, and evaluated
+    together (BurstFit.lhood_batch). The n_starts best of these are each
+    optimised (Nelder-Mead), in parallel if n_threads > 1
+
+    Returns: params (n_best, n_dim), lnprob (n_best,), sorted best first
+
+    Parameters
+    ----------
+    n_starts : int
+        number of optimisations to run
+    n_best : int
+        number of optima to return
+    n_candidates : int
+        number of points to draw for choosing starts (default 20 * n_starts)
+    n_threads : int
+        number of processes to run optimisations in
+    maxfun : int
+        max likelihood evaluations per optimisation
+    bfit : BurstFit (optional)
+    """
+    if bfit is None:
+        bfit = burstfit.BurstFit(source=source, version=version, verbose=False)
+    if n_candidates is None:
+        n_candidates = 20 * n_starts
+
+    rng = np.random.default_rng(seed)
+    bounds = bfit.mcmc_version.prior_bounds
+    candidates = rng.uniform(bounds[:, 0], bounds[:, 1],
+                             size=(n_candidates, len(bounds)))
+
+    lhood = bfit.lhood_value(bfit.lhood_batch(candidates))
+    n_finite = np.sum(np.isfinite(lhood))
+    if n_finite < n_starts:
+        raise RuntimeError(f'Only {n_finite} of {n_candidates} candidates have a finite '
+                           'likelihood. Increase n_candidates')
+
+    starts = candidates[np.argsort(lhood)[::-1][:n_starts]]
+    func = functools.partial(optimise_start, bfit=bfit, maxfun=maxfun)
+
+    t0 = time.time()
+    if n_threads > 1:
+        bfit.kemulator.share()
+        with multiprocessing.Pool(n_threads) as pool:
+            results = pool.map(func, starts)
+    else:
+        results = [func(x0) for x0 in starts]
+
+    optima = np.array([r[0] for r in results])
+    lnprob = np.array([r[1] for r in results])
+    order = np.argsort(lnprob)[::-1][:n_best]
+
+    if verbose:
+        print(f'Optimised {n_starts} starts in {time.time() - t0:.1f} s')
+        print(f'Best lnprob: {lnprob[order]}')
+    return optima[order], lnprob[order]
+
+
+def optimise_start(x0, bfit, maxfun):
+    """Runs single optimisation from x0, returns optimum params and lnprob
+    """
+    x = fmin(negative_lhood, x0=x0, args=(bfit,), maxfun=maxfun, disp=False)
+    return x, bfit.lhood_value(bfit.lhood(x))
+
+
+def negative_lhood(x, bfit):
+    """Returns -lhood (with a finite penalty outside the priors/grid), for minimising
+    """
+    lhood = bfit.lhood_value(bfit.lhood(x))
+    return -lhood if np.isfinite(lhood) else 1e9
+
+
+def get_hessian(bfit, params, step):
+    """Returns finite-difference Hessian of -lhood at params
+
+    All offset points are evaluated together (BurstFit.lhood_batch)
+
+    step : 1darray
+        step size for each parameter
+    """
+    n_dim = len(params)
+    offsets = [np.zeros(n_dim)]
+    signs = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+    for i in range(n_dim):
+        for j in range(i, n_dim):
+            for si, sj in signs:
+                offset = np.zeros(n_dim)
+                offset[i] += si * step[i]
+                offset[j] += sj * step[j]
+                offsets += [offset]
+
+    lhood = -bfit.lhood_value(bfit.lhood_batch(params + np.array(offsets)))
+    hessian = np.zeros((n_dim, n_dim))
+    k = 1
+
+    for i in range(n_dim):
+        for j in range(i, n_dim):
+            f_pp, f_pm, f_mp, f_mm = lhood[k:k+4]
+            hessian[i, j] = (f_pp - f_pm - f_mp + f_mm) / (4 * step[i] * step[j])
+            hessian[j, i] = hessian[i, j]
+            k += 4
+
+    return hessian
+
+
+def setup_positions_hessian(source, version, n_walkers, params0, bfit=None,
+                            scale=1.0, step_frac=1e-3, max_frac=0.1, seed=None):
+    """Sets up walker positions around an optimum, using its local curvature
+
+    Walkers are drawn from a Gaussian with covariance = inverse Hessian
+    of -lhood at params0 (see get_hessian). Walkers outside the priors/grid
+    are re-drawn
+
+    Parameters
+    ----------
+    params0 : 1darray
+        optimum to start from (e.g. from optimise_multistart)
+    scale : float
+        factor to scale the (1-sigma) width of the walker ball by
+    step_frac : float
+        finite-difference step, as fraction of each prior width. Also sets
+        the minimum (1-sigma) width of the ball
+    max_frac : float
+        maximum (1-sigma) width of the ball, as fraction of each prior width
+        (e.g. for directions the likelihood is flat along)
+    """
+    if bfit is None:
+        bfit = burstfit.BurstFit(source=source, version=version, verbose=False)
+
+    rng = np.random.default_rng(seed)
+    params0 = np.array(params0, dtype=float)
+    bounds = bfit.mcmc_version.prior_bounds
+    width = bounds[:, 1] - bounds[:, 0]
+    step = step_frac * width
+
+    # ===== invert curvature (abs eigenvalues, for saddles/flat directions) =====
+    hessian = get_hessian(bfit, params=params0, step=step)
+    hessian[np.invert(np.isfinite(hessian))] = 0.0  # offsets beyond priors/grid
+    eigvals, eigvecs = np.linalg.eigh(hessian)
+    eigvals = np.maximum(np.abs(eigvals), 1 / np.max(max_frac * width)**2)
+    cov = (eigvecs / eigvals) @ eigvecs.T
+
+    sigma = np.sqrt(np.diag(cov))
+    sigma_clipped = np.clip(sigma, step, max_frac * width)
+    cov *= np.outer(sigma_clipped / sigma, sigma_clipped / sigma)
+    cov *= scale**2
+
+    pos = np.zeros((0, len(params0)))
+    for i in range(100):
+        trial = rng.multivariate_normal(params0, cov, size=n_walkers)
+        valid = np.isfinite(bfit.lhood_value(bfit.lhood_batch(trial)))
+        pos = np.concatenate([pos, trial[valid]])
+
+        if len(pos) >= n_walkers:
+            return pos[:n_walkers]
+
+    raise RuntimeError(f'Could not place {n_walkers} walkers with finite likelihood '
+                       'around params0')
+
+
 def convert_params(params, source, version):
     """Converts params from dict to raw list format, and vice versa (ensures order)
     """
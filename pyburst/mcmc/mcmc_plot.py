@@ -11,12 +11,17 @@ from math import ceil
 from . import mcmc_versions
 from . import mcmc_tools
 from . import burstfit
+from . import chain_stats
 from pyburst.physics import gravity
 from pyburst.plotting import plot_tools
 from pyburst.grids.grid_strings import get_source_path, print_warning
 
 GRIDS_PATH = os.environ['KEPLER_GRIDS']
 
+# chains larger than this (bytes, after discard/cap) are summarised and plotted
+# a block at a time (see chain_stats.py), instead of loaded whole into ChainConsumer
+STREAM_BYTES = 2**30
+
 
 def default_plt_options():
     """Initialise default plot parameters"""
@@ -91,29 +96,43 @@ def save_multiple_synth(series, source, version, n_steps, discard, n_walkers=960
 
 def plot_contours(chain, discard, source, version, cap=None, truth=False, max_lhood=False,
                   display=True, save=False, truth_values=None, verbose=True,
-                  smoothing=False):
+                  smoothing=False, weights=None, streaming=None):
     """Plots posterior contours of mcmc chain
+
+    discard : int|'auto'
+        steps to discard. If 'auto', uses recommended burn-in from run's checkpoint
+    weights : ndarray (optional)
+        weight of each sample, shape (n_walkers, n_steps), e.g. from reweight.reweight_chain
+    streaming : bool (optional)
+        plot from histograms made a block of steps at a time (for chains
+        larger than memory), instead of with ChainConsumer.
+        Default is True if the chain is larger than STREAM_BYTES
     """
     default_plt_options()
+    discard = mcmc_tools.get_discard(discard, chain=chain, source=source, version=version)
     pkeys = mcmc_versions.get_parameter(source, version, 'param_keys')
     pkey_labels = plot_tools.convert_mcmc_labels(param_keys=pkeys)
-    # TODO: re-use the loaded chainconsumer here instead of reloading
-    cc = setup_chainconsumer(chain=chain, param_labels=pkey_labels, discard=discard,
-                             cap=cap, smoothing=smoothing)
 
     if max_lhood:
         n_walkers, n_steps = chain[:, :, 0].shape
-        max_params = mcmc_tools.get_max_lhood_params(source, version=version, n_walkers=n_walkers,
-                                                     n_steps=n_steps, verbose=verbose)
-        fig = cc.plotter.plot(truth=max_params, display=display)
-    elif truth:
-        if truth_values is None:
-            truth_values = get_summary(chain, discard=discard, cap=cap,
-                                       source=source, version=version)[:, 1]
-
-        fig = cc.plotter.plot(truth=truth_values, display=display)
+        truth_values = mcmc_tools.get_max_lhood_params(source, version=version,
+                                                       n_walkers=n_walkers,
+                                                       n_steps=n_steps, verbose=verbose)
+    elif truth and (truth_values is None):
+        truth_values = get_summary(chain, discard=discard, cap=cap,
+                                   source=source, version=version,
+                                   weights=weights, streaming=streaming)[:, 1]
+    elif not truth:
+        truth_values = None
+
+    if use_streaming(mcmc_tools.slice_chain(chain, discard=discard, cap=cap), streaming):
+        fig = plot_contours_streaming(chain, discard=discard, cap=cap, weights=weights,
+                                      param_labels=pkey_labels, truth_values=truth_values)
     else:
-        fig = cc.plotter.plot(display=display)
+        # TODO: re-use the loaded chainconsumer here instead of reloading
+        cc = setup_chainconsumer(chain=chain, param_labels=pkey_labels, discard=discard,
+                                 cap=cap, smoothing=smoothing, weights=weights)
+        fig = cc.plotter.plot(truth=truth_values, display=display)
 
     plt.tight_layout()
     save_plot(fig, prefix='contours', chain=chain, save=save, source=source,
@@ -122,7 +141,7 @@ def plot_contours(chain, discard, source, version, cap=None, truth=False, max_lh
 
 def plot_posteriors(chain, discard, source, version, cap=None, max_lhood=False,
                     display=True, save=False, truth_values=None,
-                    verbose=True, smoothing=False):
+                    verbose=True, smoothing=False, weights=None, streaming=None):
     """Plots posterior distributions of mcmc chain
 
     max_lhood : bool
@@ -130,24 +149,36 @@ def plot_posteriors(chain, discard, source, version, cap=None, max_lhood=False,
     truth_values : list|dict
         Specify parameters of point (e.g. the true value) to draw on the distributions.
         Will be overidden if max_lhood=True
+    discard : int|'auto'
+        steps to discard. If 'auto', uses recommended burn-in from run's checkpoint
+    weights : ndarray (optional)
+        weight of each sample, shape (n_walkers, n_steps), e.g. from reweight.reweight_chain
+    streaming : bool (optional)
+        plot from histograms made a block of steps at a time (for chains
+        larger than memory), instead of with ChainConsumer.
+        Default is True if the chain is larger than STREAM_BYTES
     """
     default_plt_options()
+    discard = mcmc_tools.get_discard(discard, chain=chain, source=source, version=version)
     pkeys = mcmc_versions.get_parameter(source, version, 'param_keys')
     pkey_labels = plot_tools.convert_mcmc_labels(param_keys=pkeys)
-    cc = setup_chainconsumer(chain=chain, param_labels=pkey_labels, discard=discard,
-                             cap=cap, smoothing=smoothing)
     height = 3 * ceil(len(pkeys) / 4)
-    if truth_values is not None:
-        fig = cc.plotter.plot_distributions(display=display, figsize=[10, height],
-                                            truth=truth_values)
-    elif max_lhood:
+
+    if (truth_values is None) and max_lhood:
         n_walkers, n_steps = chain[:, :, 0].shape
-        max_params = mcmc_tools.get_max_lhood_params(source, version=version, n_walkers=n_walkers,
-                                                     n_steps=n_steps, verbose=verbose)
-        fig = cc.plotter.plot_distributions(display=display, figsize=[10, height],
-                                            truth=max_params)
+        truth_values = mcmc_tools.get_max_lhood_params(source, version=version,
+                                                       n_walkers=n_walkers,
+                                                       n_steps=n_steps, verbose=verbose)
+
+    if use_streaming(mcmc_tools.slice_chain(chain, discard=discard, cap=cap), streaming):
+        fig = plot_posteriors_streaming(chain, discard=discard, cap=cap, weights=weights,
+                                        param_labels=pkey_labels, truth_values=truth_values,
+                                        figsize=[10, height])
     else:
-        fig = cc.plotter.plot_distributions(display=display, figsize=[10, height])
+        cc = setup_chainconsumer(chain=chain, param_labels=pkey_labels, discard=discard,
+                                 cap=cap, smoothing=smoothing, weights=weights)
+        fig = cc.plotter.plot_distributions(display=display, figsize=[10, height],
+                                            truth=truth_values)
 
     plt.tight_layout()
     save_plot(fig, prefix='posteriors', chain=chain, save=save, source=source,
@@ -156,17 +187,19 @@ def plot_posteriors(chain, discard, source, version, cap=None, max_lhood=False,
 
 def plot_mass_radius(chain, discard, source, version, cap=None,
                      display=True, save=False, max_lhood=False, verbose=True,
-                     smoothing=False):
+                     smoothing=False, weights=None):
     """Plots contours of mass versus radius
 
     See: get_mass_radius()
     """
     default_plt_options()
+    discard = mcmc_tools.get_discard(discard, chain=chain, source=source, version=version)
     mass_radius_chain = get_mass_radius(chain=chain, discard=discard,
                                         source=source, version=version, cap=cap)
 
     cc = chainconsumer.ChainConsumer()
-    cc.add_chain(mass_radius_chain.reshape(-1, 2), parameters=['M', 'R'])
+    cc.add_chain(mass_radius_chain.reshape(-1, 2), parameters=['M', 'R'],
+                 weights=slice_weights(weights, discard=discard, cap=cap))
     if not smoothing:
         cc.configure(kde=False, smooth=0)
 
@@ -289,13 +322,29 @@ def plot_qb(chain, discard, source, version, cap=None, summ=None, log=False):
     plt.show(block=False)
 
 
-def get_summary(chain, discard, source, version, cap=None):
+def get_summary(chain, discard, source, version, cap=None, weights=None,
+                streaming=None):
     """Return summary values from MCMC chain (mean, uncertainties)
+
+    weights : ndarray (optional)
+        weight of each sample, shape (n_walkers, n_steps), e.g. from reweight.reweight_chain
+    streaming : bool (optional)
+        summarise a block of steps at a time (for chains larger than memory),
+        instead of with ChainConsumer. Default is True if the chain is
+        larger than STREAM_BYTES. See chain_stats.get_summary
     """
+    discard = mcmc_tools.get_discard(discard, chain=chain, source=source, version=version)
     pkeys = mcmc_versions.get_parameter(source, version, 'param_keys')
     n_dimensions = chain.shape[2]
     summary = np.full((n_dimensions, 3), np.nan)
-    cc = setup_chainconsumer(chain=chain, param_labels=pkeys, discard=discard, cap=cap)
+
+    sliced = mcmc_tools.slice_chain(chain, discard=discard, cap=cap)
+    if use_streaming(sliced, streaming):
+        if weights is not None:
+            weights = np.asarray(weights)[:, discard:cap]
+        return chain_stats.get_summary(sliced, weights=weights)
+    cc = setup_chainconsumer(chain=chain, param_labels=pkeys, discard=discard, cap=cap,
+                             weights=weights)
     summary_dict = cc.analysis.get_summary()
 
     for i, key in enumerate(pkeys):
@@ -304,8 +353,11 @@ def get_summary(chain, discard, source, version, cap=None):
 
 
 def setup_chainconsumer(chain, discard, cap=None, param_labels=None,
-                        source=None, version=None, smoothing=False):
+                        source=None, version=None, smoothing=False, weights=None):
     """Return ChainConsumer object set up with given chain and pkeys
+
+    weights : ndarray (optional)
+        weight of each sample, shape (n_walkers, n_steps)
     """
     if param_labels is None:
         if (source is None) or (version is None):
@@ -315,13 +367,150 @@ def setup_chainconsumer(chain, discard, cap=None, param_labels=None,
     chain = mcmc_tools.slice_chain(chain, discard=discard, cap=cap)
     n_dimensions = chain.shape[2]
     cc = chainconsumer.ChainConsumer()
-    cc.add_chain(chain[:, :, :].reshape(-1, n_dimensions), parameters=param_labels)
+    cc.add_chain(chain[:, :, :].reshape(-1, n_dimensions), parameters=param_labels,
+                 weights=slice_weights(weights, discard=discard, cap=cap))
 
     if not smoothing:
         cc.configure(kde=False, smooth=0)
     return cc
 
 
+def use_streaming(chain, streaming=None):
+    """Returns whether to summarise/plot chain by streaming (see chain_stats.py)
+
+    streaming : bool (optional)
+        if None, streams chains larger than STREAM_BYTES
+    """
+    if streaming is None:
+        return chain.nbytes > STREAM_BYTES
+    return streaming
+
+
+def get_streaming_hists(chain, discard, cap=None, weights=None, pairs=None):
+    """Returns ranges, 1-D histograms (rebinned for plotting) and their edges,
+    and any 2-D histograms of chain, made a block of steps at a time
+    """
+    chain = mcmc_tools.slice_chain(chain, discard=discard, cap=cap)
+    if weights is not None:
+        weights = np.asarray(weights)[:, discard:cap]
+
+    ranges, _, _ = chain_stats.get_moments(chain, weights=weights)
+    hist, hist_2d = chain_stats.get_histograms(chain, ranges=ranges, weights=weights,
+                                               pairs=pairs)
+    n_bins = chain_stats.get_n_bins(chain.shape[0] * chain.shape[1])
+    hist = chain_stats.rebin(hist, n_bins=n_bins)
+    edges = chain_stats.get_edges(ranges, n_bins=n_bins)
+    return ranges, hist, edges, hist_2d
+
+
+def get_truth_list(truth_values, param_labels):
+    """Returns truth values as a list (None for missing), from list or dict (by label)
+    """
+    if truth_values is None:
+        return [None] * len(param_labels)
+    if isinstance(truth_values, dict):
+        return [truth_values.get(label) for label in param_labels]
+    return list(truth_values)
+
+
+def plot_posteriors_streaming(chain, discard, param_labels, cap=None, weights=None,
+                              truth_values=None, figsize=None, n_cols=4):
+    """Plots marginal posterior of each parameter from streamed histograms
+
+    Shows the mode and 68% highest-density interval (see chain_stats.get_summary)
+    """
+    ranges, hist, edges, _ = get_streaming_hists(chain, discard=discard, cap=cap,
+                                                 weights=weights)
+    truths = get_truth_list(truth_values, param_labels=param_labels)
+    n_dim = len(hist)
+    n_rows = ceil(n_dim / n_cols)
+    fig, ax = plt.subplots(n_rows, n_cols, figsize=figsize, squeeze=False)
+
+    for i, axis in enumerate(ax.flat):
+        if i >= n_dim:
+            axis.axis('off')
+            continue
+
+        density = hist[i] / np.max(hist[i])
+        lower, centre, upper = chain_stats.get_credible_interval(hist[i], edges[i])
+        axis.step(edges[i], np.append(density, density[-1]), where='post', color='C0')
+        axis.axvspan(lower, upper, color='C0', alpha=0.2)
+        axis.axvline(centre, color='C0', ls='--')
+
+        if truths[i] is not None:
+            axis.axvline(truths[i], color='k')
+
+        axis.set_xlabel(param_labels[i])
+        axis.set_yticks([])
+        axis.set_ylim(bottom=0)
+
+    return fig
+
+
+def plot_contours_streaming(chain, discard, param_labels, cap=None, weights=None,
+                            truth_values=None, n_bins_2d=50):
+    """Plots corner plot of posterior contours (68%, 95%) from streamed histograms
+    """
+    n_dim = chain.shape[2]
+    pairs = [(i, j) for i in range(n_dim) for j in range(i)]
+    ranges, hist, edges, hist_2d = get_streaming_hists(chain, discard=discard, cap=cap,
+                                                       weights=weights, pairs=pairs)
+    truths = get_truth_list(truth_values, param_labels=param_labels)
+    centres = chain_stats.get_edges(ranges, n_bins=n_bins_2d)
+    centres = 0.5 * (centres[:, 1:] + centres[:, :-1])
+
+    size = 1.5 * n_dim
+    fig, ax = plt.subplots(n_dim, n_dim, figsize=[size, size], squeeze=False)
+
+    for i in range(n_dim):
+        for j in range(n_dim):
+            axis = ax[i, j]
+            if j > i:
+                axis.axis('off')
+                continue
+
+            if i == j:
+                density = hist[i] / np.max(hist[i])
+                axis.step(edges[i], np.append(density, density[-1]), where='post',
+                          color='C0')
+                axis.set_ylim(bottom=0)
+                axis.set_yticks([])
+            else:
+                levels = chain_stats.get_contour_levels(hist_2d[(i, j)])
+                levels = np.append(levels, np.max(hist_2d[(i, j)]))
+                axis.contourf(centres[j], centres[i], hist_2d[(i, j)], levels=levels,
+                              colors=['C0', 'C0'], alpha=0.4)
+                axis.contour(centres[j], centres[i], hist_2d[(i, j)],
+                             levels=levels[:-1], colors='C0', linewidths=0.8)
+                axis.set_ylim(ranges[i])
+                if truths[i] is not None:
+                    axis.axhline(truths[i], color='k', lw=0.8)
+
+            if truths[j] is not None:
+                axis.axvline(truths[j], color='k', lw=0.8)
+            axis.set_xlim(ranges[j])
+
+            if i == n_dim - 1:
+                axis.set_xlabel(param_labels[j])
+            else:
+                axis.xaxis.set_major_formatter(NullFormatter())
+            if (j == 0) and (i > 0):
+                axis.set_ylabel(param_labels[i])
+            elif i != j:
+                axis.yaxis.set_major_formatter(NullFormatter())
+
+    fig.subplots_adjust(hspace=0.05, wspace=0.05)
+    return fig
+
+
+def slice_weights(weights, discard, cap=None):
+    """Returns flattened sample weights (or None), sliced in the same way as the chain
+    """
+    if weights is None:
+        return None
+    return np.asarray(weights)[:, discard:cap].reshape(-1)
+
+
 def get_mass_radius(chain, discard, source, version, cap=None):
     """Returns GR mass and radius given a chain containing gravity and redshift
 
@@ -330,6 +519,7 @@ def get_mass_radius(chain, discard, source, version, cap=None):
     ref_mass = 1.4
     ref_radius = 10
 
+    discard = mcmc_tools.get_discard(discard, chain=chain, source=source, version=version)
     chain = mcmc_tools.slice_chain(chain, discard=discard, cap=cap)
     n_walkers, n_steps, n_dimensions = chain.shape
     chain_flat = chain.reshape((-1, n_dimensions))
@@ -343,11 +533,9 @@ def get_mass_radius(chain, discard, source, version, cap=None):
         radius_gr = ref_radius * xi
     else:
         redshift = chain_flat[:, pkeys.index('redshift')]
-        g_reference = gravity.get_acceleration_newtonian(r=ref_radius, m=ref_mass)
+        g_reference = gravity.get_acceleration_newtonian_raw(r=ref_radius, m=ref_mass)
         g = chain_flat[:, pkeys.index('g')] * g_reference
-        mass_gr, radius_gr = gravity.get_mass_radius(g=g, redshift=redshift)
-        mass_gr = mass_gr.value
-        radius_gr = radius_gr.value
+        mass_gr, radius_gr = gravity.get_mass_radius_raw(g=g, redshift=redshift)
 
     # reshape back into chain
     new_shape = (n_walkers, n_steps)
@@ -362,14 +550,13 @@ def get_mass_radius_point(params, source, version):
     """
     ref_mass = 1.4
     ref_radius = 10
-    g_reference = gravity.get_acceleration_newtonian(r=ref_radius, m=ref_mass)
+    g_reference = gravity.get_acceleration_newtonian_raw(r=ref_radius, m=ref_mass)
 
     pkeys = mcmc_versions.get_parameter(source, version, 'param_keys')
 
     redshift = params[pkeys.index('redshift')]
     g = params[pkeys.index('g')] * g_reference
-    mass, radius = gravity.get_mass_radius(g=g, redshift=redshift)
-    return mass.value, radius.value
+    return gravity.get_mass_radius_raw(g=g, redshift=redshift)
 
 
 def plot_max_lhood(source, version, n_walkers, n_steps, verbose=True, re_interp=False,
@@ -6,19 +6,27 @@ import pickle
 from pyburst.misc import pyprint
 from pyburst.grids import grid_strings
 from . import mcmc_versions
+from . import chain_store
+from . import autocorr
+from . import ptsampler
 
 GRIDS_PATH = os.environ['KEPLER_GRIDS']
+CHECKPOINT_VERSION = 1
 
 
-def slice_chain(chain, discard=None, cap=None):
+def slice_chain(chain, discard=None, cap=None, thin=None):
     """Return a subset of a chain
 
+    Returns a view (not a copy), so slicing a memory-mapped chain reads nothing
+
     parameters
     ----------
     discard : int
         number of steps to discard (from start)
     cap : int, optional
          step number of endpoint
+    thin : int, optional
+        keep only every thin'th step
     """
     cap = {None: chain.shape[1]}.get(cap, cap)  # default to final step
     discard = {None: 0}.get(discard, discard)  # default to discard 0
@@ -33,12 +41,28 @@ def slice_chain(chain, discard=None, cap=None):
             print("LTZ")
             raise ValueError(f"{name} ({val}) can't be negative")
 
-    return chain[:, discard:cap, :]
+    return chain[:, discard:cap:thin, :]
 
 
-def load_chain(source, version, n_steps, n_walkers, verbose=True):
+def load_chain(source, version, n_steps, n_walkers, verbose=True, mmap=True):
     """Loads from file and returns np array of chain
+
+    If a chain store exists for the run (see chain_store.py), returns a lazy
+    memory-mapped view of the chain, capped at n_steps (all steps if None).
+    Otherwise, loads the chain_*_S{n_steps}.npy file
+
+    mmap : bool
+        memory-map the .npy file (read lazily), instead of loading it into memory
     """
+    if os.path.exists(get_chain_store_path(source, version=version,
+                                           n_walkers=n_walkers)):
+        store = load_chain_store(source, version=version, n_walkers=n_walkers,
+                                 verbose=verbose)
+        if (n_steps is not None) and (n_steps > store.n_steps):
+            raise ValueError(f'n_steps ({n_steps}) is larger than the number '
+                             f'of steps in store ({store.n_steps})')
+        return store.get_chain(cap=n_steps)
+
     filename = get_mcmc_string(source=source, version=version,
                                n_steps=n_steps, n_walkers=n_walkers,
                                prefix='chain', extension='.npy')
@@ -47,7 +71,67 @@ def load_chain(source, version, n_steps, n_walkers, verbose=True):
     filepath = os.path.join(mcmc_path, filename)
     pyprint.printv(f'Loading chain: {filepath}', verbose=verbose)
 
-    return np.load(filepath)
+    return np.load(filepath, mmap_mode='r' if mmap else None)
+
+
+def get_chain_store_path(source, version, n_walkers):
+    """Returns filepath of the chain store for a run
+    """
+    filename = get_mcmc_string(source=source, version=version, n_walkers=n_walkers,
+                               prefix='chain', extension='.store')
+    return os.path.join(get_mcmc_path(source), filename)
+
+
+def load_chain_store(source, version, n_walkers, mode='r', n_dim=None,
+                     blob_fields=None, verbose=True):
+    """Returns ChainStore of a run (see chain_store.py)
+
+    mode : str
+        'r' (read-only) or 'a' (append, creating the store if needed)
+    n_dim : int
+        number of dimensions, required if creating a new store
+    blob_fields : list (optional)
+        layout of blobs to store, if creating a new store (see BurstFit.get_blob_fields)
+    """
+    filepath = get_chain_store_path(source, version=version, n_walkers=n_walkers)
+    pyprint.printv(f'Loading chain store: {filepath}', verbose=verbose)
+    return chain_store.ChainStore(filepath, mode=mode, n_walkers=n_walkers, n_dim=n_dim,
+                                  blob_fields=blob_fields)
+
+
+def load_blob(source, version, n_walkers, name, discard=None, cap=None, verbose=True):
+    """Returns derived quantity saved in the blobs of a run's chain store
+
+    e.g. name='rate' returns the model burst rate of every sample,
+    shape (n_walkers, n_steps, n_epochs). See BurstFit.get_blob_fields
+    """
+    store = load_chain_store(source, version=version, n_walkers=n_walkers,
+                             verbose=verbose)
+    return store.get_blob(name, discard=discard, cap=cap)
+
+
+def convert_chain_to_store(source, version, n_steps, n_walkers, verbose=True):
+    """Converts a chain_*_S{n_steps}.npy file into a new chain store
+
+    lnprob is not saved in the chain files, so is set to NaN, and acceptances
+    are inferred from changes in walker positions (first step assumed accepted)
+    """
+    chain = load_chain(source, version=version, n_steps=n_steps,
+                       n_walkers=n_walkers, verbose=verbose)
+    n_dim = chain.shape[2]
+    store = load_chain_store(source, version=version, n_walkers=n_walkers, mode='a',
+                             n_dim=n_dim, verbose=verbose)
+    if store.n_steps > 0:
+        raise RuntimeError(f'Chain store already contains {store.n_steps} steps')
+
+    lnprob = np.full(n_walkers, np.nan)
+    for i in range(n_steps):
+        accepted = np.full(n_walkers, True) if i == 0 else \
+            np.any(chain[:, i] != chain[:, i-1], axis=1)
+        store.append(chain[:, i], lnprob=lnprob, accepted=accepted)
+
+    store.flush()
+    return store
 
 
 def get_mcmc_string(source, version, n_walkers=None, n_steps=None,
@@ -74,19 +158,41 @@ def get_mcmc_string(source, version, n_walkers=None, n_steps=None,
 def get_max_lhood_params(source, version, n_walkers, n_steps, verbose=True,
                          return_lhood=False):
     """Returns the point with the highest likelihood
+
+    Uses the best-point record of the run's checkpoint if available (and n_steps
+    is None or matches), otherwise searches the chain store, or sampler file
     """
-    sampler_state = load_sampler_state(source=source, version=version,
-                                       n_steps=n_steps, n_walkers=n_walkers)
+    store_path = get_chain_store_path(source, version=version, n_walkers=n_walkers)
+    checkpoint_path = get_checkpoint_path(source, version=version, n_walkers=n_walkers)
+    checkpoint = None
+
+    if os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(source, version=version, n_walkers=n_walkers)
+        if (n_steps is not None) and (n_steps != checkpoint['n_steps']):
+            checkpoint = None
+
+    if (checkpoint is not None) and np.isfinite(checkpoint['best_lnprob']):
+        max_lhood = checkpoint['best_lnprob']
+        max_params = checkpoint['best_params']
+    elif os.path.exists(store_path):
+        store = chain_store.ChainStore(store_path)
+        lnprob = np.array(store.get_lnprob(cap=n_steps))
+        walker_i, step_i = np.unravel_index(np.nanargmax(lnprob), lnprob.shape)
+        max_lhood = lnprob[walker_i, step_i]
+        max_params = np.array(store.get_chain(cap=n_steps)[walker_i, step_i])
+    else:
+        sampler_state = load_sampler_state(source=source, version=version,
+                                           n_steps=n_steps, n_walkers=n_walkers)
 
-    chain = sampler_state['_chain']
-    lnprob = sampler_state['_lnprob']
+        chain = sampler_state['_chain']
+        lnprob = sampler_state['_lnprob']
 
-    max_idx = np.argmax(lnprob)
-    max_lhood = lnprob.flatten()[max_idx]
+        max_idx = np.argmax(lnprob)
+        max_lhood = lnprob.flatten()[max_idx]
 
-    n_dimensions = sampler_state['dim']
-    flat_chain = chain.reshape((-1, n_dimensions))
-    max_params = flat_chain[max_idx]
+        n_dimensions = sampler_state['dim']
+        flat_chain = chain.reshape((-1, n_dimensions))
+        max_params = flat_chain[max_idx]
 
     if verbose:
         print(f'max_lhood = {max_lhood:.2f}')
@@ -122,6 +228,212 @@ def get_random_params(key, n_models, mv):
     return rand * range_ + bounds[0]
 
 
+def get_checkpoint_path(source, version, n_walkers):
+    """Returns filepath of the sampler checkpoint for a run
+    """
+    filename = get_mcmc_string(source=source, version=version, n_walkers=n_walkers,
+                               prefix='checkpoint', extension='.npz')
+    return os.path.join(get_mcmc_path(source), filename)
+
+
+def get_telemetry_path(source, version, n_walkers):
+    """Returns filepath of the telemetry stream (JSON-lines) of a run
+    """
+    filename = get_mcmc_string(source=source, version=version, n_walkers=n_walkers,
+                               prefix='telemetry', extension='.jsonl')
+    return os.path.join(get_mcmc_path(source), filename)
+
+
+def get_checkpoint(sampler, store, previous=None, autocorr=None, burn_factor=2,
+                   accept_offset=0):
+    """Returns checkpoint (dict) of the current sampler state
+
+    Holds only what's needed to restart a run (current walkers and random state),
+    acceptance counters, and a record of the best point so far. The chain itself
+    is in the chain store
+
+    parameters
+    ----------
+    sampler : EnsembleSampler|PTSampler
+        for a PTSampler, also saves the state of every temperature, and
+        the evidence estimate (see ptsampler.py)
+    store : ChainStore
+        chain store that sampler has been writing to
+    previous : dict (optional)
+        previous checkpoint of the same run. Only steps since this
+        checkpoint will be searched for a new best point
+    autocorr : AutocorrTracker (optional)
+        if provided, saves its state, and the recommended burn-in, and
+        the tau and ess after discarding it
+    burn_factor : float
+        burn-in recommended as burn_factor * max(tau)
+    accept_offset : int
+        number of initial steps not counted in sampler.naccepted (e.g. a restarted
+        run without a checkpoint, see seed_acceptance). Taken from previous if given
+    """
+    pos, lnprob = store.last_step()
+    n_steps = store.n_steps
+    rstate = sampler.random_state
+
+    checkpoint = {'checkpoint_version': CHECKPOINT_VERSION,
+                  'n_steps': n_steps,
+                  'pos': pos,
+                  'lnprob': lnprob,
+                  'naccepted': np.array(sampler.naccepted),
+                  'accept_offset': accept_offset,
+                  'rstate_keys': rstate[1],
+                  'rstate_pos': rstate[2],
+                  'rstate_has_gauss': rstate[3],
+                  'rstate_cached_gaussian': rstate[4],
+                  'best_params': np.full(store.n_dim, np.nan),
+                  'best_lnprob': -np.inf,
+                  'best_step': -1,
+                  }
+
+    if autocorr is not None:
+        burn_in = autocorr.get_burn_in(burn_factor=burn_factor)
+        checkpoint['tau'] = autocorr.get_tau(discard=burn_in)
+        checkpoint['ess'] = autocorr.get_ess(discard=burn_in)
+        checkpoint['burn_in'] = -1 if burn_in is None else burn_in
+        checkpoint['converged'] = autocorr.converged
+        checkpoint.update(autocorr.get_state())
+
+    if isinstance(sampler, ptsampler.PTSampler):
+        checkpoint.update(sampler.get_state())
+
+    step0 = 0
+    if previous is not None:
+        step0 = previous['n_steps']
+        checkpoint['accept_offset'] = previous.get('accept_offset', 0)
+        for key in ('best_params', 'best_lnprob', 'best_step'):
+            checkpoint[key] = previous[key]
+
+    new_lnprob = np.array(store.get_lnprob(discard=step0))
+    if new_lnprob.size > 0 and not np.isnan(new_lnprob).all():
+        walker_i, step_i = np.unravel_index(np.nanargmax(new_lnprob), new_lnprob.shape)
+
+        if new_lnprob[walker_i, step_i] > checkpoint['best_lnprob']:
+            checkpoint['best_lnprob'] = new_lnprob[walker_i, step_i]
+            checkpoint['best_step'] = step0 + step_i
+            checkpoint['best_params'] = np.array(store.records()[step0 + step_i]
+                                                 ['chain'][walker_i])
+    return checkpoint
+
+
+def save_checkpoint(checkpoint, source, version, n_walkers):
+    """Saves checkpoint to file (atomically, replacing any existing checkpoint)
+    """
+    filepath = get_checkpoint_path(source, version=version, n_walkers=n_walkers)
+    tmp_filepath = f'{filepath}.tmp'
+
+    with open(tmp_filepath, 'wb') as f:
+        np.savez(f, **checkpoint)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_filepath, filepath)
+    print(f'Saved checkpoint: {filepath}')
+
+
+def load_checkpoint(source, version, n_walkers):
+    """Loads checkpoint from file, and returns as dict
+    """
+    filepath = get_checkpoint_path(source, version=version, n_walkers=n_walkers)
+
+    with np.load(filepath) as f:
+        checkpoint = dict(f)
+
+    if checkpoint['checkpoint_version'] > CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint version ({checkpoint['checkpoint_version']}) "
+                         f"is newer than supported ({CHECKPOINT_VERSION})")
+
+    for key in ('n_steps', 'rstate_pos', 'rstate_has_gauss', 'best_step', 'burn_in',
+                'pt_iterations', 'accept_offset'):
+        if key in checkpoint:
+            checkpoint[key] = int(checkpoint[key])
+    for key in ('rstate_cached_gaussian', 'best_lnprob'):
+        checkpoint[key] = float(checkpoint[key])
+
+    return checkpoint
+
+
+def get_burn_in(source, version, n_walkers):
+    """Returns recommended burn-in (steps to discard) saved in run's checkpoint
+
+    Returns None if not available (no checkpoint, or tau not yet estimated)
+    """
+    filepath = get_checkpoint_path(source, version=version, n_walkers=n_walkers)
+    if not os.path.exists(filepath):
+        return None
+
+    checkpoint = load_checkpoint(source, version=version, n_walkers=n_walkers)
+    burn_in = checkpoint.get('burn_in', -1)
+    return None if burn_in < 0 else burn_in
+
+
+def get_discard(discard, chain, source, version):
+    """Returns discard, replacing discard='auto' with the run's recommended burn-in
+    """
+    if discard != 'auto':
+        return discard
+
+    burn_in = get_burn_in(source, version=version, n_walkers=chain.shape[0])
+    if burn_in is None:
+        raise ValueError("No burn-in saved for this run, can't use discard='auto'")
+    return burn_in
+
+
+def get_autocorr(checkpoint):
+    """Returns AutocorrTracker restored from checkpoint (None if not saved,
+    or saved in an older format)
+    """
+    if 'autocorr_means' not in checkpoint:
+        return None
+
+    return autocorr.AutocorrTracker.from_state(checkpoint)
+
+
+def get_checkpoint_rstate(checkpoint):
+    """Returns random state tuple (as used by numpy/emcee) from checkpoint
+    """
+    return ('MT19937', checkpoint['rstate_keys'], checkpoint['rstate_pos'],
+            checkpoint['rstate_has_gauss'], checkpoint['rstate_cached_gaussian'])
+
+
+def restore_sampler(sampler, checkpoint):
+    """Restores acceptance counters and random state of sampler from checkpoint
+
+    For a PTSampler, also restores every temperature (if saved), including
+    its own iteration count (which sets ladder adaptation and evidence burn-in)
+    """
+    if isinstance(sampler, ptsampler.PTSampler) and ('pt_betas' in checkpoint):
+        sampler.set_state(checkpoint)
+    else:
+        sampler.iterations = checkpoint['n_steps']
+
+    sampler.naccepted = np.array(checkpoint['naccepted'])
+    sampler.random_state = get_checkpoint_rstate(checkpoint)
+
+
+def seed_acceptance(sampler, source, version, n_steps, n_walkers):
+    """Seeds acceptance counters of sampler when restarting a run without a checkpoint
+
+    Uses the legacy sampler state file at n_steps (see save_sampler_state) if it
+    exists. Returns the number of steps not counted in sampler.naccepted:
+    0 if seeded, otherwise n_steps (see get_checkpoint)
+    """
+    try:
+        sampler_state = load_sampler_state(source, version=version, n_steps=n_steps,
+                                           n_walkers=n_walkers)
+    except FileNotFoundError:
+        print('No sampler state found, acceptance fraction will only count new steps')
+        return n_steps
+
+    sampler.naccepted = np.array(sampler_state['naccepted'])
+    sampler.iterations = n_steps
+    return 0
+
+
 def save_sampler_state(sampler, source, version, n_steps, n_walkers):
     """Saves sampler state as dict
     """
@@ -1,4 +1,5 @@
 import numpy as np
+import functools
 from scipy.stats import norm
 
 # kepler_grids
@@ -225,6 +226,42 @@ prior_pdfs = {
 }
 
 
+# ===== closed-form log-densities of prior pdfs (see get_prior_lnpdf) =====
+def gaussian_lnpdf(x, loc, scale):
+    return -0.5 * ((x - loc) / scale)**2 - np.log(scale * np.sqrt(2 * np.pi))
+
+
+def flat_lnpdf(x):
+    return np.zeros(np.shape(x))
+
+
+def sin_lnpdf(x):
+    return np.log(np.sin(x))
+
+
+def log_of_pdf(x, pdf):
+    return np.log(pdf(x))
+
+
+def get_prior_lnpdf(pdf):
+    """Returns log-density function equivalent to log(pdf(x)), for arrays of x
+
+    Known pdfs (flat_prior, np.sin, frozen scipy norm) are replaced with
+    closed forms, which avoids the scipy call overhead and underflow in the tails
+    """
+    if pdf is flat_prior:
+        return flat_lnpdf
+    elif pdf is np.sin:
+        return sin_lnpdf
+
+    frozen = getattr(pdf, '__self__', None)
+    if (getattr(pdf, '__name__', None) == 'pdf'
+            and isinstance(getattr(frozen, 'dist', None), type(norm))):
+        return functools.partial(gaussian_lnpdf, loc=frozen.mean(), scale=frozen.std())
+
+    return functools.partial(log_of_pdf, pdf=pdf)
+
+
 # ===== initial position of walkers =====
 initial_position = {
     1: {
@@ -537,6 +574,8 @@ class McmcVersion:
         self.prior_bounds = np.array(self.get_parameter('prior_bounds'))
         self.initial_position = self.get_parameter('initial_position')
         self.prior_pdfs = self.get_prior_pdfs()
+        self.prior_lnpdfs = {var: get_prior_lnpdf(pdf)
+                             for var, pdf in self.prior_pdfs.items()}
         self.synthetic = source_defaults['synthetic'][source]
         self.disc_model = None
 
@@ -0,0 +1,399 @@
+import numpy as np
+from emcee.ptsampler import default_beta_ladder
+
+# =============================================================================
+# Parallel-tempered ensemble sampler
+#
+# Runs an ensemble of walkers at each of a ladder of temperatures
+# (beta = 1/T, with beta=1 the posterior), sampling
+#       beta * lnlike + lnprior
+# using the affine-invariant stretch move (as in emcee.EnsembleSampler),
+# then proposing swaps of walkers between neighbouring temperatures.
+#
+# Every walker of every temperature is evaluated in a single call to
+# BurstFit.lhood_batch (i.e. one stacked query of the one Kemulator).
+#
+# The interior of the ladder adapts towards equal swap acceptance between
+# all neighbouring temperatures (Vousden, Farr & Mandel 2016), with
+# adaptation decaying over adapt_lag steps.
+#
+# Only the beta=1 ensemble is yielded from sample(), so it can be used in
+# place of emcee.EnsembleSampler in mcmc.run_sampler, with the chain store,
+# autocorr tracking and checkpointing all seeing the posterior ensemble.
+# Mean lnlike at each temperature is recorded every step, giving a
+# thermodynamic-integration estimate of the evidence (see get_log_evidence)
+# =============================================================================
+
+
+class PTSampler:
+    """Parallel-tempered ensemble sampler of a BurstFit likelihood
+
+    parameters
+    ----------
+    n_temps : int
+        number of temperatures
+    n_walkers : int
+        walkers per temperature
+    n_dim : int
+    bfit : BurstFit
+    betas : 1darray (optional)
+        initial inverse temperatures, starting at 1.
+        Default is emcee's ladder for n_dim (or geometric up to t_max)
+    t_max : float (optional)
+        highest temperature of the default ladder
+    a : float
+        stretch move scale
+    adapt : bool
+        adapt temperature spacing during sampling
+    adapt_lag : float
+        steps over which adaptation decays
+    adapt_rate : float
+        inverse rate of adaptation (larger is slower)
+    pool : (optional)
+        pool with a map() method, over which each batch is split
+    n_threads : int
+        number of processes in pool (each batch is split into this many chunks)
+    """
+
+    def __init__(self, n_temps, n_walkers, n_dim, bfit, betas=None, t_max=None,
+                 a=2.0, adapt=True, adapt_lag=1000, adapt_rate=100, pool=None,
+                 n_threads=1):
+        if n_walkers % 2 != 0:
+            raise ValueError(f'n_walkers ({n_walkers}) must be even')
+
+        if betas is None:
+            if t_max is None:
+                betas = default_beta_ladder(n_dim, ntemps=n_temps)
+            else:
+                betas = np.geomspace(1, 1 / t_max, n_temps)
+
+        self.betas = np.array(betas, dtype=float)
+        if (len(self.betas) != n_temps) or (self.betas[0] != 1):
+            raise ValueError(f'betas must have length n_temps ({n_temps}), '
+                             'and start at 1')
+
+        self.n_temps = n_temps
+        self.n_walkers = n_walkers
+        self.n_dim = n_dim
+        self.bfit = bfit
+        self.a = a
+        self.adapt = adapt
+        self.adapt_lag = adapt_lag
+        self.adapt_rate = adapt_rate
+        self.pool = pool
+        self.n_threads = n_threads
+        self._random = np.random.mtrand.RandomState()
+        self.reset()
+
+    def __repr__(self):
+        return (f'PTSampler: n_temps={self.n_temps}, n_walkers={self.n_walkers}'
+                + f'\nbetas : {self.betas}')
+
+    def reset(self):
+        """Clears walker state, stored chain and counters
+        """
+        shape = (self.n_temps, self.n_walkers)
+        self.iterations = 0
+        self.naccepted = np.zeros(self.n_walkers)  # beta=1 only, as in emcee
+        self.nprop_accepted = np.zeros(shape)
+        self.nswap = np.zeros(self.n_temps - 1)
+        self.nswap_accepted = np.zeros(self.n_temps - 1)
+
+        self.pos = None      # (n_temps, n_walkers, n_dim)
+        self.lnlike = None   # (n_temps, n_walkers)
+        self.lnprior = None  # (n_temps, n_walkers)
+        self.blobs = None    # (n_temps, n_walkers, n_blob)
+
+        self.mean_lnlike = []  # per step, (n_temps,)
+        self.beta_history = []  # per step, (n_temps,)
+
+        self._chain = []
+        self._lnprob = []
+        self._blobs = []
+
+    # ===== emcee.EnsembleSampler interface (beta=1 ensemble) =====
+    @property
+    def random_state(self):
+        return self._random.get_state()
+
+    @random_state.setter
+    def random_state(self, state):
+        self._random.set_state(state)
+
+    @property
+    def chain(self):
+        return np.array(self._chain).transpose(1, 0, 2)
+
+    @property
+    def lnprobability(self):
+        return np.array(self._lnprob).transpose()
+
+    @property
+    def acceptance_fraction(self):
+        return self.naccepted / self.iterations
+
+    @property
+    def tswap_acceptance_fraction(self):
+        """Fraction of accepted swaps between each pair of neighbouring temperatures
+        """
+        return self.nswap_accepted / np.maximum(self.nswap, 1)
+
+    def sample(self, p0, lnprob0=None, rstate0=None, blobs0=None, iterations=1,
+               storechain=True):
+        """Advances all temperatures for given iterations, as a generator
+
+        Yields (pos, lnprob, rstate[, blobs]) of the beta=1 ensemble
+
+        p0 : ndarray
+            starting positions, shape (n_temps, n_walkers, n_dim), or
+            (n_walkers, n_dim), which continues from the current state if it
+            matches its beta=1 ensemble, otherwise is copied to every temperature
+        lnprob0, blobs0 : (optional)
+            unused (kept for compatibility with EnsembleSampler). All
+            temperatures are evaluated where no state is held
+        """
+        if rstate0 is not None:
+            self.random_state = rstate0
+        self.setup_state(p0)
+
+        for i in range(iterations):
+            for half in (0, 1):
+                self.stretch_move(half)
+
+            self.swap_temperatures()
+            if self.adapt:
+                self.adapt_betas()
+
+            self.iterations += 1
+            self.mean_lnlike += [np.mean(self.lnlike, axis=1)]
+            self.beta_history += [self.betas.copy()]
+
+            pos = self.pos[0].copy()
+            lnprob = self.get_lnprob(beta=1.0, lnlike=self.lnlike[0],
+                                     lnprior=self.lnprior[0])
+            result = (pos, lnprob, self.random_state)
+
+            blobs = None
+            if self.blobs is not None:
+                blobs = list(self.blobs[0].copy())
+                result += (blobs,)
+
+            if storechain:
+                self._chain += [pos]
+                self._lnprob += [lnprob]
+                self._blobs += [blobs]
+
+            yield result
+
+    # ===== moves =====
+    def setup_state(self, p0):
+        """Sets walker positions from p0, and evaluates them if needed
+        """
+        p0 = np.array(p0, dtype=float)
+
+        if p0.ndim == 3:
+            self.pos = p0
+            self.lnlike = None
+        elif (self.pos is None) or (not np.array_equal(p0, self.pos[0])):
+            self.pos = np.repeat(p0[np.newaxis], self.n_temps, axis=0)
+            self.lnlike = None
+
+        if (self.lnlike is None) or (self.blobs is None and self.bfit.return_blobs):
+            shape = (self.n_temps, self.n_walkers)
+            lnlike, lnprior, blobs = self.evaluate(self.pos.reshape((-1, self.n_dim)))
+            self.lnlike = lnlike.reshape(shape)
+            self.lnprior = lnprior.reshape(shape)
+            if blobs is not None:
+                self.blobs = blobs.reshape(shape + (-1,))
+
+    def stretch_move(self, half):
+        """Updates one half of the walkers (at every temperature),
+        using the other half as the complementary ensemble
+        """
+        n_half = self.n_walkers // 2
+        update = slice(half, None, 2)
+        sample = slice(1 - half, None, 2)
+
+        p_update = self.pos[:, update]
+        p_sample = self.pos[:, sample]
+
+        z = ((self.a - 1.0) * self._random.rand(self.n_temps, n_half) + 1)**2 / self.a
+        js = self._random.randint(n_half, size=(self.n_temps, n_half))
+        temp_idxs = np.arange(self.n_temps)[:, np.newaxis]
+
+        p_other = p_sample[temp_idxs, js]
+        proposal = p_other + z[:, :, np.newaxis] * (p_update - p_other)
+
+        lnlike, lnprior, blobs = self.evaluate(proposal.reshape((-1, self.n_dim)))
+        lnlike = lnlike.reshape((self.n_temps, n_half))
+        lnprior = lnprior.reshape((self.n_temps, n_half))
+
+        betas = self.betas[:, np.newaxis]
+        new_lnprob = self.get_lnprob(beta=betas, lnlike=lnlike, lnprior=lnprior)
+        old_lnprob = self.get_lnprob(beta=betas, lnlike=self.lnlike[:, update],
+                                     lnprior=self.lnprior[:, update])
+
+        with np.errstate(invalid='ignore'):  # -inf - -inf for invalid walkers
+            lnpdiff = (self.n_dim - 1.) * np.log(z) + new_lnprob - old_lnprob
+        accept = lnpdiff > np.log(self._random.rand(self.n_temps, n_half))
+
+        self.pos[:, update][accept] = proposal[accept]
+        self.lnlike[:, update][accept] = lnlike[accept]
+        self.lnprior[:, update][accept] = lnprior[accept]
+        if blobs is not None:
+            self.blobs[:, update][accept] = blobs.reshape((self.n_temps, n_half, -1))[accept]
+
+        self.nprop_accepted[:, update] += accept
+        self.naccepted[update] += accept[0]
+
+    def swap_temperatures(self):
+        """Proposes swapping walkers between each pair of neighbouring temperatures
+        (from hottest to coldest)
+        """
+        self.swap_accepted = np.zeros(self.n_temps - 1)
+
+        for i in range(self.n_temps - 1, 0, -1):
+            d_beta = self.betas[i - 1] - self.betas[i]
+            hot = self._random.permutation(self.n_walkers)
+            cold = self._random.permutation(self.n_walkers)
+
+            with np.errstate(invalid='ignore'):
+                ln_accept = d_beta * (self.lnlike[i, hot] - self.lnlike[i - 1, cold])
+            accept = ln_accept > np.log(self._random.rand(self.n_walkers))
+            hot = hot[accept]
+            cold = cold[accept]
+
+            for state in (self.pos, self.lnlike, self.lnprior, self.blobs):
+                if state is None:
+                    continue
+                hot_state = state[i, hot].copy()
+                state[i, hot] = state[i - 1, cold]
+                state[i - 1, cold] = hot_state
+
+            self.swap_accepted[i - 1] = np.mean(accept)
+            self.nswap[i - 1] += self.n_walkers
+            self.nswap_accepted[i - 1] += np.sum(accept)
+
+    def adapt_betas(self):
+        """Adjusts interior temperatures towards equal swap acceptance
+        (the coldest and hottest stay fixed)
+        """
+        if self.n_temps < 3:
+            return
+
+        decay = self.adapt_lag / (self.iterations + self.adapt_lag)
+        kappa = decay / self.adapt_rate
+        d_s = kappa * (self.swap_accepted[:-1] - self.swap_accepted[1:])
+
+        d_temps = np.diff(1 / self.betas[:-1]) * np.exp(d_s)
+        self.betas[1:-1] = 1 / (np.cumsum(d_temps) + 1 / self.betas[0])
+
+    # ===== likelihood =====
+    def evaluate(self, params):
+        """Returns lnlike, lnprior, and blobs (or None) of params, shape (n, n_dim)
+        """
+        if self.pool is None:
+            out = self.bfit.lhood_batch(params)
+        else:
+            chunks = np.array_split(params, min(self.n_threads, len(params)))
+            results = list(self.pool.map(self.bfit.lhood_batch, chunks))
+            if self.bfit.return_blobs:
+                out = (np.concatenate([r[0] for r in results]),
+                       np.concatenate([r[1] for r in results]))
+            else:
+                out = np.concatenate(results)
+
+        blobs = None
+        if self.bfit.return_blobs:
+            out, blobs = out
+
+        lnprior = self.bfit.lnprior(params)
+        if self.pool is not None:
+            self.bfit.count_evals(lnprior=lnprior, lhood=out)
+
+        lnlike = np.full(len(params), -np.inf)
+        valid = np.isfinite(out) & np.isfinite(lnprior)
+        lnlike[valid] = out[valid] / self.bfit.lhood_factor - lnprior[valid]
+        return lnlike, lnprior, blobs
+
+    def get_lnprob(self, beta, lnlike, lnprior):
+        """Returns tempered log-probability (scaled by BurstFit.lhood_factor)
+        """
+        with np.errstate(invalid='ignore'):
+            lnprob = (beta * lnlike + lnprior) * self.bfit.lhood_factor
+        return np.where(np.isfinite(lnlike) & np.isfinite(lnprior), lnprob, -np.inf)
+
+    # ===== evidence =====
+    def get_log_evidence(self, discard=None):
+        """Returns thermodynamic-integration estimate of the log-evidence,
+        and its error (from the difference when using every second temperature)
+
+        lnZ = integral over beta (0 to 1) of mean lnlike at beta
+
+        discard : int (optional)
+            steps to discard (default: first half, including most of the
+            ladder adaptation)
+        """
+        if self.iterations == 0:
+            raise ValueError('No steps taken yet')
+        if discard is None:
+            discard = self.iterations // 2
+
+        mean_lnlike = np.mean(self.mean_lnlike[discard:], axis=0)
+        betas = np.mean(self.beta_history[discard:], axis=0)
+
+        ln_z = get_ti_evidence(betas, mean_lnlike)
+        ln_z2 = get_ti_evidence(betas[::2], mean_lnlike[::2])
+        return ln_z, np.abs(ln_z - ln_z2)
+
+    # ===== checkpointing =====
+    def get_state(self, prefix='pt_'):
+        """Returns state of all temperatures as dict of arrays (e.g. to save
+        in a checkpoint). Blobs are not saved, and are re-evaluated on restart
+        """
+        ln_z, ln_z_err = np.nan, np.nan
+        if self.iterations > 0:
+            ln_z, ln_z_err = self.get_log_evidence()
+
+        return {f'{prefix}betas': self.betas,
+                f'{prefix}iterations': self.iterations,
+                f'{prefix}pos': self.pos,
+                f'{prefix}lnlike': self.lnlike,
+                f'{prefix}lnprior': self.lnprior,
+                f'{prefix}nprop_accepted': self.nprop_accepted,
+                f'{prefix}nswap': self.nswap,
+                f'{prefix}nswap_accepted': self.nswap_accepted,
+                f'{prefix}mean_lnlike': np.array(self.mean_lnlike).reshape((-1, self.n_temps)),
+                f'{prefix}beta_history': np.array(self.beta_history).reshape((-1, self.n_temps)),
+                f'{prefix}ln_evidence': ln_z,
+                f'{prefix}ln_evidence_err': ln_z_err,
+                }
+
+    def set_state(self, state, prefix='pt_'):
+        """Restores state from get_state()
+        """
+        self.betas = np.array(state[f'{prefix}betas'], dtype=float)
+        self.iterations = int(state[f'{prefix}iterations'])
+        self.pos = np.array(state[f'{prefix}pos'], dtype=float)
+        self.lnlike = np.array(state[f'{prefix}lnlike'], dtype=float)
+        self.lnprior = np.array(state[f'{prefix}lnprior'], dtype=float)
+        self.blobs = None
+        self.nprop_accepted = np.array(state[f'{prefix}nprop_accepted'])
+        self.nswap = np.array(state[f'{prefix}nswap'])
+        self.nswap_accepted = np.array(state[f'{prefix}nswap_accepted'])
+        self.mean_lnlike = list(state[f'{prefix}mean_lnlike'])
+        self.beta_history = list(state[f'{prefix}beta_history'])
+
+
+def get_ti_evidence(betas, mean_lnlike):
+    """Returns log-evidence from thermodynamic integration (trapezoid rule),
+    taking mean lnlike at beta=0 to equal that of the hottest temperature
+
+    betas : 1darray
+        inverse temperatures, decreasing from 1
+    mean_lnlike : 1darray
+        mean lnlike at each beta
+    """
+    betas = np.concatenate([betas, [0]])
+    mean_lnlike = np.concatenate([mean_lnlike, mean_lnlike[-1:]])
+    return np.sum(0.5 * (mean_lnlike[1:] + mean_lnlike[:-1]) * -np.diff(betas))
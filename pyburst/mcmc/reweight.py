@@ -0,0 +1,178 @@
+import numpy as np
+import os
+
+# kepler_grids
+from pyburst.misc import pyprint
+from . import burstfit
+from . import mcmc_tools
+from . import mcmc_versions
+
+# =============================================================================
+# Importance-reweighting of an existing chain to a different set of priors
+#
+# For a version that only changes the priors (prior_pdfs/prior_bounds), each
+# sample of the old posterior is weighted by
+#       w = exp(lnprior_new - lnprior_old)
+# (the likelihood cancels), giving the new posterior without re-running the
+# mcmc. This only works while the new posterior lies well within the old one:
+# the effective sample size (ESS) of the weights measures how much is left
+#
+# Priors are evaluated directly from the versions' prior_lnpdfs and
+# prior_bounds (no BurstFit/emulator), in chunks of steps of the chain
+# =============================================================================
+
+
+def reweight_chain(source, version, new_version, n_walkers, n_steps=None,
+                   discard=None, min_ess_frac=0.01, chunk_steps=1000, verbose=True):
+    """Returns importance weights of a run's chain under a new version's priors,
+    and their effective sample size (ESS)
+
+    Weights have the same shape as the chain (n_walkers, n_steps), so can be
+    given to mcmc_plot (plot_contours, get_summary, etc.) along with the chain.
+    Raises ValueError if the reweighting is degenerate (see min_ess_frac)
+
+    parameters
+    ----------
+    source : str
+    version : int
+        version of the existing chain
+    new_version : int
+        version with the new priors (must have the same param_keys)
+    n_walkers : int
+    n_steps : int (optional)
+        step to cap the chain at (default all saved steps)
+    discard : int|'auto' (optional)
+        steps to discard when computing the ESS
+    min_ess_frac : flt
+        raise an error if the ESS is less than this fraction of the
+        (post-discard) samples (set to 0 to always return the weights)
+    chunk_steps : int
+        steps of the chain to evaluate priors for at a time
+    """
+    chain = mcmc_tools.load_chain(source, version=version, n_steps=n_steps,
+                                  n_walkers=n_walkers, verbose=verbose)
+    discard = mcmc_tools.get_discard(discard, chain=chain, source=source, version=version)
+    check_param_keys(source, version=version, new_version=new_version)
+
+    lnprior_old = get_lnprior(source, version=version, n_walkers=n_walkers,
+                              chain=chain, chunk_steps=chunk_steps, verbose=verbose)
+    lnprior_new = get_chain_lnprior(source, version=new_version, chain=chain,
+                                    chunk_steps=chunk_steps)
+
+    weights = get_weights(lnprior_new - lnprior_old)
+    ess = get_ess(weights[:, discard:])
+    n_samples = weights[:, discard:].size
+
+    tau = get_tau(source, version=version, n_walkers=n_walkers)
+    if not check_ess(ess, n_samples=n_samples, min_ess_frac=min_ess_frac, tau=tau,
+                     verbose=verbose):
+        raise ValueError(f'Reweighting is degenerate: ESS ({ess:.1f}) is '
+                         f'{100 * ess / n_samples:.2f}% of samples '
+                         f'(min_ess_frac={min_ess_frac}). '
+                         'The new priors need a new mcmc run')
+    return weights, ess
+
+
+def get_lnprior(source, version, n_walkers, chain, chunk_steps=1000, verbose=True):
+    """Returns lnprior of each sample of a chain, shape (n_walkers, n_steps)
+
+    Uses the lnprior saved in the chain store's blobs if available,
+    otherwise re-evaluates it (see get_chain_lnprior)
+    """
+    store_path = mcmc_tools.get_chain_store_path(source, version=version,
+                                                 n_walkers=n_walkers)
+    if os.path.exists(store_path):
+        store = mcmc_tools.load_chain_store(source, version=version,
+                                            n_walkers=n_walkers, verbose=False)
+        if (store.blob_fields is not None) and ('lnprior' in store.blob_slices):
+            pyprint.printv('Using lnprior saved in blobs', verbose=verbose)
+            return np.array(store.get_blob('lnprior', cap=chain.shape[1]))
+
+    return get_chain_lnprior(source, version=version, chain=chain,
+                             chunk_steps=chunk_steps)
+
+
+def get_chain_lnprior(source, version, chain, chunk_steps=1000):
+    """Returns lnprior of each sample of a chain under a version's priors,
+    shape (n_walkers, n_steps)
+
+    chunk_steps : int
+        steps of the chain to evaluate at a time (only one chunk of the
+        chain is read into memory at once)
+    """
+    mcmc_version = mcmc_versions.McmcVersion(source=source, version=version)
+    n_walkers, n_steps, n_dim = chain.shape
+    lnprior = np.empty((n_walkers, n_steps))
+
+    for i0 in range(0, n_steps, chunk_steps):
+        i1 = min(i0 + chunk_steps, n_steps)
+        chunk = np.reshape(chain[:, i0:i1], (-1, n_dim))
+        lnprior[:, i0:i1] = burstfit.get_lnprior(chunk, mcmc_version=mcmc_version
+                                                 ).reshape((n_walkers, i1 - i0))
+    return lnprior
+
+
+def get_weights(log_weights):
+    """Returns weights normalised to a maximum of 1 (0 outside the new priors)
+    """
+    log_weights = np.asarray(log_weights, dtype=float)
+    finite = np.isfinite(log_weights)
+    if not finite.any():
+        raise ValueError('No samples lie within the new priors')
+
+    weights = np.zeros_like(log_weights)
+    weights[finite] = np.exp(log_weights[finite] - np.max(log_weights[finite]))
+    return weights
+
+
+def get_ess(weights):
+    """Returns the (Kish) effective sample size of weights
+    """
+    return np.sum(weights)**2 / np.sum(weights**2)
+
+
+def get_tau(source, version, n_walkers):
+    """Returns max autocorrelation time saved in run's checkpoint (None if not available)
+    """
+    filepath = mcmc_tools.get_checkpoint_path(source, version=version, n_walkers=n_walkers)
+    if not os.path.exists(filepath):
+        return None
+
+    checkpoint = mcmc_tools.load_checkpoint(source, version=version, n_walkers=n_walkers)
+    tau = checkpoint.get('tau')
+    if (tau is None) or np.isnan(tau).any():
+        return None
+    return np.max(tau)
+
+
+def check_ess(ess, n_samples, min_ess_frac=0.01, tau=None, verbose=True):
+    """Prints ESS of the weights
+
+    Returns True if ESS is at least min_ess_frac of n_samples
+    (i.e. the reweighting isn't degenerate)
+
+    tau : flt (optional)
+        autocorrelation time of the chain, to also give the number of
+        independent samples
+    """
+    ess_frac = ess / n_samples
+    pyprint.printv(f'Effective sample size: {ess:.1f} of {n_samples} '
+                   f'({100 * ess_frac:.2f}%)', verbose=verbose)
+
+    if tau is not None:
+        pyprint.printv(f'Independent samples: {ess / tau:.1f} (tau={tau:.1f})',
+                       verbose=verbose)
+
+    return ess_frac >= min_ess_frac
+
+
+def check_param_keys(source, version, new_version):
+    """Checks that both versions have the same parameters
+    """
+    keys = mcmc_versions.get_parameter(source, version, 'param_keys')
+    new_keys = mcmc_versions.get_parameter(source, new_version, 'param_keys')
+
+    if list(keys) != list(new_keys):
+        raise ValueError(f'param_keys of version {new_version} ({new_keys}) do not '
+                         f'match those of version {version} ({keys}). Can only '
+                         'reweight between versions that change the priors')
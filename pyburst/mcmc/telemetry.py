@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+import json
+import time
+import resource
+
+# =============================================================================
+# Telemetry of a running mcmc, as an append-only JSON-lines file
+#
+# One record (line) is written every `interval` seconds of sampling, with the
+# throughput, acceptance and rejection rates over that interval:
+#   time              : unix time of record
+#   step              : total steps done
+#   steps_per_s       : steps per second
+#   evals_per_s       : likelihood evaluations per second
+#   frac_prior        : fraction of evaluations outside the prior bounds
+#   frac_interp       : fraction of evaluations outside the interpolator grid
+#   acceptance        : fraction of proposals accepted
+#   best_lnprob       : best lnprob so far (of this run)
+#   peak_rss_mb       : peak memory (RSS) of this process, and of its
+#   peak_rss_children_mb  finished child processes
+#
+# Evaluation counts come from the BurstFit counters. With n_threads > 1,
+# the sampler's pool adds its workers' evaluations to them (see
+# BurstFit.count_evals). Without a bfit, frac_prior/frac_interp are null,
+# and evals_per_s assumes n_walkers per step
+# =============================================================================
+
+
+class Telemetry:
+    """Writes per-interval sampler metrics to a JSON-lines file
+
+    parameters
+    ----------
+    filepath : str
+    interval : float
+        seconds between records
+    step : int
+        steps already done (e.g. when restarting)
+    bfit : BurstFit (optional)
+        whose evaluation counters to report
+    """
+
+    def __init__(self, filepath, interval=60, step=0, bfit=None):
+        self.filepath = filepath
+        self.interval = interval
+        self.step = step
+        self.bfit = bfit
+        self.best_lnprob = -np.inf
+        self.last = None
+
+    def __repr__(self):
+        return (f'Telemetry: {self.filepath}'
+                + f'\ninterval : {self.interval} s'
+                + f'\nstep     : {self.step}')
+
+    def start(self, sampler):
+        """Marks start of an interval
+        """
+        self.last = {'time': time.time(),
+                     'step': self.step,
+                     'naccepted': np.array(sampler.naccepted),
+                     'counts': self.get_counts(),
+                     }
+
+    def update(self, sampler, lnprob):
+        """Records a step of sampler, writing a record if interval has passed
+
+        lnprob : 1darray
+            lnprob of walkers at this step
+        """
+        if self.last is None:
+            self.start(sampler)
+
+        self.step += 1
+        self.best_lnprob = max(self.best_lnprob, np.max(lnprob))
+
+        if time.time() - self.last['time'] >= self.interval:
+            self.write(sampler)
+
+    def write(self, sampler):
+        """Writes record of the current interval, and starts a new one
+        """
+        if (self.last is None) or (self.step == self.last['step']):
+            return
+
+        record = self.get_record(sampler)
+        with open(self.filepath, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.start(sampler)
+
+    def get_record(self, sampler):
+        """Returns record (dict) of the current interval
+        """
+        now = time.time()
+        dt = now - self.last['time']
+        n_steps = self.step - self.last['step']
+        n_walkers = len(sampler.naccepted)
+
+        naccepted = np.array(sampler.naccepted) - self.last['naccepted']
+        n_evals = n_walkers * n_steps
+        frac_prior = None
+        frac_interp = None
+
+        counts = self.get_counts()
+        if counts is not None:
+            d_counts = counts - self.last['counts']
+            if d_counts[0] > 0:
+                n_evals = int(d_counts[0])
+                frac_prior = d_counts[1] / d_counts[0]
+                frac_interp = d_counts[2] / d_counts[0]
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        return {'time': round(now, 3),
+                'step': self.step,
+                'steps_per_s': n_steps / dt,
+                'evals_per_s': n_evals / dt,
+                'frac_prior': frac_prior,
+                'frac_interp': frac_interp,
+                'acceptance': np.sum(naccepted) / (n_walkers * n_steps),
+                'best_lnprob': float(self.best_lnprob),
+                'peak_rss_mb': get_rss_mb(usage.ru_maxrss),
+                'peak_rss_children_mb': get_rss_mb(usage_children.ru_maxrss),
+                }
+
+    def get_counts(self):
+        """Returns evaluation counters of bfit (None if not available)
+        """
+        if self.bfit is None:
+            return None
+        return np.array([self.bfit.n_evals, self.bfit.n_rejected_prior,
+                         self.bfit.n_rejected_interp])
+
+
+def get_rss_mb(maxrss):
+    """Returns ru_maxrss in MB (which is in kB on Linux, bytes on macOS)
+    """
+    if sys.platform == 'darwin':
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+def read_telemetry(filepath):
+    """Returns all telemetry records as a DataFrame
+
+    A partially-written final line (of a running job) is skipped
+    """
+    records = []
+    with open(filepath, 'r') as f:
+        for line in f:
+            try:
+                records += [json.loads(line)]
+            except json.JSONDecodeError:
+                break
+
+    return pd.DataFrame(records)
+
+
+def tail_telemetry(filepath, n=10, follow=False, poll=5):
+    """Prints the last n records of a telemetry file
+
+    follow : bool
+        keep printing new records as they are written (until interrupted)
+    poll : float
+        seconds between checks for new records
+    """
+    table = read_telemetry(filepath)
+    print_records(table.tail(n), header=True)
+    n_read = len(table)
+
+    while follow:
+        time.sleep(poll)
+        if not os.path.exists(filepath):
+            continue
+
+        table = read_telemetry(filepath)
+        if len(table) > n_read:
+            print_records(table.iloc[n_read:], header=False)
+            n_read = len(table)
+
+
+def print_records(table, header=True):
+    """Prints telemetry records as aligned columns
+    """
+    if len(table) == 0:
+        return
+
+    table = table.copy()
+    table['time'] = pd.to_datetime(table['time'], unit='s').dt.strftime('%m-%d %H:%M:%S')
+    string = table.to_string(index=False, header=header, float_format='{:.4g}'.format)
+    print(string)
@@ -1,4 +1,5 @@
 from . import pyprint
+from . import binary_file
 from . import misc
 from . import temp
 from . import mcmc_test
@@ -9,6 +10,7 @@ from . import anisotropy_tools
 from . import alpha
 
 __all__ = ['pyprint',
+           'binary_file',
            'misc',
            'temp',
            'mcmc_test',
@@ -0,0 +1,139 @@
+import numpy as np
+import os
+import json
+
+# =============================================================================
+# Self-describing binary files: a JSON header, followed by raw arrays
+#
+# Layout:
+#   - a single line of JSON (the header), padded with spaces to a multiple of
+#     ALIGN bytes. Holds the file format and format_version, any fields
+#     specific to the format, and the name, dtype, shape and offset
+#     (from the end of the header) of each array
+#   - each array as raw (C-order) bytes, starting on a multiple of ALIGN bytes
+#
+# Arrays are memory-mapped on load, so opening a file costs the same for any
+# size of array. Formats: interpolator/emulator_file.py, burst_analyser/lum_file.py
+# =============================================================================
+ALIGN = 64
+
+
+def save(filepath, header, arrays):
+    """Saves header and arrays to file (atomically, replacing any existing file)
+
+    parameters
+    ----------
+    filepath : str
+    header : dict
+        must contain 'format' and 'format_version'. Must be JSON-serialisable
+        (numpy scalars/arrays allowed). The layout of arrays is added as 'arrays'
+    arrays : {name: ndarray}
+    """
+    header = dict(header, arrays=[])
+    offset = 0
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        header['arrays'] += [[name, array.dtype.str, list(array.shape), offset]]
+        offset = get_aligned(offset + array.nbytes)
+
+    header_str = json.dumps(header, default=to_builtin).encode()
+    header_size = get_aligned(len(header_str) + 1)
+
+    tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(header_str.ljust(header_size - 1) + b'\n')
+        for name, array in arrays.items():
+            f.seek(header_size + get_offset(header, name))
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(header_size + offset)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_filepath, filepath)
+
+
+def load(filepath, fmt, fmt_version, mmap=True):
+    """Returns header (dict) and arrays (dict of read-only ndarray) from file
+
+    parameters
+    ----------
+    filepath : str
+    fmt : str
+        expected file format
+    fmt_version : int
+        newest supported format_version
+    mmap : bool
+        memory-map arrays (instead of reading them into memory)
+    """
+    header, header_size = load_header(filepath, fmt=fmt, fmt_version=fmt_version)
+    file_size = os.path.getsize(filepath)
+    arrays = {}
+
+    for name, dtype, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        count = int(np.prod(shape))
+
+        if header_size + offset + count * dtype.itemsize > file_size:
+            raise ValueError(f'Truncated {fmt} file: {filepath}')
+
+        if mmap and count > 0:
+            arrays[name] = np.memmap(filepath, dtype=dtype, mode='r', shape=shape,
+                                     offset=header_size + offset)
+        else:
+            with open(filepath, 'rb') as f:
+                f.seek(header_size + offset)
+                arrays[name] = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+
+    return header, arrays
+
+
+def load_header(filepath, fmt, fmt_version):
+    """Returns header (dict), and its size in bytes
+
+    parameters
+    ----------
+    filepath : str
+    fmt : str
+        expected file format
+    fmt_version : int
+        newest supported format_version
+    """
+    with open(filepath, 'rb') as f:
+        line = f.readline()
+
+    try:
+        header = json.loads(line.decode())
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError(f'Not a {fmt} file: {filepath}')
+
+    if (not isinstance(header, dict)) or (header.get('format') != fmt):
+        raise ValueError(f'Not a {fmt} file: {filepath}')
+    if header['format_version'] > fmt_version:
+        raise ValueError(f"{fmt} file format_version ({header['format_version']}) "
+                         f"is newer than supported ({fmt_version})")
+
+    return header, len(line)
+
+
+def get_offset(header, name):
+    for array_name, dtype, shape, offset in header['arrays']:
+        if array_name == name:
+            return offset
+    raise ValueError(f"No array '{name}' in header")
+
+
+def get_aligned(n_bytes):
+    """Returns n_bytes rounded up to multiple of ALIGN
+    """
+    return -(-n_bytes // ALIGN) * ALIGN
+
+
+def to_builtin(obj):
+    """Converts numpy types for JSON
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
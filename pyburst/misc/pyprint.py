@@ -1,4 +1,7 @@
 import os
+import time
+import functools
+import pandas as pd
 
 # ========================================================
 # Miscellaneous printing functions
@@ -30,6 +33,90 @@ class Debugger:
         if self.debug:
             self.indent.print_(string)
 
+    def trace(self, func, name=None):
+        """Returns func wrapped to print its name, arguments, and return value
+
+        Used to add tracing to a method only when debugging, so the method
+        itself has no debugging overhead
+        """
+        name = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.start_function(name)
+            for i, arg in enumerate(args):
+                self.variable(f'arg{i}', arg, formatter='')
+            for key, val in kwargs.items():
+                self.variable(key, val, formatter='')
+
+            out = func(*args, **kwargs)
+            self.variable('return', out, formatter='')
+            self.end_function()
+            return out
+        return wrapper
+
+
+class Profiler:
+    """Records cumulative wall time and number of calls of named stages
+
+    Stages are timed by wrapping functions with wrap(). Nested calls of the
+    same stage are only timed once (by the outermost call)
+    """
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        self.depth = {}
+        self.n_samples = 0
+
+    def wrap(self, func, stage, count_samples=None):
+        """Returns func wrapped to add its wall time and calls to stage
+
+        count_samples : function (optional)
+            returns number of samples evaluated by a call, from the call's
+            arguments. Each sample is one set of parameters (e.g. one walker)
+        """
+        for attr in (self.times, self.calls, self.depth):
+            attr.setdefault(stage, 0)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.depth[stage] > 0:
+                return func(*args, **kwargs)
+
+            self.depth[stage] += 1
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[stage] += time.perf_counter() - t0
+                self.calls[stage] += 1
+                self.depth[stage] -= 1
+                if count_samples is not None:
+                    self.n_samples += count_samples(*args, **kwargs)
+        return wrapper
+
+    def reset(self):
+        for stage in self.times:
+            self.times[stage] = 0
+            self.calls[stage] = 0
+        self.n_samples = 0
+
+    def get_table(self):
+        """Returns table (DataFrame) of time spent in each stage
+        """
+        table = pd.DataFrame({'stage': list(self.times)})
+        table['calls'] = [self.calls[stage] for stage in table['stage']]
+        table['time'] = [self.times[stage] for stage in table['stage']]
+        table['us_per_call'] = 1e6 * table['time'] / table['calls'].clip(lower=1)
+        table['us_per_sample'] = 1e6 * table['time'] / max(self.n_samples, 1)
+        return table
+
+    def print_table(self):
+        print_dashes()
+        print(f'Profile of {self.n_samples} samples (times in seconds/microseconds)')
+        print_dashes()
+        print(self.get_table().to_string(index=False, float_format='{:.4g}'.format))
+
 
 class Indenter:
     def __init__(self):
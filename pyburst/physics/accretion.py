@@ -2,19 +2,23 @@ import numpy as np
 from astropy import units
 import astropy.constants as const
 
+# Eddington luminosity (erg / s) per solar mass, for pure hydrogen
+l_edd_msun = (4*np.pi * const.G * units.M_sun * const.m_p * const.c
+              / const.sigma_T).to(units.erg / units.s).value
+
+
 def eddington_lum(mass, x):
     """Returns the spherical Eddington luminosity for a given solar mass and composition
        (erg / s)
 
     Parameters
     ----------
-    mass : flt
+    mass : flt|ndarray
         solar mass (M_sun)
-    x : flt
+    x : flt|ndarray
         hydrogen composition (mass fraction)
     """
-    l_edd = 4*np.pi * const.G * (mass*units.M_sun) * const.m_p * const.c / const.sigma_T
-    l_edd = l_edd.to(units.erg / units.s).value   # cgs units
+    l_edd = l_edd_msun * mass
     l_edd = l_edd * 2 / (x + 1)  # correct for hydrogen/helium ratio
 
     return l_edd
@@ -1,6 +1,9 @@
 import numpy as np
 import astropy.units as units
 
+km_to_cm = units.km.to(units.cm)
+accrate_edd = 1.75e-8 * units.M_sun.to(units.g) / units.year.to(units.s)  # (g/s)
+
 
 def predict_qnuc(accrate, x0, z, dt, radius=10):
     xbar = get_xbar(accrate, x0=x0, z=z, dt=dt, radius=radius)
@@ -46,7 +49,7 @@ def get_y_ignition(dt, accrate, radius=10):
     radius : float
         radius of neutron star (km)
     """
-    r_cm = radius * units.km.to(units.cm)
+    r_cm = radius * km_to_cm
     accrate_gram_sec = convert_accrate(accrate)
     return (dt * accrate_gram_sec) / (4 * np.pi * r_cm**2)
 
@@ -54,5 +57,4 @@ def get_y_ignition(dt, accrate, radius=10):
 def convert_accrate(accrate):
     """Returns accrate in g/s, when given as Eddington fraction
     """
-    accrate_edd = 1.75e-8 * units.M_sun.to(units.g) / units.year.to(units.s)
     return accrate * accrate_edd
@@ -2,16 +2,26 @@ import matplotlib.pyplot as plt
 import numpy as np
 import astropy.units as u
 import astropy.constants as const
-from scipy.optimize import brentq
 
 # kepler_grids
-from pyburst.misc.pyprint import print_title, print_dashes
+from pyburst.misc.pyprint import print_title, print_dashes, print_warning
 
 # Constants in cgs units
 G = const.G.to(u.cm**3/(u.g*u.s**2))
 c = const.c.to(u.cm/u.s)
 Msun = const.M_sun.to(u.g)
 
+# Plain float values of constants, for the unit-free (*_raw) functions
+G_cgs = G.value
+c_cgs = c.value
+Msun_g = Msun.value
+km_to_cm = 1e5
+
+# NOTE: Functions with the suffix "_raw" take and return plain floats/arrays
+#       (radius in km, mass in Msun, everything else cgs), and broadcast over
+#       arrays of any shape. The equivalent functions without the suffix are
+#       wrappers that apply astropy units.
+
 # TODO: allow flexibility with parsing units, e.g. check_units()
 # TODO: inverse redshift
 
@@ -31,18 +41,33 @@ def get_redshift(r, m):
     return 1 / np.sqrt(1 - 2*zeta)
 
 
+def get_redshift_raw(r, m):
+    """Returns redshift (1+z) for given radius (km) and mass (Msun), without units
+
+    Returns NaN where zeta >= 0.5 (see get_zeta)
+    """
+    zeta = get_zeta_raw(r=r, m=m)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 1 / np.sqrt(1 - 2*zeta)
+
+
 def get_zeta(r, m):
     """Returns zeta factor (GM/Rc^2) for given radius and mass
     """
-    r_u, m_u = apply_units(r=r, m=m)
-    zeta = (G * m_u) / (r_u * c**2)
+    zeta = get_zeta_raw(r=r, m=m)
 
-    if True in zeta >= 0.5:
-        raise ValueError(f'R, M ({r:.2f}, {m:.2f}) returns zeta >= 0.5')
+    if np.any(zeta >= 0.5):
+        raise ValueError(f'R, M ({r}, {m}) returns zeta >= 0.5')
 
     return np.array(zeta)
 
 
+def get_zeta_raw(r, m):
+    """Returns zeta factor (GM/Rc^2) for given radius (km) and mass (Msun)
+    """
+    return (G_cgs * m * Msun_g) / (r * km_to_cm * c_cgs**2)
+
+
 def get_mass_radius(g, redshift):
     """Return GR mass and radius for given gravity and redshift
 
@@ -54,28 +79,50 @@ def get_mass_radius(g, redshift):
     return m, r
 
 
+def get_mass_radius_raw(g, redshift):
+    """Return GR mass (Msun) and radius (km) for given gravity (cm/s^2) and redshift
+    """
+    r = radius_raw(g=g, redshift=redshift)
+    m = mass_raw(g=g, redshift=redshift)
+    return m, r
+
+
 def radius(g, redshift):
     """Return GR NS radius for given gravity and redshift
              Eq. B24, Keek & Heger (2011)
 
-        g : gravitational acceleration
+        g : gravitational acceleration (assumed cm/s^2 if no units)
         redshift : (1+z) redshift factor
         """
+    g = u.Quantity(g, u.cm/u.s**2).value
+    return radius_raw(g=g, redshift=redshift) * u.km
+
+
+def radius_raw(g, redshift):
+    """Return GR NS radius (km) for given gravity (cm/s^2) and redshift
+    """
     z = redshift - 1
-    r_u = (c ** 2 * z * (z + 2)) / (2 * g * redshift)
-    return r_u.to(u.km)
+    r = (c_cgs**2 * z * (z + 2)) / (2 * g * redshift)
+    return r / km_to_cm
 
 
 def mass(g, redshift):
     """Return GR NS mass for given gravity and redshift
          Eq. B24, Keek & Heger (2011)
 
-    g : gravitational acceleration
+    g : gravitational acceleration (assumed cm/s^2 if no units)
     redshift : (1+z) redshift factor
     """
+    g = u.Quantity(g, u.cm/u.s**2).value
+    return mass_raw(g=g, redshift=redshift) * u.M_sun
+
+
+def mass_raw(g, redshift):
+    """Return GR NS mass (Msun) for given gravity (cm/s^2) and redshift
+    """
     z = redshift - 1
-    m_u = (c ** 4 * z ** 2 * (z + 2) ** 2) / (4 * G * g * redshift ** 3)
-    return m_u.to(u.M_sun)
+    m = (c_cgs**4 * z**2 * (z + 2)**2) / (4 * G_cgs * g * redshift**3)
+    return m / Msun_g
 
 
 def get_accelerations(r, m):
@@ -89,9 +136,13 @@ def get_accelerations(r, m):
 def get_acceleration_newtonian(r, m):
     """Returns gravitational accelerations (Newtonian), given R and M
     """
-    r_u, m_u = apply_units(r=r, m=m)
-    g_newton = G*m_u/r_u**2
-    return g_newton
+    return get_acceleration_newtonian_raw(r=r, m=m) * u.cm/u.s**2
+
+
+def get_acceleration_newtonian_raw(r, m):
+    """Returns Newtonian gravitational acceleration (cm/s^2), given R (km) and M (Msun)
+    """
+    return G_cgs * m * Msun_g / (r * km_to_cm)**2
 
 
 def get_acceleration_gr(r, m):
@@ -105,34 +156,89 @@ def get_acceleration_gr(r, m):
 
 def inverse_acceleration(g, m=None, r=None):
     """Returns R or M, given g and one of R or M
-    """
-    def root(r_root, m_root, g_root):
-        return get_acceleration_gr(r=r_root, m=m_root).value - g_root.value
 
+    Solves g = get_acceleration_gr(r, m) for every point at once. Writing
+    x = 2GM/(Rc^2), the GR acceleration is:
+        g = c^2 x / (2R sqrt(1-x)) = c^4 x^2 / (4GM sqrt(1-x))
+    which, for given R, is a quadratic in x (solved exactly), and for given M
+    is a quartic in x (solved numerically, see solve_compactness)
+
+    parameters
+    ----------
+    g : flt|ndarray
+        GR gravitational acceleration (1e14 cm/s^2)
+    m : flt|ndarray (optional)
+        mass (Msun). If provided, returns radius (km)
+    r : flt|ndarray (optional)
+        radius (km). If provided, returns mass (Msun)
+    """
     if (m is None) and (r is None):
-        print('ERROR: need to specify one of m or r')
+        raise ValueError('Need to specify one of m or r')
     if (m is not None) and (r is not None):
-        print('Error: can only specify one of m or r')
+        raise ValueError('Can only specify one of m or r')
 
-    g *= 1e14 * u.cm/u.s/u.s
+    g = 1e14 * np.asarray(g, dtype=float)
 
     if r is None:
-        r = brentq(root, 6, 50, args=(m, g))
-        return r
+        gm = G_cgs * Msun_g * np.asarray(m, dtype=float)
+        k = (4 * gm * g / c_cgs**4)**2
+        x = solve_compactness(k)
+        return 2 * gm / (x * c_cgs**2) / km_to_cm
+    else:
+        r_cm = km_to_cm * np.asarray(r, dtype=float)
+        a = (2 * g * r_cm / c_cgs**2)**2
+        x = 2 * a / (a + np.sqrt(a**2 + 4*a))  # root of x^2 + ax - a = 0
+        return x * r_cm * c_cgs**2 / (2 * G_cgs) / Msun_g
+
+
+def solve_compactness(k, tol=1e-13, max_iter=100):
+    """Returns root x in (0, 1) of x^4 + kx - k = 0, for an array of k > 0
+
+    Uses Newton's method, falling back on bisection of the bracketing interval
+    whenever a Newton step leaves it. Starting from x = min(k^(1/4), 1), which is
+    always above the root, the steps decrease monotonically (f is convex).
+    Points that have not converged after max_iter iterations are returned as NaN
+    """
+    k = np.asarray(k, dtype=float)
+    lower = np.zeros_like(k)
+    upper = np.ones_like(k)
+    x = np.minimum(k**0.25, 1.0)
+    converged = np.zeros(k.shape, dtype=bool)
+
+    for i in range(max_iter):
+        f = x**4 + k*x - k
+        lower = np.where(f < 0, x, lower)
+        upper = np.where(f > 0, x, upper)
+
+        step = f / (4*x**3 + k)
+        converged = converged | (np.abs(step) <= tol * x)
+
+        x_new = x - step
+        outside = (x_new <= lower) | (x_new >= upper)
+        x_new = np.where(outside, 0.5 * (lower + upper), x_new)
+        x = np.where(converged, x - step, x_new)
+
+        if converged.all():
+            break
+
+    invalid = np.invert(converged) | np.invert(k > 0)
+    if invalid.any():
+        print_warning(f'{invalid.sum()} point(s) failed to converge in solve_compactness')
+        x = np.where(invalid, np.nan, x)
+
+    return x
+
 
 def plot_g():
     """Plots g=constant curves against R, M
     """
     g_list = [1.06, 1.33, 2.1, 2.66, 3.45, 4.25]
     m_list = np.linspace(1, 2, 50)
-    r_list = np.zeros(50)
 
     fig, ax = plt.subplots()
 
     for g in g_list:
-        for i, m in enumerate(m_list):
-            r_list[i] = inverse_acceleration(g=g, m=m)
-
+        r_list = inverse_acceleration(g=g, m=m_list)
         ax.plot(m_list, r_list, label=f'{g:.2f}')
 
     ax.set_xlabel('Mass (Msun)')
@@ -157,17 +263,31 @@ def gr_corrections(r, m, phi=1.0, verbose=False):
     verbose : bool
     """
     zeta = get_zeta(r=r, m=m)
+    xi, redshift = gr_correction_factors(zeta=zeta, phi=phi)
+
+    if verbose:
+        print_title(f'Using R={r:.3f}, M={m}, M_GR={m*phi}:')
+        print(f'    R_GR = {r*xi:.2f} km')
+        print(f'(1+z)_GR = {redshift:.3f}')
+    return xi, redshift
+
 
+def gr_correction_factors(zeta, phi=1.0):
+    """Returns GR correction factors (xi, 1+z) given zeta (GM/Rc^2) of Newtonian R, M
+        Unit-free core of gr_corrections()
+
+    parameters
+    ----------
+    zeta : flt|ndarray
+        GM/Rc^2 of the Newtonian mass and radius
+    phi : flt|ndarray
+        Ratio of GR mass to Newtonian mass: M_GR / M_NW
+    """
     b = (9*zeta**2*phi**4 + np.sqrt(3)*phi**3 * np.sqrt(16 + 27*zeta**4 * phi**2))**(1/3)
     a = (2/9)**(1/3) * (b**2 / phi**2 - 2 * 6**(1/3)) / (b * zeta**2)
     xi = (zeta * phi/2) * (1 + np.sqrt(1 - a) + np.sqrt(2 + a + 2 / np.sqrt(1 - a)))
 
     redshift = xi**2/phi    # NOTE: xi is unrelated to anisotropy factors xi_b, xi_p
-
-    if verbose:
-        print_title(f'Using R={r:.3f}, M={m}, M_GR={m*phi}:')
-        print(f'    R_GR = {r*xi:.2f} km')
-        print(f'(1+z)_GR = {redshift:.3f}')
     return xi, redshift
 
 
@@ -1,6 +1,9 @@
 # kepler_grids
 from pyburst.mcmc import mcmc
 from pyburst.mcmc import mcmc_tools
+from pyburst.mcmc import burstfit
+from pyburst.mcmc import autocorr as mcmc_autocorr
+from pyburst.mcmc import telemetry as mcmc_telemetry
 
 import numpy as np
 import sys
@@ -15,6 +18,44 @@ import time
 print('=' * 30)
 GRIDS_PATH = os.environ['KEPLER_GRIDS']
 nparams = 6
+
+# ===== convergence =====
+# Set n_tau (e.g. 50) to stop early once the chain (after burn-in) is longer
+# than n_tau autocorrelation times (checked every autocorr_every steps).
+# By default (None), always does n_steps
+n_tau = None
+autocorr_every = 100
+burn_factor = 2  # recommended burn-in saved to checkpoint, as burn_factor * tau
+
+# ===== derived quantities =====
+# Save model burst properties, redshift, etc. of each sample to the chain store
+# (see BurstFit.get_blob_fields). On restart, follows the existing chain store
+save_blobs = True
+
+# ===== telemetry =====
+# Append sampler metrics (throughput, acceptance, rejections, memory) to
+# telemetry_*.jsonl every telemetry_interval seconds.
+# Follow with: python tail_telemetry.py [source] [version] [n_walkers]
+telemetry_interval = 60
+
+# ===== parallel tempering =====
+# Run n_temps ensembles of n_walkers on a temperature ladder (mcmc.setup_sampler),
+# only saving the posterior (beta=1) ensemble. The evidence estimate
+# from thermodynamic integration is saved in the checkpoint
+n_temps = 1
+t_max = None  # default: emcee's ladder for the number of dimensions
+
+# ===== starting positions (new runs only) =====
+# Start walkers around the best of n_starts optimisations (mcmc.optimise_multistart),
+# spread according to the local curvature, instead of a small ball around
+# the version's initial_position
+multistart = False
+n_starts = 32
+
+# Or, warm-start from the (post burn-in) chain of a previous version, drawing any
+# parameters it doesn't share from the priors (mcmc.warm_start_positions)
+warm_version = None
+warm_n_walkers = None  # default: same as n_walkers
 nargs = len(sys.argv)
 
 if (nargs != nparams + 1) and (nargs != nparams + 2):
@@ -34,24 +75,106 @@ n_walkers = int(sys.argv[3])
 n_steps = int(sys.argv[4])
 n_threads = int(sys.argv[5])
 dumpstep = int(sys.argv[6])
-mcmc_path = mcmc_tools.get_mcmc_path(source)
 
 # ===== if restart =====
 if nargs == (nparams + 2):
-    restart = True
     start = int(sys.argv[7])
-    chain0 = mcmc_tools.load_chain(source=source, version=version, n_walkers=n_walkers,
-                                   n_steps=start)
-    pos = chain0[:, -1, :]
+    store_path = mcmc_tools.get_chain_store_path(source, version=version,
+                                                 n_walkers=n_walkers)
+    if not os.path.exists(store_path):
+        print('No chain store found, converting chain file')
+        mcmc_tools.convert_chain_to_store(source, version=version,
+                                          n_steps=start, n_walkers=n_walkers)
+
+    store = mcmc_tools.load_chain_store(source, version=version,
+                                        n_walkers=n_walkers, mode='a')
+    if start > store.n_steps:
+        print(f'ERROR: step0 ({start}) is beyond the last saved step ({store.n_steps})')
+        sys.exit()
+    elif start < store.n_steps:
+        print(f'Discarding saved steps beyond step0 ({start})')
+        store.truncate(start)
+
+    pos, lnprob0 = store.last_step()
+    blobs0 = store.last_blobs()
+    save_blobs = store.blob_fields is not None
+    if np.isnan(lnprob0).any():
+        lnprob0 = None
+        blobs0 = None
+
+    checkpoint_path = mcmc_tools.get_checkpoint_path(source, version=version,
+                                                     n_walkers=n_walkers)
+    checkpoint = None
+    if os.path.exists(checkpoint_path):
+        checkpoint = mcmc_tools.load_checkpoint(source, version=version,
+                                                n_walkers=n_walkers)
+        if checkpoint['n_steps'] != start:
+            print('Checkpoint does not match step0, ignoring')
+            checkpoint = None
+
+    autocorr = None
+    if checkpoint is not None:
+        autocorr = mcmc_tools.get_autocorr(checkpoint)
+    if autocorr is None:
+        print('Rebuilding autocorrelation estimate from chain store')
+        autocorr = mcmc_autocorr.AutocorrTracker(n_walkers=n_walkers, n_dim=store.n_dim,
+                                                 burn_factor=burn_factor)
+        autocorr.update_chain(store.get_chain())
 else:
-    restart = False
     start = 0
-    pos = mcmc.setup_positions(source=source, version=version, n_walkers=n_walkers)
+    if warm_version is not None:
+        pos = mcmc.setup_positions(source=source, version=version, n_walkers=n_walkers,
+                                   prev_version=warm_version,
+                                   prev_n_walkers=warm_n_walkers)
+    elif multistart:
+        params0, _ = mcmc.optimise_multistart(source, version=version, n_starts=n_starts,
+                                              n_threads=n_threads)
+        pos = mcmc.setup_positions_hessian(source, version=version, n_walkers=n_walkers,
+                                           params0=params0[0])
+    else:
+        pos = mcmc.setup_positions(source=source, version=version, n_walkers=n_walkers)
+    lnprob0 = None
+    blobs0 = None
+    checkpoint = None
+    autocorr = mcmc_autocorr.AutocorrTracker(n_walkers=n_walkers, n_dim=pos.shape[1],
+                                             burn_factor=burn_factor)
+    store = None
+
+bfit = burstfit.BurstFit(source=source, version=version, verbose=False,
+                         re_interp=False, blobs=save_blobs)
+
+if store is None:
+    blob_fields = bfit.get_blob_fields() if save_blobs else None
+    store = mcmc_tools.load_chain_store(source, version=version, n_walkers=n_walkers,
+                                        mode='a', n_dim=pos.shape[1],
+                                        blob_fields=blob_fields)
+    if store.n_steps > 0:
+        print(f'ERROR: chain store already exists with {store.n_steps} steps:'
+              f'\n\t{store.filepath}'
+              '\n\tprovide step0 to restart from it, or delete it first')
+        sys.exit()
+
+sampler = mcmc.setup_sampler(source=source, version=version, bfit=bfit,
+                             pos=pos, n_threads=n_threads, n_temps=n_temps,
+                             t_max=t_max)
+rstate = None
+accept_offset = 0
+if checkpoint is not None:
+    mcmc_tools.restore_sampler(sampler, checkpoint=checkpoint)
+    rstate = sampler.random_state
+elif start > 0:
+    accept_offset = mcmc_tools.seed_acceptance(sampler, source=source, version=version,
+                                               n_steps=start, n_walkers=n_walkers)
+
+telemetry_path = mcmc_tools.get_telemetry_path(source, version=version,
+                                               n_walkers=n_walkers)
+telemetry = mcmc_telemetry.Telemetry(telemetry_path, interval=telemetry_interval,
+                                     step=start, bfit=bfit)
+print(f'Writing telemetry to: {telemetry_path}')
 
-sampler = mcmc.setup_sampler(source=source, version=version,
-                             pos=pos, n_threads=n_threads)
 iterations = round(n_steps / dumpstep)
 t0 = time.time()
+steps_done = 0
 
 # ===== do 'dumpstep' steps at a time =====
 for i in range(iterations):
@@ -60,34 +183,48 @@ for i in range(iterations):
 
     print('-' * 30)
     print(f'Doing steps: {step0} - {step1}')
-    pos, lnprob, rstate = mcmc.run_sampler(sampler, pos=pos, n_steps=dumpstep)
+    n0 = store.n_steps
+    result = mcmc.run_sampler(sampler, pos=pos, n_steps=dumpstep,
+                              lnprob0=lnprob0, rstate0=rstate, blobs0=blobs0,
+                              store=store, autocorr=autocorr,
+                              check_every=autocorr_every, n_tau=n_tau,
+                              telemetry=telemetry)
+    pos, lnprob0, rstate = result[:3]
+    blobs0 = result[3] if save_blobs else None
+    steps_done += store.n_steps - n0
+    print(f'Saved steps to: {store.filepath}')
 
-    # ===== concatenate loaded chain to current chain =====
-    if restart:
-        save_chain = np.concatenate([chain0, sampler.chain], 1)
-    else:
-        save_chain = sampler.chain
-
-    # === save chain state ===
-    filename = mcmc_tools.get_mcmc_string(source=source, version=version, prefix='chain',
-                                          n_steps=step1, n_walkers=n_walkers, extension='.npy')
-    filepath = os.path.join(mcmc_path, filename)
-    print(f'Saving: {filepath}')
-    np.save(filepath, save_chain)
+    # ===== save sampler checkpoint =====
+    checkpoint = mcmc_tools.get_checkpoint(sampler, store=store, previous=checkpoint,
+                                           autocorr=autocorr, burn_factor=burn_factor,
+                                           accept_offset=accept_offset)
+    mcmc_tools.save_checkpoint(checkpoint, source=source, version=version,
+                               n_walkers=n_walkers)
+    print(f"Effective sample size: {checkpoint['ess']}")
+    print(f"Recommended burn-in: {checkpoint['burn_in']}")
+    if n_temps > 1:
+        print(f'Temperature ladder: {1 / sampler.betas}')
+        print(f'Swap acceptance: {sampler.tswap_acceptance_fraction}')
+        print(f"Log-evidence: {checkpoint['pt_ln_evidence']:.2f} "
+              f"+/- {checkpoint['pt_ln_evidence_err']:.2f}")
 
-    # ===== save sampler state =====
-    mcmc_tools.save_sampler_state(sampler, source=source, version=version,
-                                  n_steps=step1, n_walkers=n_walkers)
+    if autocorr.converged:
+        print(f'Converged at step {store.n_steps}, stopping')
+        break
 
+mcmc.close_pool(sampler)
 print('=' * 30)
 print('Done!')
 
 t1 = time.time()
 dt = t1 - t0
-time_per_step = dt / n_steps
-time_per_sample = dt / (n_walkers * n_steps)
-
 print(f'Total compute time: {dt:.0f} s ({dt/3600:.2f} hr)')
-print(f'Average time per step: {time_per_step:.1f} s')
-print(f'Average time per sample: {time_per_sample:.4f} s')
+
+if steps_done > 0:
+    time_per_step = dt / steps_done
+    time_per_sample = dt / (n_walkers * steps_done)
+    print(f'Average time per step: {time_per_step:.1f} s')
+    print(f'Average time per sample: {time_per_sample:.4f} s')
+else:
+    print('No steps done')
 print('=' * 30)
@@ -0,0 +1,31 @@
+import sys
+import os
+
+from pyburst.mcmc import mcmc_tools
+from pyburst.mcmc import telemetry
+# =================================================================
+# Script callable from terminal to follow the telemetry of a running mcmc
+# (see pyburst/mcmc/telemetry.py)
+# =================================================================
+n_arg = len(sys.argv)
+
+if n_arg not in (4, 5):
+    print('Must provide 3 parameters: \n\t1. [source]'
+          + '\n\t2. [version]\n\t3. [n_walkers]\n\t4. [n_lines] (optional)')
+    sys.exit()
+
+source = sys.argv[1]
+version = int(sys.argv[2])
+n_walkers = int(sys.argv[3])
+n_lines = 10 if n_arg == 4 else int(sys.argv[4])
+
+filepath = mcmc_tools.get_telemetry_path(source, version=version, n_walkers=n_walkers)
+if not os.path.exists(filepath):
+    print(f'No telemetry found: {filepath}')
+    sys.exit()
+
+print(f'Following: {filepath}')
+try:
+    telemetry.tail_telemetry(filepath, n=n_lines, follow=True)
+except KeyboardInterrupt:
+    pass